@@ -0,0 +1,59 @@
+"""
+Compare the per-bit Python loop previously used by encode_audio with the
+vectorized LSB embed, across message sizes.
+
+Run from the backend directory:
+    python benchmarks/bench_audio.py [--repeat N]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stego.audio import _embed_bits
+
+MESSAGE_SIZES = [100, 1000, 10000, 100000]
+# One minute of 44.1 kHz stereo 16-bit audio
+SAMPLE_COUNT = 44100 * 2 * 60
+
+
+def _embed_loop(samples, data):
+    bits = ''.join([format(byte, '08b') for byte in data])
+    for i, bit in enumerate(bits):
+        samples[i] = (samples[i] & ~1) | int(bit)
+
+
+def _best_of(func, samples, data, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        work = samples.copy()
+        start = time.perf_counter()
+        func(work, data)
+        best = min(best, time.perf_counter() - start)
+    return best, work
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    samples = rng.integers(-32768, 32768, SAMPLE_COUNT, dtype=np.int16)
+
+    print(f"Carrier: {SAMPLE_COUNT} int16 samples, best of {args.repeat}")
+    print(f"{'message bytes':>13} | {'loop ms':>10} | {'vectorized ms':>13} | {'speedup':>8}")
+    for size in MESSAGE_SIZES:
+        data = rng.integers(0, 256, size, dtype=np.uint8).tobytes()
+        loop_time, loop_result = _best_of(_embed_loop, samples, data, args.repeat)
+        vector_time, vector_result = _best_of(_embed_bits, samples, data, args.repeat)
+        assert np.array_equal(loop_result, vector_result)
+        print(f"{size:>13} | {loop_time * 1000:10.2f} | {vector_time * 1000:13.3f} | {loop_time / vector_time:7.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Measure decode_audio peak memory with tracemalloc for short and long WAV
+carriers holding the same message, and check that it does not grow with the
+track length.
+
+Run from the backend directory:
+    python benchmarks/bench_audio_decode.py
+"""
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import wave
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stego.audio import encode_audio, decode_audio
+
+SAMPLE_RATE = 44100
+CHANNELS = 2
+DURATIONS = [10, 60, 300]  # seconds
+MESSAGE = "benchmark message " * 500
+# Peak decode memory allowed, independent of the track length
+PEAK_BUDGET = 1024 * 1024
+
+
+def _write_carrier(path, seconds, rng):
+    samples = rng.integers(-32768, 32768, SAMPLE_RATE * CHANNELS * seconds, dtype=np.int16)
+    with wave.open(path, "wb") as wav:
+        wav.setnchannels(CHANNELS)
+        wav.setsampwidth(2)
+        wav.setframerate(SAMPLE_RATE)
+        wav.writeframes(samples.tobytes())
+
+
+def main():
+    rng = np.random.default_rng(0)
+    peaks = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for seconds in DURATIONS:
+            carrier = os.path.join(workdir, f"carrier_{seconds}.wav")
+            encoded = os.path.join(workdir, f"encoded_{seconds}.wav")
+            _write_carrier(carrier, seconds, rng)
+            encode_audio(carrier, MESSAGE, encoded)
+
+            tracemalloc.start()
+            start = time.perf_counter()
+            message = decode_audio(encoded)
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            assert message == MESSAGE
+            peaks.append((seconds, os.path.getsize(encoded), peak, elapsed))
+
+    print(f"Message size: {len(MESSAGE.encode('utf-8'))} bytes")
+    print(f"{'track s':>8} | {'file MB':>8} | {'peak KB':>8} | {'decode ms':>10}")
+    for seconds, size, peak, elapsed in peaks:
+        print(f"{seconds:>8} | {size / 1e6:8.1f} | {peak / 1024:8.1f} | {elapsed * 1000:10.2f}")
+
+    worst = max(peak for _, _, peak, _ in peaks)
+    assert worst < PEAK_BUDGET, f"decode peak {worst} bytes exceeds budget {PEAK_BUDGET}"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+Measure the end-to-end effect of payload compression: encode + decode time and
+the carrier bits touched, for images, WAV audio and lossless video, with each
+compression method available here.
+
+The message is JSON event log lines, a typical compressible payload. For audio
+and video, fewer payload bits mean fewer modified samples and fewer carrier
+frames to re-encode.
+
+Run from the backend directory (ffmpeg on PATH makes video encoding re-encode
+only the carrier frames, as in production):
+    python benchmarks/bench_compression.py [--message-kb N] [--repeat N]
+"""
+import argparse
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import wave
+
+import cv2
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stego.audio import encode_audio, decode_audio
+from stego.compression import compress
+from stego.image import encode_image, decode_image
+from stego.options import available_compressions
+from stego.video import encode_video, decode_video
+
+_EVENTS = ("login", "logout", "upload", "download", "share", "delete")
+
+
+def _message(size: int) -> str:
+    rng = random.Random(0)
+    lines = []
+    total = 0
+    while total < size:
+        line = json.dumps({
+            "id": len(lines),
+            "user": f"user{rng.randrange(500)}",
+            "event": rng.choice(_EVENTS),
+            "ts": 1700000000 + len(lines) * 7,
+            "ok": rng.random() < 0.95,
+        })
+        lines.append(line)
+        total += len(line) + 1
+    return "\n".join(lines)[:size]
+
+
+def _best_of(func, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def _carriers(workdir, message_bytes):
+    # Each carrier is sized so the uncompressed message fits with some room
+    rng = np.random.default_rng(0)
+
+    side = int((message_bytes * 8 / 3 * 1.2) ** 0.5) + 1
+    image = io.BytesIO()
+    Image.fromarray(rng.integers(0, 256, (side, side, 3), dtype=np.uint8)).save(image, format="PNG")
+
+    samples = int(message_bytes * 8 * 1.2)
+    audio = io.BytesIO()
+    with wave.open(audio, "wb") as wav:
+        wav.setnchannels(2)
+        wav.setsampwidth(2)
+        wav.setframerate(44100)
+        wav.writeframes(rng.integers(-8000, 8000, samples + samples % 2, dtype=np.int16).tobytes())
+
+    width, height = 640, 360
+    frames = int(message_bytes * 8 / (width * height * 3)) + 30
+    video_path = os.path.join(workdir, "carrier.avi")
+    writer = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*"FFV1"), 30, (width, height))
+    frame = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+    for _ in range(frames):
+        writer.write(frame)
+    writer.release()
+    return image.getvalue(), audio.getvalue(), video_path, width * height * 3
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--message-kb", type=int, default=1024)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    message = _message(args.message_kb * 1024)
+    raw = message.encode("utf-8")
+    methods = available_compressions()
+
+    # The stego functions log every step; keep the table readable
+    log, sys.stdout = sys.stdout, open(os.devnull, "w")
+    rows = []
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            image, audio, video_path, bits_per_frame = _carriers(workdir, len(raw))
+            for method in methods:
+                stored_bits = (len(compress(raw, method)) + 14) * 8
+
+                def image_round_trip():
+                    return decode_image(encode_image(image, message, None, compression=method))
+
+                def audio_round_trip():
+                    return decode_audio(encode_audio(audio, message, None, compression=method))
+
+                def video_round_trip():
+                    output = os.path.join(workdir, f"out_{method}.mkv")
+                    encode_video(video_path, message, output, mode="lossless", compression=method)
+                    return decode_video(output)
+
+                for media, round_trip, touched in (
+                    ("image", image_round_trip, f"{-(-stored_bits // 3)} px"),
+                    ("audio", audio_round_trip, f"{stored_bits} samples"),
+                    ("video", video_round_trip, f"{-(-stored_bits // bits_per_frame)} frames"),
+                ):
+                    seconds, decoded = _best_of(round_trip, args.repeat)
+                    assert decoded == message, f"{media} {method} round trip failed"
+                    rows.append((media, method, stored_bits // 8, touched, seconds))
+    finally:
+        sys.stdout.close()
+        sys.stdout = log
+
+    print(f"Message: {len(raw)} bytes of JSON lines, best of {args.repeat} encode + decode round trips")
+    print(f"{'media':>6} | {'method':>6} | {'stored bytes':>12} | {'carrier touched':>16} | {'seconds':>8} | {'vs none':>7}")
+    baseline = {media: seconds for media, method, _, _, seconds in rows if method == "none"}
+    for media, method, stored, touched, seconds in rows:
+        print(f"{media:>6} | {method:>6} | {stored:>12} | {touched:>16} | {seconds:>8.3f} | {baseline[media] / seconds:>6.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Compare the built-in numpy LSB engine against the stepic library on in-memory images.
+
+Run from the backend directory:
+    python benchmarks/bench_image.py [--message-bytes N] [--repeat N]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+import stepic
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stego.image import _embed_numpy, _extract_numpy, _extract_stepic
+
+# (label, width, height)
+SIZES = [
+    ("1 MP", 1280, 800),
+    ("12 MP", 4000, 3000),
+    ("48 MP", 8000, 6000),
+]
+
+
+def _best_of(func, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--message-bytes", type=int, default=64 * 1024)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    message = rng.integers(0, 256, args.message_bytes, dtype=np.uint8).tobytes()
+
+    print(f"Message size: {args.message_bytes} bytes, best of {args.repeat}")
+    print(f"{'size':>6} | {'engine':>6} | {'encode ms':>10} | {'decode ms':>10} | {'MB/s':>8}")
+    for label, width, height in SIZES:
+        pixels = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+        image = Image.fromarray(pixels, "RGB")
+
+        numpy_encoded = _embed_numpy(image.copy(), message)
+        stepic_encoded = stepic.encode(image, message)
+        assert _extract_numpy(numpy_encoded)[0] == message
+        assert _extract_stepic(stepic_encoded) == message
+
+        results = {
+            "numpy": (
+                # Embedding is idempotent, so the in-place write can reuse one carrier
+                _best_of(lambda: _embed_numpy(numpy_encoded, message), args.repeat),
+                _best_of(lambda: _extract_numpy(numpy_encoded), args.repeat),
+            ),
+            "stepic": (
+                _best_of(lambda: stepic.encode(image, message), args.repeat),
+                _best_of(lambda: stepic.decode(stepic_encoded), args.repeat),
+            ),
+        }
+        for engine, (encode_time, decode_time) in results.items():
+            throughput = len(message) / 1e6 / (encode_time + decode_time)
+            print(f"{label:>6} | {engine:>6} | {encode_time * 1000:10.1f} | {decode_time * 1000:10.1f} | {throughput:8.1f}")
+
+        speedup = sum(results["stepic"]) / sum(results["numpy"])
+        print(f"{label:>6} | numpy speedup: {speedup:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
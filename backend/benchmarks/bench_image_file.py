@@ -0,0 +1,104 @@
+"""
+Measure time and peak memory of hiding a large file in a PNG and extracting it
+again (stego/image_file.py).
+
+Each operation runs in a fresh process and reports its peak resident set size,
+so a copy of the payload held in memory shows up directly. Run from the backend
+directory:
+    python benchmarks/bench_image_file.py [--size-mb N] [--compare-ref GIT_REV]
+
+--compare-ref checks out an older revision into a temporary git worktree and
+measures it on the same files, e.g. --compare-ref HEAD~1.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+from PIL import Image
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the child process; prints "<seconds> <peak RSS in KiB>"
+_CHILD = """
+import resource, sys, time
+sys.path.insert(0, sys.argv[1])
+from stego.image_file import encode_image_with_file, decode_file_from_image
+started = time.perf_counter()
+if sys.argv[2] == "encode":
+    encode_image_with_file(sys.argv[3], sys.argv[4], sys.argv[5])
+elif sys.argv[2] == "decode":
+    decode_file_from_image(sys.argv[3], sys.argv[4])
+print(time.perf_counter() - started, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+
+def _run(backend_dir, *args):
+    result = subprocess.run(
+        [sys.executable, "-c", _CHILD, backend_dir, *args],
+        capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"{args[0]} failed in {backend_dir}:\n{result.stderr}")
+    seconds, peak_kib = result.stdout.split()[-2:]
+    return float(seconds), int(peak_kib) / 1024
+
+
+def _write_payload(path, size_mb):
+    block = os.urandom(1024 * 1024)
+    with open(path, "wb") as f:
+        for _ in range(size_mb):
+            f.write(block)
+
+
+def _measure(label, backend_dir, workdir, carrier, payload, size_mb):
+    encoded = os.path.join(workdir, f"{label.replace('~', '_')}_encoded.png")
+    output_dir = tempfile.mkdtemp(dir=workdir)
+    # Peak RSS of a child that only imports the module, i.e. the interpreter itself
+    _, baseline = _run(backend_dir, "none")
+    encode_seconds, encode_peak = _run(backend_dir, "encode", carrier, payload, encoded)
+    decode_seconds, decode_peak = _run(backend_dir, "decode", encoded, output_dir)
+    for name, seconds, peak in (("encode", encode_seconds, encode_peak), ("decode", decode_seconds, decode_peak)):
+        print(
+            f"{label:<10} {name}  {seconds:7.2f} s  {size_mb / seconds:8.0f} MB/s   "
+            f"peak RSS {peak:7.0f} MB (+{peak - baseline:.0f} MB over the interpreter)"
+        )
+    os.remove(encoded)
+    for name in os.listdir(output_dir):
+        os.remove(os.path.join(output_dir, name))
+    os.rmdir(output_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=int, default=1024, help="size of the hidden file")
+    parser.add_argument("--compare-ref", help="git revision to measure as well, e.g. HEAD~1")
+    parser.add_argument("--workdir", help="directory for the test files (default: system temp)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.workdir) as workdir:
+        carrier = os.path.join(workdir, "carrier.png")
+        payload = os.path.join(workdir, "payload.bin")
+        Image.new("RGB", (1280, 800), (40, 90, 160)).save(carrier)
+        _write_payload(payload, args.size_mb)
+        print(f"Hidden file: {args.size_mb} MB")
+
+        _measure("current", BACKEND_DIR, workdir, carrier, payload, args.size_mb)
+
+        if args.compare_ref:
+            repo_root = subprocess.check_output(["git", "rev-parse", "--show-toplevel"], cwd=BACKEND_DIR, text=True).strip()
+            backend_rel = os.path.relpath(BACKEND_DIR, repo_root)
+            with tempfile.TemporaryDirectory() as worktree:
+                subprocess.run(
+                    ["git", "worktree", "add", "--detach", worktree, args.compare_ref],
+                    cwd=repo_root, check=True, capture_output=True,
+                )
+                try:
+                    _measure(args.compare_ref, os.path.join(worktree, backend_rel), workdir, carrier, payload, args.size_mb)
+                finally:
+                    subprocess.run(["git", "worktree", "remove", "--force", worktree], cwd=repo_root, capture_output=True)
+
+
+if __name__ == "__main__":
+    main()
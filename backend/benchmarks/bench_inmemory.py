@@ -0,0 +1,151 @@
+"""
+Compare request latency of the in-memory and temp-file paths for image and
+audio encode/decode.
+
+Starts two uvicorn servers, one with the default IN_MEMORY_MAX_MB and one with
+IN_MEMORY_MAX_MB=0 (every request goes through temp files), so run it from the
+backend directory:
+    python benchmarks/bench_inmemory.py [--requests N]
+"""
+import argparse
+import io
+import os
+import statistics
+import subprocess
+import sys
+import time
+import wave
+
+import numpy as np
+import requests
+from PIL import Image
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _make_inputs():
+    rng = np.random.default_rng(0)
+
+    # Noise does not compress, so 820x820 RGB is a ~2 MB PNG
+    image = io.BytesIO()
+    Image.fromarray(rng.integers(0, 256, (820, 820, 3), dtype=np.uint8)).save(image, format="PNG")
+
+    # 10 s of 16-bit stereo at 44.1 kHz, ~1.7 MB
+    audio = io.BytesIO()
+    with wave.open(audio, "wb") as wav:
+        wav.setnchannels(2)
+        wav.setsampwidth(2)
+        wav.setframerate(44100)
+        wav.writeframes(rng.integers(-2000, 2000, 44100 * 10 * 2, dtype=np.int16).tobytes())
+    return image.getvalue(), audio.getvalue()
+
+
+def _start_server(port, in_memory_max_mb):
+    env = dict(os.environ, IN_MEMORY_MAX_MB=str(in_memory_max_mb))
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL,
+    )
+
+
+def _wait_for_server(base_url, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            requests.get(base_url, timeout=1)
+            return
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    raise RuntimeError("Server did not start")
+
+
+def _timed(func):
+    start = time.perf_counter()
+    response = func()
+    response.raise_for_status()
+    return time.perf_counter() - start, response
+
+
+def _measure(base_url, image, audio, count):
+    encoded_image = requests.post(
+        f"{base_url}/encode/image/direct",
+        files={"image": ("in.png", image, "image/png")},
+        data={"message": "hello"},
+    ).content
+    encoded_audio = requests.post(
+        f"{base_url}/audio/encode/direct",
+        files={"audio": ("in.wav", audio, "audio/wav")},
+        data={"message": "hello"},
+    ).content
+
+    calls = {
+        "image encode": lambda: requests.post(
+            f"{base_url}/encode/image/direct",
+            files={"image": ("in.png", image, "image/png")},
+            data={"message": "hello"},
+        ),
+        "image decode": lambda: requests.post(
+            f"{base_url}/decode/image",
+            files={"image": ("in.png", encoded_image, "image/png")},
+        ),
+        "audio encode": lambda: requests.post(
+            f"{base_url}/audio/encode/direct",
+            files={"audio": ("in.wav", audio, "audio/wav")},
+            data={"message": "hello"},
+        ),
+        "audio decode": lambda: requests.post(
+            f"{base_url}/audio/decode",
+            files={"audio": ("in.wav", encoded_audio, "audio/wav")},
+        ),
+    }
+
+    results = {}
+    for label, call in calls.items():
+        times = []
+        for _ in range(count):
+            seconds, response = _timed(call)
+            if label.endswith("decode"):
+                assert response.json()["message"] == "hello", response.text
+            times.append(seconds)
+        results[label] = sorted(times)
+    return results
+
+
+def _percentiles(times):
+    p99 = times[min(len(times) - 1, int(len(times) * 0.99))]
+    return statistics.median(times) * 1000, p99 * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--port", type=int, default=8766)
+    args = parser.parse_args()
+
+    image, audio = _make_inputs()
+    print(f"image upload {len(image) / 1e6:.1f} MB, audio upload {len(audio) / 1e6:.1f} MB, {args.requests} requests each")
+
+    results = {}
+    for label, in_memory_max_mb in (("memory", 8), ("disk", 0)):
+        base_url = f"http://127.0.0.1:{args.port}"
+        server = _start_server(args.port, in_memory_max_mb)
+        try:
+            _wait_for_server(base_url)
+            # Warm up the worker processes before measuring
+            _measure(base_url, image, audio, 2)
+            results[label] = _measure(base_url, image, audio, args.requests)
+        finally:
+            server.terminate()
+            server.wait()
+
+    print(f"{'':<14}{'memory p50':>12}{'memory p99':>12}{'disk p50':>12}{'disk p99':>12}")
+    for operation in results["memory"]:
+        memory_p50, memory_p99 = _percentiles(results["memory"][operation])
+        disk_p50, disk_p99 = _percentiles(results["disk"][operation])
+        print(f"{operation:<14}{memory_p50:10.1f}ms{memory_p99:10.1f}ms{disk_p50:10.1f}ms{disk_p99:10.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
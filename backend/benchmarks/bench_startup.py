@@ -0,0 +1,86 @@
+"""
+Measure how long a worker takes to import the app (`import main`), which is
+what every uvicorn worker start and every cold start pays before serving.
+
+S3 is pointed at an address that never answers, so any network call made at
+import shows up as a timeout rather than a fast round trip. Run it from the
+backend directory:
+    python benchmarks/bench_startup.py [--runs N] [--compare-ref GIT_REV]
+
+--compare-ref checks out an older revision into a temporary git worktree and
+measures it the same way, e.g. --compare-ref HEAD~1.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# TEST-NET-1 (RFC 5737): never routed, so connections hang until the timeout
+STARTUP_ENV = {
+    "AWS_ACCESS_KEY_ID": "testing",
+    "AWS_SECRET_ACCESS_KEY": "testing",
+    "AWS_S3_BUCKET_NAME": "stego-startup",
+    "AWS_S3_ENDPOINT_URL": "http://192.0.2.1:9",
+    "AWS_METADATA_SERVICE_TIMEOUT": "1",
+    "AWS_MAX_ATTEMPTS": "1",
+}
+
+
+def _time_import(backend_dir, timeout):
+    env = dict(os.environ, **STARTUP_ENV)
+    start = time.perf_counter()
+    try:
+        result = subprocess.run(
+            [sys.executable, "-c", "import main"],
+            cwd=backend_dir, env=env, capture_output=True, timeout=timeout,
+        )
+    except subprocess.TimeoutExpired:
+        return None
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(f"import main failed in {backend_dir}:\n{result.stderr.decode()}")
+    return elapsed
+
+
+def _measure(label, backend_dir, runs, timeout):
+    times = []
+    for _ in range(runs):
+        elapsed = _time_import(backend_dir, timeout)
+        if elapsed is None:
+            print(f"{label:<10} import did not finish within {timeout} s")
+            return
+        times.append(elapsed)
+    print(f"{label:<10} median {statistics.median(times) * 1000:8.0f} ms   min {min(times) * 1000:8.0f} ms   ({runs} runs)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--timeout", type=int, default=120, help="seconds before an import counts as hung")
+    parser.add_argument("--compare-ref", help="git revision to measure as well, e.g. HEAD~1")
+    args = parser.parse_args()
+
+    _measure("current", BACKEND_DIR, args.runs, args.timeout)
+
+    if args.compare_ref:
+        repo_root = subprocess.check_output(["git", "rev-parse", "--show-toplevel"], cwd=BACKEND_DIR, text=True).strip()
+        backend_rel = os.path.relpath(BACKEND_DIR, repo_root)
+        with tempfile.TemporaryDirectory() as worktree:
+            subprocess.run(
+                ["git", "worktree", "add", "--detach", worktree, args.compare_ref],
+                cwd=repo_root, check=True, capture_output=True,
+            )
+            try:
+                os.makedirs(os.path.join(worktree, backend_rel, "temp"), exist_ok=True)
+                _measure(args.compare_ref, os.path.join(worktree, backend_rel), args.runs, args.timeout)
+            finally:
+                subprocess.run(["git", "worktree", "remove", "--force", worktree], cwd=repo_root, capture_output=True)
+
+
+if __name__ == "__main__":
+    main()
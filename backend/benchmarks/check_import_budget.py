@@ -0,0 +1,77 @@
+"""
+Fail if importing the app gets slower than a budget or starts loading the codec
+libraries again.
+
+Runs `python -X importtime -c "import main"` a few times and takes the fastest
+run, so a busy machine does not cause false failures. The codec libraries
+(numpy, PIL, pydub, cv2, ffmpeg, stepic) and boto3 must not be imported at all:
+the routes load them on first use and main.py warms them up after startup.
+
+Run from the backend directory; exits with status 1 on a regression:
+    python benchmarks/check_import_budget.py [--budget-ms N] [--runs N]
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFERRED_MODULES = ("numpy", "PIL", "pydub", "cv2", "ffmpeg", "stepic", "boto3", "botocore")
+
+# "import time:   self [us] | cumulative | imported package"
+_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)$")
+
+
+def _import_times():
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=BACKEND_DIR, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import main failed:\n{result.stderr}")
+    times = []
+    for line in result.stderr.splitlines():
+        match = _LINE.match(line)
+        if match:
+            _, cumulative, indent, module = match.groups()
+            times.append((module, len(indent) // 2, int(cumulative)))
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("IMPORT_BUDGET_MS", "1000")))
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="heaviest direct imports of main to list")
+    args = parser.parse_args()
+
+    runs = [_import_times() for _ in range(args.runs)]
+    total_ms = [next(cumulative for module, _, cumulative in times if module == "main") / 1000 for times in runs]
+    best = min(range(args.runs), key=lambda index: total_ms[index])
+
+    # Direct imports of main are the entries one level deeper than main itself
+    heaviest = sorted(
+        ((cumulative, module) for module, depth, cumulative in runs[best] if depth == 1),
+        reverse=True,
+    )[:args.top]
+    print(f"import main: best {total_ms[best]:.0f} ms of {args.runs} runs (budget {args.budget_ms:.0f} ms)")
+    for cumulative, module in heaviest:
+        print(f"  {cumulative / 1000:8.1f} ms  {module}")
+
+    failures = []
+    loaded = sorted({module.split(".")[0] for module, _, _ in runs[best]} & set(DEFERRED_MODULES))
+    if loaded:
+        failures.append(f"deferred modules imported at startup: {', '.join(loaded)}")
+    if total_ms[best] > args.budget_ms:
+        failures.append(f"import main took {total_ms[best]:.0f} ms, over the {args.budget_ms:.0f} ms budget")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+    print("Import budget OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+Exercise the S3 upload paths against a local moto server instead of AWS:
+multipart file upload, in-memory upload_fileobj, and background uploads with
+the status endpoint. Requires moto's server mode (pip install "moto[server]").
+
+Run from the backend directory:
+    python benchmarks/check_s3_moto.py [--size-mb N]
+"""
+import argparse
+import asyncio
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import requests
+from PIL import Image
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+MOTO_PORT = 5055
+APP_PORT = 8767
+BUCKET = "stego-test"
+
+S3_ENV = {
+    "AWS_ACCESS_KEY_ID": "testing",
+    "AWS_SECRET_ACCESS_KEY": "testing",
+    "AWS_S3_BUCKET_NAME": BUCKET,
+    "AWS_S3_REGION": "us-east-1",
+    "AWS_S3_ENDPOINT_URL": f"http://127.0.0.1:{MOTO_PORT}",
+    # Smallest part size S3 accepts, so a modest file goes multipart
+    "S3_MULTIPART_THRESHOLD_MB": "5",
+    "S3_MULTIPART_CHUNKSIZE_MB": "5",
+}
+
+
+def _wait_for(url, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not start")
+
+
+def _check_in_process(size_mb):
+    from utils import s3
+
+    s3.get_s3_client().create_bucket(Bucket=BUCKET)
+
+    payload = os.urandom(size_mb * 1024 * 1024)
+    with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as f:
+        f.write(payload)
+    start = time.perf_counter()
+    url = s3.upload_file_to_s3(f.name)
+    elapsed = time.perf_counter() - start
+    os.remove(f.name)
+    response = requests.get(url)
+    etag = response.headers["ETag"]
+    assert response.content == payload, "multipart upload content mismatch"
+    assert "-" in etag, f"expected a multipart ETag, got {etag}"
+    print(f"upload_file_to_s3: {size_mb} MB in {elapsed:.2f} s, multipart ETag {etag}")
+
+    url = s3.upload_bytes_to_s3(payload, ".png")
+    assert requests.get(url).content == payload, "upload_fileobj content mismatch"
+    print("upload_bytes_to_s3: streamed from memory OK")
+
+    s3.S3_BACKGROUND_UPLOADS = True
+    body = asyncio.run(s3.upload_output(payload[:1024], ".wav"))
+    upload_id = body["status_url"].rsplit("/", 1)[1]
+    while s3.upload_status(upload_id)["state"] == "pending":
+        time.sleep(0.05)
+    assert s3.upload_status(upload_id)["state"] == "complete", s3.upload_status(upload_id)
+    assert requests.get(body["url"]).content == payload[:1024]
+    print(f"background upload: URL returned before upload, state {s3.upload_status(upload_id)['state']}")
+
+
+def _check_route():
+    image = io.BytesIO()
+    Image.fromarray(np.random.default_rng(0).integers(0, 256, (128, 128, 3), dtype=np.uint8)).save(image, format="PNG")
+
+    env = dict(os.environ, S3_BACKGROUND_UPLOADS="true")
+    # Two workers, so status requests can land on a process that did not start the upload
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(APP_PORT), "--workers", "2",
+         "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL,
+    )
+    base_url = f"http://127.0.0.1:{APP_PORT}"
+    try:
+        _wait_for(base_url)
+        body = requests.post(
+            f"{base_url}/encode/image",
+            files={"image": ("in.png", image.getvalue(), "image/png")},
+            data={"message": "background"},
+        ).json()
+        assert body.get("upload") == "pending", body
+        while True:
+            status = requests.get(f"{base_url}{body['status_url']}").json()
+            if status["state"] != "pending":
+                break
+            time.sleep(0.05)
+        assert status["state"] == "complete", status
+        decoded = requests.post(
+            f"{base_url}/decode/image",
+            files={"image": ("out.png", requests.get(body["url"]).content, "image/png")},
+        ).json()
+        assert decoded == {"message": "background"}, decoded
+        print("POST /encode/image in background mode, 2 workers: status endpoint reports complete, object decodes")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size-mb", type=int, default=24)
+    args = parser.parse_args()
+
+    os.environ.update(S3_ENV)
+    moto = subprocess.Popen(
+        [sys.executable, "-m", "moto.server", "-p", str(MOTO_PORT)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        _wait_for(S3_ENV["AWS_S3_ENDPOINT_URL"])
+        _check_in_process(args.size_mb)
+        _check_route()
+    finally:
+        moto.terminate()
+        moto.wait()
+    print("All S3 checks passed")
+
+
+if __name__ == "__main__":
+    main()
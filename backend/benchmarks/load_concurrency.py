@@ -0,0 +1,147 @@
+"""
+Load test: latency of small image encode requests and of the health check,
+measured alone and while a long video encode is running on the same server.
+
+Starts uvicorn on a local port, so run it from the backend directory:
+    python benchmarks/load_concurrency.py [--requests N] [--frames N]
+
+ffmpeg is hidden from the server's PATH unless --keep-ffmpeg is given, so the
+video request re-encodes every frame (the slowest encode path).
+"""
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+import requests
+from PIL import Image
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _make_inputs(workdir, frames):
+    rng = np.random.default_rng(0)
+    image_path = os.path.join(workdir, "small.png")
+    Image.fromarray(rng.integers(0, 256, (256, 256, 3), dtype=np.uint8)).save(image_path)
+
+    video_path = os.path.join(workdir, "long.mp4")
+    writer = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*"mp4v"), 30, (1280, 720))
+    frame = rng.integers(0, 256, (720, 1280, 3), dtype=np.uint8)
+    for _ in range(frames):
+        writer.write(frame)
+    writer.release()
+    return image_path, video_path
+
+
+def _server_env(keep_ffmpeg):
+    env = dict(os.environ)
+    if not keep_ffmpeg:
+        env["PATH"] = os.pathsep.join(
+            entry for entry in env.get("PATH", "").split(os.pathsep)
+            if not shutil.which("ffmpeg", path=entry)
+        )
+    return env
+
+
+def _wait_for_server(base_url, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            requests.get(base_url, timeout=1)
+            return
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    raise RuntimeError("Server did not start")
+
+
+def _timed(func):
+    start = time.perf_counter()
+    response = func()
+    response.raise_for_status()
+    return time.perf_counter() - start
+
+
+def _small_requests(base_url, image_path, count, concurrency):
+    def encode():
+        with open(image_path, "rb") as f:
+            return requests.post(
+                f"{base_url}/encode/image/direct",
+                files={"image": ("small.png", f, "image/png")},
+                data={"message": "hello"},
+            )
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        image_times = list(pool.map(lambda _: _timed(encode), range(count)))
+    health_times = [_timed(lambda: requests.get(base_url)) for _ in range(count)]
+    return image_times, health_times
+
+
+def _report(label, times):
+    times = sorted(times)
+    p99 = times[min(len(times) - 1, int(len(times) * 0.99))]
+    print(f"{label:<34} p50 {statistics.median(times) * 1000:8.1f} ms   p99 {p99 * 1000:8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--frames", type=int, default=600)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--keep-ffmpeg", action="store_true")
+    args = parser.parse_args()
+
+    base_url = f"http://127.0.0.1:{args.port}"
+    with tempfile.TemporaryDirectory() as workdir:
+        image_path, video_path = _make_inputs(workdir, args.frames)
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.port), "--log-level", "warning"],
+            cwd=BACKEND_DIR,
+            env=_server_env(args.keep_ffmpeg),
+            stdout=subprocess.DEVNULL,
+        )
+        try:
+            _wait_for_server(base_url)
+            # Warm up the worker processes before measuring
+            _small_requests(base_url, image_path, 4, args.concurrency)
+
+            idle_images, idle_health = _small_requests(base_url, image_path, args.requests, args.concurrency)
+
+            video_result = {}
+
+            def encode_video():
+                with open(video_path, "rb") as f:
+                    video_result["seconds"] = _timed(lambda: requests.post(
+                        f"{base_url}/video/encode/direct",
+                        files={"video": ("long.mp4", f, "video/mp4")},
+                        data={"message": "hello", "mode": "lossless"},
+                    ))
+
+            video_thread = threading.Thread(target=encode_video)
+            video_thread.start()
+            time.sleep(1)  # let the video upload finish and the encode start
+            busy_images, busy_health = _small_requests(base_url, image_path, args.requests, args.concurrency)
+            video_still_running = video_thread.is_alive()
+            video_thread.join()
+        finally:
+            server.terminate()
+            server.wait()
+
+    _report("image encode, idle", idle_images)
+    _report("image encode, during video encode", busy_images)
+    _report("health check, idle", idle_health)
+    _report("health check, during video encode", busy_health)
+    print(f"video encode took {video_result['seconds']:.1f} s"
+          f"{'' if video_still_running else ' (finished before the small requests did; raise --frames)'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,61 @@
-from fastapi import FastAPI, Request, HTTPException
+from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse
 from fastapi.exceptions import RequestValidationError
+from contextlib import asynccontextmanager
+import asyncio
+import time
 import traceback
 
-from routes import encode, decode, audio, image_file, video
+from routes import encode, decode, audio, image_file, video, artifacts, storage, capacity
+from utils import executors, scratch, cache, s3, metrics, uploads
 
 import os
 
-app = FastAPI()
+# Codec modules the routes import on first use. With STEGO_WARMUP on they are
+# loaded, and the CPU workers started, in the background once the port is open.
+STEGO_WARMUP = os.getenv("STEGO_WARMUP", "true").lower() in ("1", "true", "yes")
+WARMUP_MODULES = ("stego.image", "stego.audio", "stego.video", "stego.image_file")
+
+async def warm_up():
+    start = time.perf_counter()
+    try:
+        await executors.warm_up(WARMUP_MODULES)
+        if s3.AWS_S3_BUCKET:
+            await executors.run_io(s3.get_s3_client)
+        print(f"[INFO] Warm-up finished in {time.perf_counter() - start:.2f} s")
+    except Exception as warmup_error:
+        # Requests still work, they load what they need themselves
+        print(f"[WARNING] Warm-up failed: {warmup_error}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One writability check for the temp directory instead of a probe per request
+    scratch.init_temp_dir()
+    sweeper = asyncio.create_task(scratch.sweep_forever())
+    cache_sweeper = asyncio.create_task(cache.sweep_disk_forever()) if cache.RESULT_CACHE_DIR else None
+    warmup = asyncio.create_task(warm_up()) if STEGO_WARMUP else None
+    yield
+    sweeper.cancel()
+    if cache_sweeper is not None:
+        cache_sweeper.cancel()
+    if warmup is not None:
+        warmup.cancel()
+    # Stop the shared encode/decode process pool and I/O thread pool
+    executors.shutdown()
+
+app = FastAPI(lifespan=lifespan)
+
+# Remove each request's scratch files once its response has been sent
+app.add_middleware(scratch.ScratchCleanupMiddleware)
+
+# Per-media byte counts, latency and in-flight requests for /metrics
+app.add_middleware(metrics.MetricsMiddleware)
+
+# Reject oversized uploads before their body is buffered; inside CORS so the
+# 413 still carries the CORS headers
+app.add_middleware(uploads.RequestSizeLimitMiddleware)
 
 # CORS config
 app.add_middleware(
@@ -60,12 +106,25 @@ async def root():
             "encode": "/encode/image",
             "decode": "/decode/image",
             "audio": "/audio/encode, /audio/decode",
-            "image_file": "/image-file/encode, /image-file/decode",
+            "image_file": "/image-file/encode, /image-file/decode, /image-file/list",
             "video": "/video/encode, /video/decode",
+            "artifacts": "/artifacts/{name}",
+            "metrics": "/metrics",
+            "capacity": "/capacity",
             "docs": "/docs"
         }
     })
 
+@app.get("/cache/stats")
+async def cache_stats():
+    # Hit/miss counters of the encode/decode result cache
+    return cache.stats()
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    # Prometheus text exposition format
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/info", response_class=HTMLResponse)
 async def info_page():
     with open("static/index.html", "r") as f:
@@ -78,6 +137,9 @@ app.include_router(decode.router, prefix="/decode")
 app.include_router(audio.router, prefix="/audio")
 app.include_router(image_file.router, prefix="/image-file")
 app.include_router(video.router, prefix="/video")  # Fixed spelling: vedio → video
+app.include_router(artifacts.router, prefix="/artifacts")
+app.include_router(storage.router, prefix="/storage")
+app.include_router(capacity.router, prefix="/capacity")
 
 print("\nAPI Routes registered:")
 for route in app.routes:
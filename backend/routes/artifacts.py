@@ -0,0 +1,26 @@
+# routes/artifacts.py
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+import mimetypes
+import os
+from utils.artifacts import artifact_path, artifact_filename, ArtifactFileResponse
+
+router = APIRouter()
+
+@router.api_route("/{name}", methods=["GET", "HEAD"])
+async def get_artifact(name: str):
+    """
+    Re-fetch an encoded output served by an earlier request, in full or in part
+    (Range), for as long as the temp sweeper keeps it.
+    """
+    path = artifact_path(name)
+    if path is None:
+        print(f"[WARNING] Artifact not found or expired: {name}")
+        return JSONResponse(
+            status_code=404,
+            content={"detail": "Artifact not found or expired"}
+        )
+
+    digest = os.path.splitext(name)[0]
+    media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+    return ArtifactFileResponse(path, digest, media_type=media_type, filename=artifact_filename(name))
@@ -1,23 +1,43 @@
 # routes/audio.py
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException
-from fastapi.responses import JSONResponse, FileResponse
-import uuid
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Depends
+from fastapi.responses import JSONResponse
 import os
 import traceback
-from stego.audio import encode_audio, decode_audio
-from utils.s3 import upload_file_to_s3
+from stego.options import DEFAULT_COMPRESSION, available_compressions
+from utils.s3 import upload_output
+from utils.executors import run_cpu
+from utils.uploads import save_upload, read_upload, fits_in_memory, UploadTooLarge, UPLOAD_LIMITS
+from utils.scratch import Scratch, request_scratch
+from utils.artifacts import artifact_response, ArtifactBytesResponse
+from utils.cache import cache_key, cached_response, store, artifact_value
 
+# stego.audio (numpy, pydub) is imported inside the handlers, so the API can start
+# without loading it; main.py imports it in the background after startup
 router = APIRouter()
 
+def _wav_response(data: bytes) -> ArtifactBytesResponse:
+    # In-memory counterpart of artifact_response() for an encoded WAV
+    return ArtifactBytesResponse(data, media_type="audio/wav", filename="encoded.wav")
+
 @router.post("/encode")
 async def encode_audio_route(
     audio: UploadFile = File(...),
-    message: str = Form(...)
+    message: str = Form(...),
+    compression: str = Form(DEFAULT_COMPRESSION),
+    scratch: Scratch = Depends(request_scratch)
 ):
+    from stego.audio import encode_audio, PAYLOAD_VERSION
     try:
         # Log request info
         print(f"[INFO] Encode audio request received for file: {audio.filename}, content_type: {audio.content_type}")
-        print(f"[INFO] Message length: {len(message)}")
+        print(f"[INFO] Message length: {len(message)}, compression: {compression}")
+
+        if compression not in available_compressions():
+            print(f"[WARNING] Invalid compression: {compression}")
+            return JSONResponse(
+                status_code=400,
+                content={"detail": f"Unknown or unavailable compression '{compression}'. Available: {', '.join(available_compressions())}"}
+            )
         
         # Validate the audio file
         print(f"[INFO] Audio content type: {audio.content_type}, filename: {audio.filename}")
@@ -48,21 +68,55 @@ async def encode_audio_route(
                 content={"detail": f"Message too long. Maximum length is 10000 characters."}
             )
 
-        os.makedirs("temp", exist_ok=True)
-
-        # Check if temp directory is writable
-        try:
-            test_file = f"temp/test_{uuid.uuid4()}.txt"
-            with open(test_file, "w") as f:
-                f.write("test")
-            os.remove(test_file)
-            print(f"[INFO] Temp directory is writable")
-        except Exception as perm_error:
-            print(f"[ERROR] Temp directory permission error: {perm_error}")
-            return JSONResponse(
-                status_code=500,
-                content={"detail": f"Server configuration error: Unable to write to temp directory"}
-            )
+        # Small WAV uploads are encoded in memory and never touch the disk. An MP3
+        # decodes to a WAV output many times its size, so it goes through scratch
+        # and is served as a resumable artifact.
+        if file_ext == ".wav" and fits_in_memory(audio):
+            try:
+                data, digest = await read_upload(audio, max_bytes=UPLOAD_LIMITS["audio"])
+                print(f"[INFO] Read audio into memory, file size: {len(data)} bytes, sha256: {digest}")
+            except UploadTooLarge as too_large:
+                print(f"[WARNING] {too_large}")
+                return JSONResponse(
+                    status_code=400,
+                    content={"detail": str(too_large)}
+                )
+            
+            # The same carrier and message were uploaded before: return the earlier URL
+            key = cache_key("audio-encode-s3", compression, PAYLOAD_VERSION, digest, message)
+            cached = await cached_response(key)
+            if cached is not None:
+                return cached
+            
+            try:
+                encoded = await run_cpu(encode_audio, data, message, None, input_format=file_ext, compression=compression)
+                print(f"[INFO] Successfully encoded message in memory, output size: {len(encoded)} bytes")
+            except ValueError as value_error:
+                print(f"[ERROR] Encoding value error: {value_error}")
+                return JSONResponse(
+                    status_code=400,
+                    content={"detail": str(value_error)}
+                )
+            except Exception as encode_error:
+                print(f"[ERROR] Encoding algorithm failed: {encode_error}")
+                traceback.print_exc()
+                return JSONResponse(
+                    status_code=500,
+                    content={"detail": f"Error in encoding algorithm: {str(encode_error)}"}
+                )
+            
+            try:
+                result = await upload_output(encoded, ".wav")
+                print(f"[INFO] S3 upload {result.get('upload', 'complete')}, URL: {result['url']}")
+                # Background uploads may still fail, so only finished ones are cached
+                if result.get("upload", "complete") == "complete":
+                    await store(key, result)
+                return result
+            except Exception as s3_error:
+                print(f"[ERROR] S3 upload failed: {s3_error}")
+                # As a fallback, serve the encoded bytes directly
+                print(f"[INFO] Serving the encoded audio directly from memory")
+                return _wav_response(encoded)
 
         # Get file extension from the uploaded file
         file_ext = os.path.splitext(audio.filename.lower())[1]
@@ -70,26 +124,19 @@ async def encode_audio_route(
             file_ext = ".wav"  # Default to .wav if no extension
             
         # Generate unique paths with proper extensions
-        input_path = f"temp/{uuid.uuid4()}{file_ext}"
-        output_path = f"temp/{uuid.uuid4()}_encoded.wav"  # Output is always WAV
+        input_path = scratch.path(file_ext)
+        output_path = scratch.path("_encoded.wav")  # Output is always WAV
 
         try:
-            # Read and save the file
-            file_content = await audio.read()
-            print(f"[INFO] Read {len(file_content)} bytes from uploaded audio file")
-            
-            # Check file size
-            if len(file_content) > 25 * 1024 * 1024:  # 25 MB limit
-                print(f"[WARNING] File too large: {len(file_content)} bytes")
-                return JSONResponse(
-                    status_code=400,
-                    content={"detail": f"File too large. Maximum size is 25 MB."}
-                )
-            
-            with open(input_path, "wb") as f:
-                f.write(file_content)
-                
-            print(f"[INFO] Saved audio to {input_path}, file size: {os.path.getsize(input_path)} bytes")
+            # Stream the upload to disk, enforcing the size limit
+            size, digest = await save_upload(audio, input_path, max_bytes=UPLOAD_LIMITS["audio"])
+            print(f"[INFO] Saved audio to {input_path}, file size: {size} bytes, sha256: {digest}")
+        except UploadTooLarge as too_large:
+            print(f"[WARNING] {too_large}")
+            return JSONResponse(
+                status_code=400,
+                content={"detail": str(too_large)}
+            )
         except Exception as read_error:
             print(f"[ERROR] File read/write error: {read_error}")
             return JSONResponse(
@@ -97,6 +144,11 @@ async def encode_audio_route(
                 content={"detail": f"Error reading or writing audio file: {str(read_error)}"}
             )
 
+        key = cache_key("audio-encode-s3", compression, PAYLOAD_VERSION, digest, message)
+        cached = await cached_response(key)
+        if cached is not None:
+            return cached
+
         try:
             print(f"[INFO] Encoding message into audio: {input_path}")
             
@@ -122,7 +174,7 @@ async def encode_audio_route(
             
             # Proceed with encoding
             try:
-                encode_audio(input_path, message, output_path)
+                await run_cpu(encode_audio, input_path, message, output_path, compression=compression)
                 print(f"[INFO] Successfully encoded message, output file size: {os.path.getsize(output_path)} bytes")
             except ValueError as value_error:
                 print(f"[ERROR] Encoding value error: {value_error}")
@@ -160,9 +212,12 @@ async def encode_audio_route(
                 
             # Upload to S3
             try:
-                s3_url = upload_file_to_s3(output_path)
-                print(f"[INFO] Successfully uploaded to S3, URL: {s3_url}")
-                return {"url": s3_url}
+                result = await upload_output(output_path)
+                print(f"[INFO] S3 upload {result.get('upload', 'complete')}, URL: {result['url']}")
+                # Background uploads may still fail, so only finished ones are cached
+                if result.get("upload", "complete") == "complete":
+                    await store(key, result)
+                return result
             except Exception as s3_error:
                 print(f"[ERROR] S3 upload failed: {s3_error}")
                 print(f"[ERROR] Error type: {type(s3_error)}")
@@ -170,11 +225,7 @@ async def encode_audio_route(
                 
                 # As a fallback, try to serve the file directly
                 print(f"[INFO] Trying to serve the audio file directly")
-                return FileResponse(
-                    output_path,
-                    media_type="audio/wav",
-                    filename="encoded.wav"
-                )
+                return await artifact_response(output_path, media_type="audio/wav")
         except Exception as s3_error:
             print(f"[ERROR] S3 upload failed: {s3_error}")
             return JSONResponse(
@@ -193,8 +244,10 @@ async def encode_audio_route(
 
 @router.post("/decode")
 async def decode_audio_route(
-    audio: UploadFile = File(...)
+    audio: UploadFile = File(...),
+    scratch: Scratch = Depends(request_scratch)
 ):
+    from stego.audio import decode_audio, PAYLOAD_VERSION
     try:
         # Log request info
         print(f"[INFO] Decode audio request received for file: {audio.filename}, content_type: {audio.content_type}")
@@ -217,27 +270,30 @@ async def decode_audio_route(
                 content={"detail": f"Only WAV or MP3 files are supported. Please upload a file with .wav or .mp3 extension. You uploaded a file with content type: {audio.content_type} and extension: {file_ext}"}
             )
 
-        os.makedirs("temp", exist_ok=True)
-
         # Get file extension from the uploaded file
         file_ext = os.path.splitext(audio.filename.lower())[1]
         if not file_ext:
             file_ext = ".wav"  # Default to .wav if no extension
-            
-        # Generate unique path with proper extension
-        input_path = f"temp/{uuid.uuid4()}{file_ext}"
-        
-        print(f"[INFO] Using file extension: {file_ext}, input path: {input_path}")
 
         try:
-            # Read and save the file
-            file_content = await audio.read()
-            print(f"[INFO] Read {len(file_content)} bytes from uploaded audio file")
-            
-            with open(input_path, "wb") as f:
-                f.write(file_content)
-                
-            print(f"[INFO] Saved audio to {input_path}, file size: {os.path.getsize(input_path)} bytes")
+            if file_ext == ".wav" and fits_in_memory(audio):
+                # Small WAV uploads are decoded straight from memory; pydub decodes
+                # MP3 through ffmpeg and a temp file anyway
+                source, digest = await read_upload(audio, max_bytes=UPLOAD_LIMITS["audio"])
+                print(f"[INFO] Read audio into memory, file size: {len(source)} bytes, sha256: {digest}")
+            else:
+                # Generate unique path with proper extension
+                source = scratch.path(file_ext)
+                print(f"[INFO] Using file extension: {file_ext}, input path: {source}")
+                # Stream the upload to disk, enforcing the size limit
+                size, digest = await save_upload(audio, source, max_bytes=UPLOAD_LIMITS["audio"])
+                print(f"[INFO] Saved audio to {source}, file size: {size} bytes, sha256: {digest}")
+        except UploadTooLarge as too_large:
+            print(f"[WARNING] {too_large}")
+            return JSONResponse(
+                status_code=400,
+                content={"detail": str(too_large)}
+            )
         except Exception as read_error:
             print(f"[ERROR] File read/write error: {read_error}")
             return JSONResponse(
@@ -245,10 +301,17 @@ async def decode_audio_route(
                 content={"detail": f"Error reading or writing audio file: {str(read_error)}"}
             )
 
+        # The same stego audio was decoded before
+        key = cache_key("audio-decode", PAYLOAD_VERSION, digest)
+        cached = await cached_response(key)
+        if cached is not None:
+            return cached
+
         try:
-            print(f"[INFO] Decoding message from audio: {input_path}")
-            message = decode_audio(input_path)
+            print(f"[INFO] Decoding message from audio")
+            message = await run_cpu(decode_audio, source, input_format=file_ext)
             print(f"[INFO] Successfully decoded message from audio")
+            await store(key, {"message": message})
             return JSONResponse({"message": message})
         except Exception as decode_error:
             print(f"[ERROR] Decoding algorithm failed: {decode_error}")
@@ -268,16 +331,26 @@ async def decode_audio_route(
 @router.post("/encode/direct")
 async def encode_audio_direct(
     audio: UploadFile = File(...),
-    message: str = Form(...)
+    message: str = Form(...),
+    compression: str = Form(DEFAULT_COMPRESSION),
+    scratch: Scratch = Depends(request_scratch)
 ):
     """
     Encode an audio file and serve it directly without S3 upload.
     This endpoint is a fallback for when S3 is not available.
     """
+    from stego.audio import encode_audio, PAYLOAD_VERSION
     try:
         # Log request info
         print(f"[INFO] Direct encode audio request received for file: {audio.filename}, content_type: {audio.content_type}")
-        print(f"[INFO] Message length: {len(message)}")
+        print(f"[INFO] Message length: {len(message)}, compression: {compression}")
+
+        if compression not in available_compressions():
+            print(f"[WARNING] Invalid compression: {compression}")
+            return JSONResponse(
+                status_code=400,
+                content={"detail": f"Unknown or unavailable compression '{compression}'. Available: {', '.join(available_compressions())}"}
+            )
         
         # Check file extension and content type
         valid_extensions = ['.wav', '.mp3']
@@ -297,7 +370,26 @@ async def encode_audio_direct(
                 content={"detail": f"Only WAV or MP3 files are supported. Please upload a file with .wav or .mp3 extension. You uploaded a file with content type: {audio.content_type} and extension: {file_ext}"}
             )
 
-        os.makedirs("temp", exist_ok=True)
+        # Only small WAV inputs stay in memory: the WAV output of an MP3 is many
+        # times the upload size and needs a resumable artifact response
+        if file_ext == ".wav" and fits_in_memory(audio):
+            try:
+                data, digest = await read_upload(audio, max_bytes=UPLOAD_LIMITS["audio"])
+            except UploadTooLarge as too_large:
+                print(f"[WARNING] {too_large}")
+                return JSONResponse(
+                    status_code=400,
+                    content={"detail": str(too_large)}
+                )
+            print(f"[INFO] Read audio into memory, file size: {len(data)} bytes, sha256: {digest}")
+            key = cache_key("audio-encode-direct", compression, PAYLOAD_VERSION, digest, message)
+            cached = await cached_response(key)
+            if cached is not None:
+                return cached
+            encoded = await run_cpu(encode_audio, data, message, None, input_format=file_ext, compression=compression)
+            print(f"[INFO] Successfully encoded message in memory, output size: {len(encoded)} bytes")
+            await store(key, {"data": encoded, "media_type": "audio/wav", "filename": "encoded.wav"})
+            return _wav_response(encoded)
 
         # Get file extension from the uploaded file
         file_ext = os.path.splitext(audio.filename.lower())[1]
@@ -305,31 +397,36 @@ async def encode_audio_direct(
             file_ext = ".wav"  # Default to .wav if no extension
             
         # Generate unique paths with proper extensions
-        input_path = f"temp/{uuid.uuid4()}{file_ext}"
-        output_path = f"temp/{uuid.uuid4()}_encoded.wav"  # Output is always WAV
+        input_path = scratch.path(file_ext)
+        output_path = scratch.path("_encoded.wav")  # Output is always WAV
         
         print(f"[INFO] Using file extension: {file_ext}, input path: {input_path}")
 
-        # Read and save the file
-        file_content = await audio.read()
-        print(f"[INFO] Read {len(file_content)} bytes from uploaded audio file")
-        
-        with open(input_path, "wb") as f:
-            f.write(file_content)
-            
-        print(f"[INFO] Saved audio to {input_path}, file size: {os.path.getsize(input_path)} bytes")
+        # Stream the upload to disk, enforcing the size limit
+        try:
+            size, digest = await save_upload(audio, input_path, max_bytes=UPLOAD_LIMITS["audio"])
+        except UploadTooLarge as too_large:
+            print(f"[WARNING] {too_large}")
+            return JSONResponse(
+                status_code=400,
+                content={"detail": str(too_large)}
+            )
+        print(f"[INFO] Saved audio to {input_path}, file size: {size} bytes, sha256: {digest}")
+
+        key = cache_key("audio-encode-direct", compression, PAYLOAD_VERSION, digest, message)
+        cached = await cached_response(key)
+        if cached is not None:
+            return cached
 
         # Encode the message
         print(f"[INFO] Encoding message into audio: {input_path}")
-        encode_audio(input_path, message, output_path)
+        await run_cpu(encode_audio, input_path, message, output_path, compression=compression)
         print(f"[INFO] Successfully encoded message, output file size: {os.path.getsize(output_path)} bytes")
 
         # Return the file directly
-        return FileResponse(
-            output_path,
-            media_type="audio/wav",
-            filename="encoded.wav"
-        )
+        response = await artifact_response(output_path, media_type="audio/wav")
+        await store(key, artifact_value(response))
+        return response
             
     except Exception as e:
         print(f"[ERROR] Unexpected error in direct encode audio route: {e}")
@@ -0,0 +1,94 @@
+# routes/capacity.py
+from fastapi import APIRouter, UploadFile, File, Form, Depends
+from fastapi.responses import JSONResponse
+import os
+import traceback
+from stego.options import ENGINES, DEFAULT_ENGINE
+from utils.executors import run_io
+from utils.uploads import save_upload, UploadTooLarge, UPLOAD_LIMITS
+from utils.scratch import Scratch, request_scratch
+
+# Carrier extensions by media type, as accepted by the encode routes
+_MEDIA_TYPES = {
+    ".png": "image",
+    ".wav": "audio",
+    ".mp3": "audio",
+    ".mp4": "video",
+    ".avi": "video",
+    ".mov": "video",
+    ".mkv": "video",
+}
+
+router = APIRouter()
+
+@router.post("")
+async def capacity_route(
+    file: UploadFile = File(...),
+    engine: str = Form(DEFAULT_ENGINE),
+    scratch: Scratch = Depends(request_scratch)
+):
+    """
+    Largest message, in UTF-8 bytes, the carrier can hold, worked out from its
+    header so clients can check a message before sending it to an encode route.
+
+    PNG and WAV capacity is read from the first bytes of the upload, so sending
+    only the start of the file (e.g. 64 KB) is enough. MP3 capacity is an
+    estimate from the stream duration. Videos are probed from their container
+    index without decoding any frame.
+    """
+    try:
+        file_ext = os.path.splitext(os.path.basename(file.filename or "").lower())[1]
+        media = _MEDIA_TYPES.get(file_ext)
+        print(f"[INFO] Capacity request received for file: {file.filename}, media: {media}")
+
+        if media is None:
+            return JSONResponse(
+                status_code=400,
+                content={"detail": f"Unsupported file extension '{file_ext}'. Supported: {', '.join(_MEDIA_TYPES)}"}
+            )
+        if engine not in ENGINES:
+            return JSONResponse(
+                status_code=400,
+                content={"detail": f"Unknown engine '{engine}'. Supported engines: {', '.join(ENGINES)}"}
+            )
+
+        try:
+            if media == "image":
+                from stego.image import image_capacity
+                # Image.open parses the header from the spooled upload without decoding pixels
+                result = await run_io(image_capacity, file.file, engine=engine)
+            elif file_ext == ".wav":
+                from stego.audio import audio_capacity
+                result = await run_io(audio_capacity, file.file, input_format="wav")
+            else:
+                # ffprobe and OpenCV need a path to probe
+                path = scratch.path(file_ext)
+                await save_upload(file, path, max_bytes=UPLOAD_LIMITS[media])
+                if media == "audio":
+                    from stego.audio import audio_capacity
+                    result = await run_io(audio_capacity, path)
+                else:
+                    from stego.video import video_capacity
+                    result = await run_io(video_capacity, path)
+        except UploadTooLarge as too_large:
+            print(f"[WARNING] {too_large}")
+            return JSONResponse(
+                status_code=400,
+                content={"detail": str(too_large)}
+            )
+        except ValueError as invalid:
+            print(f"[WARNING] Capacity check failed: {invalid}")
+            return JSONResponse(
+                status_code=400,
+                content={"detail": str(invalid)}
+            )
+
+        print(f"[INFO] Capacity of {file.filename}: {result['capacity_bytes']} bytes")
+        return result
+    except Exception as e:
+        print(f"[ERROR] Capacity check failed: {e}")
+        traceback.print_exc()
+        return JSONResponse(
+            status_code=500,
+            content={"detail": f"Capacity check failed: {str(e)}"}
+        )
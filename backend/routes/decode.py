@@ -1,20 +1,36 @@
 # routes/decode.py
-from fastapi import APIRouter, UploadFile, File
+from fastapi import APIRouter, UploadFile, File, Form, Depends
 from fastapi.responses import JSONResponse
-from stego.image import decode_image
-import uuid
-import os
+from stego.options import ENGINES, DEFAULT_ENGINE
+from utils.executors import run_cpu
+from utils.uploads import save_upload, read_upload, fits_in_memory, UploadTooLarge, UPLOAD_LIMITS
+from utils.scratch import Scratch, request_scratch
+from utils.cache import cache_key, cached_response, store
 import traceback
 import sys
 
+# stego.image (numpy, PIL) is imported inside the handlers, so the API can start
+# without loading it; main.py imports it in the background after startup
 router = APIRouter()
 
 @router.post("/image")
-async def decode_image_route(image: UploadFile = File(...)):
+async def decode_image_route(
+    image: UploadFile = File(...),
+    engine: str = Form(DEFAULT_ENGINE),
+    scratch: Scratch = Depends(request_scratch)
+):
+    from stego.image import decode_image, PAYLOAD_VERSION
     try:
         # Log request info
         print(f"[INFO] Decode request received for file: {image.filename}, content_type: {image.content_type}, size: {image.size}")
         
+        if engine not in ENGINES:
+            print(f"[WARNING] Invalid engine: {engine}")
+            return JSONResponse(
+                status_code=400,
+                content={"detail": f"Unknown engine '{engine}'. Supported engines: {', '.join(ENGINES)}"}
+            )
+        
         # Validate the image
         if image.content_type != "image/png":
             print(f"[WARNING] Invalid content type: {image.content_type}")
@@ -23,33 +39,42 @@ async def decode_image_route(image: UploadFile = File(...)):
                 content={"detail": "Only PNG images are supported"}
             )
             
-        input_path = f"temp/{uuid.uuid4()}.png"
-        
-        # Ensure temp directory exists
-        os.makedirs("temp", exist_ok=True)
-        
         try:
-            # Read and save the file
-            file_content = await image.read()
-            print(f"[INFO] Read {len(file_content)} bytes from uploaded file")
-            
-            with open(input_path, "wb") as f:
-                f.write(file_content)
-                
-            print(f"[INFO] Saved file to {input_path}, file size: {os.path.getsize(input_path)} bytes")
+            if fits_in_memory(image):
+                # Small uploads are decoded straight from memory
+                source, digest = await read_upload(image, max_bytes=UPLOAD_LIMITS["image"])
+                print(f"[INFO] Read file into memory, file size: {len(source)} bytes, sha256: {digest}")
+            else:
+                source = scratch.path(".png")
+                # Stream the upload to disk, enforcing the size limit
+                size, digest = await save_upload(image, source, max_bytes=UPLOAD_LIMITS["image"])
+                print(f"[INFO] Saved file to {source}, file size: {size} bytes, sha256: {digest}")
+        except UploadTooLarge as too_large:
+            print(f"[WARNING] {too_large}")
+            return JSONResponse(
+                status_code=400,
+                content={"detail": str(too_large)}
+            )
         except Exception as read_error:
             print(f"[ERROR] File read/write error: {read_error}")
             raise
 
+        # The same stego image was decoded before
+        key = cache_key("image-decode", engine, PAYLOAD_VERSION, digest)
+        cached = await cached_response(key)
+        if cached is not None:
+            return cached
+
         # Decode the message
         print(f"[INFO] Attempting to decode message from image")
-        message = decode_image(input_path)
+        message = await run_cpu(decode_image, source, engine=engine)
         
         if message:
             print(f"[INFO] Successfully decoded message, length: {len(message)}")
         else:
             print(f"[WARNING] Decoded message is empty")
             
+        await store(key, {"message": message})
         return {"message": message}
     except Exception as e:
         print(f"[ERROR] Image decoding failed: {e}")
@@ -1,21 +1,54 @@
-from fastapi import APIRouter, UploadFile, Form, File
-from fastapi.responses import FileResponse, JSONResponse
-import uuid
+from fastapi import APIRouter, UploadFile, Form, File, Depends
+from fastapi.responses import JSONResponse
 import os
-from stego.image import encode_image
-from utils.s3 import upload_file_to_s3
+from stego.options import ENGINES, DEFAULT_ENGINE, DEFAULT_COMPRESSION, available_compressions
+from utils.s3 import upload_output
+from utils.executors import run_cpu
+from utils.uploads import save_upload, read_upload, fits_in_memory, UploadTooLarge, UPLOAD_LIMITS
+from utils.scratch import Scratch, request_scratch
+from utils.artifacts import artifact_response, ArtifactBytesResponse
+from utils.cache import cache_key, cached_response, store, artifact_value
 
+# stego.image (numpy, PIL) is imported inside the handlers, so the API can start
+# without loading it; main.py imports it in the background after startup
 router = APIRouter()  # ✅ THIS LINE IS REQUIRED
 
+def _png_response(data: bytes) -> ArtifactBytesResponse:
+    # In-memory counterpart of artifact_response() for an encoded PNG
+    return ArtifactBytesResponse(data, media_type="image/png", filename="encoded.png")
+
 @router.post("/image")
 async def encode_image_route(
     image: UploadFile = File(...),
-    message: str = Form(...)
+    message: str = Form(...),
+    engine: str = Form(DEFAULT_ENGINE),
+    compression: str = Form(DEFAULT_COMPRESSION),
+    scratch: Scratch = Depends(request_scratch)
 ):
+    from stego.image import encode_image, PAYLOAD_VERSION
     try:
         # Log request info
         print(f"[INFO] Encode request received for file: {image.filename}, content_type: {image.content_type}, size: {image.size}")
-        print(f"[INFO] Message length: {len(message)}")
+        print(f"[INFO] Message length: {len(message)}, engine: {engine}, compression: {compression}")
+        
+        if engine not in ENGINES:
+            print(f"[WARNING] Invalid engine: {engine}")
+            return JSONResponse(
+                status_code=400,
+                content={"detail": f"Unknown engine '{engine}'. Supported engines: {', '.join(ENGINES)}"}
+            )
+        if compression not in available_compressions():
+            print(f"[WARNING] Invalid compression: {compression}")
+            return JSONResponse(
+                status_code=400,
+                content={"detail": f"Unknown or unavailable compression '{compression}'. Available: {', '.join(available_compressions())}"}
+            )
+        if engine == "stepic" and compression != "none":
+            print(f"[WARNING] Compression {compression} requested with the stepic engine")
+            return JSONResponse(
+                status_code=400,
+                content={"detail": "Compression needs the numpy engine; stepic images have no header to record it in."}
+            )
         
         # Validate the image
         if image.content_type != "image/png":
@@ -25,21 +58,26 @@ async def encode_image_route(
                 content={"detail": f"Only PNG images are supported, received {image.content_type}"}
             )
             
-        input_path = f"temp/{uuid.uuid4()}.png"
-        output_path = f"temp/{uuid.uuid4()}_encoded.png"
-
-        # Ensure temp directory exists
-        os.makedirs("temp", exist_ok=True)
+        # Small uploads never touch the disk; larger ones go through temp files
+        in_memory = fits_in_memory(image)
 
         try:
-            # Read and save the file
-            file_content = await image.read()
-            print(f"[INFO] Read {len(file_content)} bytes from uploaded file")
-            
-            with open(input_path, "wb") as f:
-                f.write(file_content)
-                
-            print(f"[INFO] Saved file to {input_path}, file size: {os.path.getsize(input_path)} bytes")
+            if in_memory:
+                source, digest = await read_upload(image, max_bytes=UPLOAD_LIMITS["image"])
+                print(f"[INFO] Read file into memory, file size: {len(source)} bytes, sha256: {digest}")
+            else:
+                input_path = scratch.path(".png")
+                output_path = scratch.path("_encoded.png")
+                # Stream the upload to disk, enforcing the size limit
+                size, digest = await save_upload(image, input_path, max_bytes=UPLOAD_LIMITS["image"])
+                print(f"[INFO] Saved file to {input_path}, file size: {size} bytes, sha256: {digest}")
+                source = input_path
+        except UploadTooLarge as too_large:
+            print(f"[WARNING] {too_large}")
+            return JSONResponse(
+                status_code=400,
+                content={"detail": str(too_large)}
+            )
         except Exception as read_error:
             print(f"[ERROR] File read/write error: {read_error}")
             return JSONResponse(
@@ -47,10 +85,20 @@ async def encode_image_route(
                 content={"detail": f"Error reading or writing image file: {str(read_error)}"}
             )
 
+        # The same carrier and message were uploaded before: return the earlier URL
+        key = cache_key("image-encode-s3", engine, compression, PAYLOAD_VERSION, digest, message)
+        cached = await cached_response(key)
+        if cached is not None:
+            return cached
+
         try:
-            print(f"[INFO] Encoding message into image: {input_path}")
-            encode_image(input_path, message, output_path)
-            print(f"[INFO] Successfully encoded message, output file size: {os.path.getsize(output_path)} bytes")
+            print(f"[INFO] Encoding message into image ({'in memory' if in_memory else input_path})")
+            if in_memory:
+                encoded = await run_cpu(encode_image, source, message, None, engine=engine, compression=compression)
+                print(f"[INFO] Successfully encoded message, output size: {len(encoded)} bytes")
+            else:
+                await run_cpu(encode_image, source, message, output_path, engine=engine, compression=compression)
+                print(f"[INFO] Successfully encoded message, output file size: {os.path.getsize(output_path)} bytes")
         except Exception as encode_error:
             print(f"[ERROR] Encoding algorithm failed: {encode_error}")
             return JSONResponse(
@@ -58,6 +106,20 @@ async def encode_image_route(
                 content={"detail": f"Error in encoding algorithm: {str(encode_error)}"}
             )
 
+        if in_memory:
+            try:
+                result = await upload_output(encoded, ".png")
+                print(f"[INFO] S3 upload {result.get('upload', 'complete')}, URL: {result['url']}")
+                # Background uploads may still fail, so only finished ones are cached
+                if result.get("upload", "complete") == "complete":
+                    await store(key, result)
+                return result
+            except Exception as s3_error:
+                print(f"[ERROR] S3 upload failed: {s3_error}")
+                # As a fallback, serve the encoded bytes directly
+                print(f"[INFO] Serving the encoded image directly from memory")
+                return _png_response(encoded)
+
         try:
             print(f"[INFO] Uploading encoded image to S3: {output_path}")
             
@@ -79,9 +141,12 @@ async def encode_image_route(
                 
             # Upload to S3
             try:
-                s3_url = upload_file_to_s3(output_path)
-                print(f"[INFO] Successfully uploaded to S3, URL: {s3_url}")
-                return {"url": s3_url}
+                result = await upload_output(output_path)
+                print(f"[INFO] S3 upload {result.get('upload', 'complete')}, URL: {result['url']}")
+                # Background uploads may still fail, so only finished ones are cached
+                if result.get("upload", "complete") == "complete":
+                    await store(key, result)
+                return result
             except Exception as s3_error:
                 print(f"[ERROR] S3 upload failed: {s3_error}")
                 print(f"[ERROR] Error type: {type(s3_error)}")
@@ -90,11 +155,7 @@ async def encode_image_route(
                 
                 # As a fallback, try to serve the file directly
                 print(f"[INFO] Trying to serve the file directly")
-                return FileResponse(
-                    output_path,
-                    media_type="image/png",
-                    filename="encoded.png"
-                )
+                return await artifact_response(output_path, media_type="image/png")
         except Exception as s3_error:
             print(f"[ERROR] S3 upload failed: {s3_error}")
             return JSONResponse(
@@ -114,16 +175,39 @@ async def encode_image_route(
 @router.post("/image/direct")
 async def encode_image_direct(
     image: UploadFile = File(...),
-    message: str = Form(...)
+    message: str = Form(...),
+    engine: str = Form(DEFAULT_ENGINE),
+    compression: str = Form(DEFAULT_COMPRESSION),
+    scratch: Scratch = Depends(request_scratch)
 ):
     """
     Encode an image and serve it directly without S3 upload.
     This endpoint is a fallback for when S3 is not available.
     """
+    from stego.image import encode_image, PAYLOAD_VERSION
     try:
         # Log request info
         print(f"[INFO] Direct encode request received for file: {image.filename}, content_type: {image.content_type}, size: {image.size}")
-        print(f"[INFO] Message length: {len(message)}")
+        print(f"[INFO] Message length: {len(message)}, engine: {engine}, compression: {compression}")
+        
+        if engine not in ENGINES:
+            print(f"[WARNING] Invalid engine: {engine}")
+            return JSONResponse(
+                status_code=400,
+                content={"detail": f"Unknown engine '{engine}'. Supported engines: {', '.join(ENGINES)}"}
+            )
+        if compression not in available_compressions():
+            print(f"[WARNING] Invalid compression: {compression}")
+            return JSONResponse(
+                status_code=400,
+                content={"detail": f"Unknown or unavailable compression '{compression}'. Available: {', '.join(available_compressions())}"}
+            )
+        if engine == "stepic" and compression != "none":
+            print(f"[WARNING] Compression {compression} requested with the stepic engine")
+            return JSONResponse(
+                status_code=400,
+                content={"detail": "Compression needs the numpy engine; stepic images have no header to record it in."}
+            )
         
         # Validate the image
         if image.content_type != "image/png":
@@ -133,32 +217,53 @@ async def encode_image_direct(
                 content={"detail": f"Only PNG images are supported, received {image.content_type}"}
             )
             
-        input_path = f"temp/{uuid.uuid4()}.png"
-        output_path = f"temp/{uuid.uuid4()}_encoded.png"
+        if fits_in_memory(image):
+            try:
+                data, digest = await read_upload(image, max_bytes=UPLOAD_LIMITS["image"])
+            except UploadTooLarge as too_large:
+                print(f"[WARNING] {too_large}")
+                return JSONResponse(
+                    status_code=400,
+                    content={"detail": str(too_large)}
+                )
+            print(f"[INFO] Read file into memory, file size: {len(data)} bytes, sha256: {digest}")
+            key = cache_key("image-encode-direct", engine, compression, PAYLOAD_VERSION, digest, message)
+            cached = await cached_response(key)
+            if cached is not None:
+                return cached
+            encoded = await run_cpu(encode_image, data, message, None, engine=engine, compression=compression)
+            print(f"[INFO] Successfully encoded message in memory, output size: {len(encoded)} bytes")
+            await store(key, {"data": encoded, "media_type": "image/png", "filename": "encoded.png"})
+            return _png_response(encoded)
 
-        # Ensure temp directory exists
-        os.makedirs("temp", exist_ok=True)
+        input_path = scratch.path(".png")
+        output_path = scratch.path("_encoded.png")
 
-        # Read and save the file
-        file_content = await image.read()
-        print(f"[INFO] Read {len(file_content)} bytes from uploaded file")
-        
-        with open(input_path, "wb") as f:
-            f.write(file_content)
-            
-        print(f"[INFO] Saved file to {input_path}, file size: {os.path.getsize(input_path)} bytes")
+        # Stream the upload to disk, enforcing the size limit
+        try:
+            size, digest = await save_upload(image, input_path, max_bytes=UPLOAD_LIMITS["image"])
+        except UploadTooLarge as too_large:
+            print(f"[WARNING] {too_large}")
+            return JSONResponse(
+                status_code=400,
+                content={"detail": str(too_large)}
+            )
+        print(f"[INFO] Saved file to {input_path}, file size: {size} bytes, sha256: {digest}")
+
+        key = cache_key("image-encode-direct", engine, compression, PAYLOAD_VERSION, digest, message)
+        cached = await cached_response(key)
+        if cached is not None:
+            return cached
 
         # Encode the message
         print(f"[INFO] Encoding message into image: {input_path}")
-        encode_image(input_path, message, output_path)
+        await run_cpu(encode_image, input_path, message, output_path, engine=engine, compression=compression)
         print(f"[INFO] Successfully encoded message, output file size: {os.path.getsize(output_path)} bytes")
 
         # Return the file directly
-        return FileResponse(
-            output_path,
-            media_type="image/png",
-            filename="encoded.png"
-        )
+        response = await artifact_response(output_path, media_type="image/png")
+        await store(key, artifact_value(response))
+        return response
             
     except Exception as e:
         print(f"[ERROR] Unexpected error in direct encode route: {e}")
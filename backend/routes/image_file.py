@@ -1,41 +1,54 @@
 # routes/image_file.py
-from fastapi import APIRouter, UploadFile, File, HTTPException
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Depends
 from fastapi.responses import FileResponse, JSONResponse
-import uuid
+from typing import List, Optional
 import os
-import mimetypes
 import traceback
-from stego.image_file import encode_image_with_file, decode_file_from_image
-from utils.s3 import upload_file_to_s3
+from stego.options import DEFAULT_COMPRESSION, available_compressions
+from stego.image_file import encode_image_with_files, decode_file_from_image, read_file_index, PAYLOAD_VERSION
+from utils.s3 import upload_output
+from utils.executors import run_io
+from utils.uploads import save_upload, UploadTooLarge, UPLOAD_LIMITS
+from utils.scratch import Scratch, request_scratch
+from utils.artifacts import artifact_response
+from utils.cache import cache_key, cached_response, store, artifact_value
 
 router = APIRouter()
 
+
+async def _save_files(files: List[UploadFile], scratch: Scratch) -> list:
+    # Stream each file to hide to scratch; UPLOAD_LIMITS["file"] caps their total size
+    saved = []
+    remaining = UPLOAD_LIMITS["file"]
+    for upload in files:
+        path = scratch.path(f"_{os.path.basename(upload.filename)}")
+        try:
+            size, digest = await save_upload(upload, path, max_bytes=remaining)
+        except UploadTooLarge:
+            if len(files) == 1:
+                raise
+            raise UploadTooLarge(f"Files too large. Maximum total size is {UPLOAD_LIMITS['file'] // (1024 * 1024)} MB.")
+        remaining -= size
+        print(f"[INFO] Saved file to {path}, file size: {size} bytes, sha256: {digest}")
+        saved.append((path, os.path.basename(upload.filename), upload.content_type, digest))
+    return saved
+
+
 @router.post("/encode")
 async def encode_image_file_route(
     image: UploadFile = File(...),
-    file: UploadFile = File(...)
+    file: List[UploadFile] = File(...),
+    compression: str = Form(DEFAULT_COMPRESSION),
+    scratch: Scratch = Depends(request_scratch)
 ):
     try:
         # Log request info
         print(f"[INFO] Encode file-in-image request received")
         print(f"[INFO] Image: {image.filename}, content_type: {image.content_type}")
-        print(f"[INFO] File: {file.filename}, content_type: {file.content_type}, size: {file.size}")
+        for upload in file:
+            print(f"[INFO] File: {upload.filename}, content_type: {upload.content_type}, size: {upload.size}")
         
-        os.makedirs("temp", exist_ok=True)
 
-        # Check if temp directory is writable
-        try:
-            test_file = f"temp/test_{uuid.uuid4()}.txt"
-            with open(test_file, "w") as f:
-                f.write("test")
-            os.remove(test_file)
-            print(f"[INFO] Temp directory is writable")
-        except Exception as perm_error:
-            print(f"[ERROR] Temp directory permission error: {perm_error}")
-            return JSONResponse(
-                status_code=500,
-                content={"detail": f"Server configuration error: Unable to write to temp directory"}
-            )
 
         if image.content_type != "image/png":
             print(f"[WARNING] Invalid image content type: {image.content_type}")
@@ -44,25 +57,27 @@ async def encode_image_file_route(
                 content={"detail": "Only PNG images supported."}
             )
 
-        input_image_path = f"temp/{uuid.uuid4()}.png"
-        input_file_path = f"temp/{uuid.uuid4()}_{file.filename}"
-        output_path = f"temp/{uuid.uuid4()}_encoded.png"
+        if compression not in available_compressions():
+            print(f"[WARNING] Invalid compression: {compression}")
+            return JSONResponse(
+                status_code=400,
+                content={"detail": f"Unknown or unavailable compression '{compression}'. Available: {', '.join(available_compressions())}"}
+            )
+
+        input_image_path = scratch.path(".png")
+        output_path = scratch.path("_encoded.png")
 
         try:
-            # Read and save the files
-            image_content = await image.read()
-            file_content = await file.read()
-            
-            print(f"[INFO] Read {len(image_content)} bytes from uploaded image")
-            print(f"[INFO] Read {len(file_content)} bytes from uploaded file")
-            
-            with open(input_image_path, "wb") as f_img:
-                f_img.write(image_content)
-            with open(input_file_path, "wb") as f_file:
-                f_file.write(file_content)
-                
-            print(f"[INFO] Saved image to {input_image_path}, file size: {os.path.getsize(input_image_path)} bytes")
-            print(f"[INFO] Saved file to {input_file_path}, file size: {os.path.getsize(input_file_path)} bytes")
+            # Stream the uploads to disk, enforcing the size limits
+            image_size, image_digest = await save_upload(image, input_image_path, max_bytes=UPLOAD_LIMITS["image"])
+            print(f"[INFO] Saved image to {input_image_path}, file size: {image_size} bytes, sha256: {image_digest}")
+            saved = await _save_files(file, scratch)
+        except UploadTooLarge as too_large:
+            print(f"[WARNING] {too_large}")
+            return JSONResponse(
+                status_code=400,
+                content={"detail": str(too_large)}
+            )
         except Exception as read_error:
             print(f"[ERROR] File read/write error: {read_error}")
             return JSONResponse(
@@ -70,10 +85,22 @@ async def encode_image_file_route(
                 content={"detail": f"Error reading or writing files: {str(read_error)}"}
             )
 
+        # The same image and files were uploaded before: return the earlier URL
+        key = cache_key("image-file-encode-s3", compression, PAYLOAD_VERSION, image_digest, *(
+            part for _, name, content_type, digest in saved for part in (digest, name, content_type)
+        ))
+        cached = await cached_response(key)
+        if cached is not None:
+            return cached
+
         try:
-            print(f"[INFO] Encoding file into image")
-            encode_image_with_file(input_image_path, input_file_path, output_path)
-            print(f"[INFO] Successfully encoded file, output size: {os.path.getsize(output_path)} bytes")
+            print(f"[INFO] Encoding {len(saved)} file(s) into image")
+            await run_io(
+                encode_image_with_files, input_image_path,
+                [(path, name, content_type) for path, name, content_type, _ in saved], output_path,
+                compression=compression
+            )
+            print(f"[INFO] Successfully encoded files, output size: {os.path.getsize(output_path)} bytes")
         except Exception as encode_error:
             print(f"[ERROR] Encoding algorithm failed: {encode_error}")
             traceback.print_exc()
@@ -103,9 +130,12 @@ async def encode_image_file_route(
                 
             # Upload to S3
             try:
-                s3_url = upload_file_to_s3(output_path)
-                print(f"[INFO] Successfully uploaded to S3, URL: {s3_url}")
-                return {"url": s3_url}
+                result = await upload_output(output_path)
+                print(f"[INFO] S3 upload {result.get('upload', 'complete')}, URL: {result['url']}")
+                # Background uploads may still fail, so only finished ones are cached
+                if result.get("upload", "complete") == "complete":
+                    await store(key, result)
+                return result
             except Exception as s3_error:
                 print(f"[ERROR] S3 upload failed: {s3_error}")
                 print(f"[ERROR] Error type: {type(s3_error)}")
@@ -113,11 +143,7 @@ async def encode_image_file_route(
                 
                 # As a fallback, try to serve the file directly
                 print(f"[INFO] Trying to serve the file directly")
-                return FileResponse(
-                    output_path,
-                    media_type="image/png",
-                    filename="encoded.png"
-                )
+                return await artifact_response(output_path, media_type="image/png")
         except Exception as s3_error:
             print(f"[ERROR] S3 upload failed: {s3_error}")
             return JSONResponse(
@@ -136,14 +162,19 @@ async def encode_image_file_route(
 
 @router.post("/decode")
 async def decode_image_file_route(
-    image: UploadFile = File(...)
+    image: UploadFile = File(...),
+    name: Optional[str] = Form(None),
+    scratch: Scratch = Depends(request_scratch)
 ):
+    """
+    Extract a file hidden in an image. When the image holds several files,
+    `name` selects one (see /image-file/list); only that file is read.
+    """
     try:
         # Log request info
         print(f"[INFO] Decode file-from-image request received")
         print(f"[INFO] Image: {image.filename}, content_type: {image.content_type}")
         
-        os.makedirs("temp", exist_ok=True)
 
         if image.content_type != "image/png":
             print(f"[WARNING] Invalid image content type: {image.content_type}")
@@ -152,17 +183,20 @@ async def decode_image_file_route(
                 content={"detail": "Only PNG images supported."}
             )
 
-        input_image_path = f"temp/{uuid.uuid4()}.png"
+        input_image_path = scratch.path(".png")
 
         try:
-            # Read and save the image file
-            image_content = await image.read()
-            print(f"[INFO] Read {len(image_content)} bytes from uploaded image")
-            
-            with open(input_image_path, "wb") as f_img:
-                f_img.write(image_content)
-                
-            print(f"[INFO] Saved image to {input_image_path}, file size: {os.path.getsize(input_image_path)} bytes")
+            # Stream the upload to disk; it carries both the image and the hidden file
+            image_size, image_digest = await save_upload(
+                image, input_image_path, max_bytes=UPLOAD_LIMITS["image"] + UPLOAD_LIMITS["file"]
+            )
+            print(f"[INFO] Saved image to {input_image_path}, file size: {image_size} bytes, sha256: {image_digest}")
+        except UploadTooLarge as too_large:
+            print(f"[WARNING] {too_large}")
+            return JSONResponse(
+                status_code=400,
+                content={"detail": str(too_large)}
+            )
         except Exception as read_error:
             print(f"[ERROR] File read/write error: {read_error}")
             return JSONResponse(
@@ -171,8 +205,30 @@ async def decode_image_file_route(
             )
 
         try:
-            print(f"[INFO] Decoding file from image: {input_image_path}")
-            output_path = decode_file_from_image(input_image_path, "temp")
+            # The directory gives each file's offset, name and MIME type without a scan
+            index = await run_io(read_file_index, input_image_path)
+        except ValueError as invalid:
+            print(f"[WARNING] No readable hidden files: {invalid}")
+            return JSONResponse(
+                status_code=400,
+                content={"detail": str(invalid)}
+            )
+        names = [entry["filename"] for entry in index["files"]]
+        if name is None and len(names) > 1:
+            return JSONResponse(
+                status_code=400,
+                content={"detail": f"Image holds {len(names)} files; choose one with the 'name' field.", "files": names}
+            )
+        if name is not None and name not in names:
+            return JSONResponse(
+                status_code=404,
+                content={"detail": f"No file named '{name}' hidden in image.", "files": names}
+            )
+
+        try:
+            print(f"[INFO] Decoding file {name or names[0]!r} from image: {input_image_path}")
+            extracted = await run_io(decode_file_from_image, input_image_path, scratch.dir, name)
+            output_path = extracted["path"]
             
             if not os.path.exists(output_path):
                 print(f"[ERROR] Extracted file does not exist: {output_path}")
@@ -181,11 +237,14 @@ async def decode_image_file_route(
                     content={"detail": "Failed to extract file from image."}
                 )
                 
-            print(f"[INFO] Successfully extracted file: {output_path}, size: {os.path.getsize(output_path)} bytes")
+            print(f"[INFO] Successfully extracted file: {output_path}, size: {extracted['size']} bytes")
 
             filename = os.path.basename(output_path)
-            mime_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+            mime_type = extracted["mime_type"]
 
+            # Served from the request scratch space, which is removed once the
+            # response is sent: the hidden file is never published as an artifact
+            # and not cached
             print(f"[INFO] Returning extracted file: {filename}, mime type: {mime_type}")
             return FileResponse(output_path, media_type=mime_type, filename=filename)
         except Exception as decode_error:
@@ -204,22 +263,65 @@ async def decode_image_file_route(
         )
 
 
+@router.post("/list")
+async def list_image_files_route(image: UploadFile = File(...)):
+    """
+    List the files hidden in an image. Only the trailer and directory at the
+    end of the upload are read.
+    """
+    try:
+        print(f"[INFO] List hidden files request received for image: {image.filename}")
+        if image.content_type != "image/png":
+            print(f"[WARNING] Invalid image content type: {image.content_type}")
+            return JSONResponse(
+                status_code=400,
+                content={"detail": "Only PNG images supported."}
+            )
+
+        try:
+            index = await run_io(read_file_index, image.file)
+        except ValueError as invalid:
+            print(f"[WARNING] No readable hidden files: {invalid}")
+            return JSONResponse(
+                status_code=400,
+                content={"detail": str(invalid)}
+            )
+
+        print(f"[INFO] Image holds {len(index['files'])} hidden file(s)")
+        return {
+            "version": index["version"],
+            "files": [
+                {key: entry[key] for key in ("filename", "mime_type", "size", "stored_size", "compression", "crc32")}
+                for entry in index["files"]
+            ],
+        }
+    except Exception as e:
+        print(f"[ERROR] Unexpected error in list hidden files route: {e}")
+        traceback.print_exc()
+        return JSONResponse(
+            status_code=500,
+            content={"detail": f"Listing failed: {str(e)}"}
+        )
+
+
 @router.post("/encode/direct")
 async def encode_image_file_direct(
     image: UploadFile = File(...),
-    file: UploadFile = File(...)
+    file: List[UploadFile] = File(...),
+    compression: str = Form(DEFAULT_COMPRESSION),
+    scratch: Scratch = Depends(request_scratch)
 ):
     """
-    Encode a file in an image and serve it directly without S3 upload.
+    Encode one or more files in an image and serve it directly without S3 upload.
     This endpoint is a fallback for when S3 is not available.
     """
     try:
         # Log request info
         print(f"[INFO] Direct encode file-in-image request received")
         print(f"[INFO] Image: {image.filename}, content_type: {image.content_type}")
-        print(f"[INFO] File: {file.filename}, content_type: {file.content_type}, size: {file.size}")
+        for upload in file:
+            print(f"[INFO] File: {upload.filename}, content_type: {upload.content_type}, size: {upload.size}")
         
-        os.makedirs("temp", exist_ok=True)
 
         if image.content_type != "image/png":
             print(f"[WARNING] Invalid image content type: {image.content_type}")
@@ -228,33 +330,48 @@ async def encode_image_file_direct(
                 content={"detail": "Only PNG images supported."}
             )
 
-        input_image_path = f"temp/{uuid.uuid4()}.png"
-        input_file_path = f"temp/{uuid.uuid4()}_{file.filename}"
-        output_path = f"temp/{uuid.uuid4()}_encoded.png"
+        if compression not in available_compressions():
+            print(f"[WARNING] Invalid compression: {compression}")
+            return JSONResponse(
+                status_code=400,
+                content={"detail": f"Unknown or unavailable compression '{compression}'. Available: {', '.join(available_compressions())}"}
+            )
 
-        # Read and save the files
-        image_content = await image.read()
-        file_content = await file.read()
-        
-        with open(input_image_path, "wb") as f_img:
-            f_img.write(image_content)
-        with open(input_file_path, "wb") as f_file:
-            f_file.write(file_content)
-            
-        print(f"[INFO] Saved image to {input_image_path}, file size: {os.path.getsize(input_image_path)} bytes")
-        print(f"[INFO] Saved file to {input_file_path}, file size: {os.path.getsize(input_file_path)} bytes")
+        input_image_path = scratch.path(".png")
+        output_path = scratch.path("_encoded.png")
 
-        # Encode file into image
-        print(f"[INFO] Encoding file into image")
-        encode_image_with_file(input_image_path, input_file_path, output_path)
-        print(f"[INFO] Successfully encoded file, output size: {os.path.getsize(output_path)} bytes")
+        # Stream the uploads to disk, enforcing the size limits
+        try:
+            image_size, image_digest = await save_upload(image, input_image_path, max_bytes=UPLOAD_LIMITS["image"])
+            print(f"[INFO] Saved image to {input_image_path}, file size: {image_size} bytes, sha256: {image_digest}")
+            saved = await _save_files(file, scratch)
+        except UploadTooLarge as too_large:
+            print(f"[WARNING] {too_large}")
+            return JSONResponse(
+                status_code=400,
+                content={"detail": str(too_large)}
+            )
 
-        # Return the file directly
-        return FileResponse(
-            output_path,
-            media_type="image/png",
-            filename="encoded.png"
+        key = cache_key("image-file-encode-direct", compression, PAYLOAD_VERSION, image_digest, *(
+            part for _, name, content_type, digest in saved for part in (digest, name, content_type)
+        ))
+        cached = await cached_response(key)
+        if cached is not None:
+            return cached
+
+        # Encode the files into the image
+        print(f"[INFO] Encoding {len(saved)} file(s) into image")
+        await run_io(
+            encode_image_with_files, input_image_path,
+            [(path, name, content_type) for path, name, content_type, _ in saved], output_path,
+            compression=compression
         )
+        print(f"[INFO] Successfully encoded files, output size: {os.path.getsize(output_path)} bytes")
+
+        # Return the file directly
+        response = await artifact_response(output_path, media_type="image/png")
+        await store(key, artifact_value(response))
+        return response
             
     except Exception as e:
         print(f"[ERROR] Unexpected error in direct encode file-in-image route: {e}")
@@ -0,0 +1,17 @@
+# routes/storage.py
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+from utils.s3 import upload_status
+
+router = APIRouter()
+
+@router.get("/uploads/{upload_id}")
+async def get_upload_status(upload_id: str):
+    """State of a background S3 upload started with S3_BACKGROUND_UPLOADS enabled."""
+    status = upload_status(upload_id)
+    if status is None:
+        return JSONResponse(
+            status_code=404,
+            content={"detail": "Unknown or expired upload"}
+        )
+    return status
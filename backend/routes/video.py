@@ -1,24 +1,53 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, Form
-from fastapi.responses import FileResponse, JSONResponse
-import uuid
+from fastapi import APIRouter, UploadFile, File, HTTPException, Form, Depends
+from fastapi.responses import JSONResponse
 import os
 import traceback
-from utils.s3 import upload_file_to_s3
-from stego.video import encode_video, decode_video
+from utils.s3 import upload_output
+from utils.executors import run_cpu
+from utils.uploads import save_upload, UploadTooLarge, UPLOAD_LIMITS
+from utils.scratch import Scratch, request_scratch
+from utils.artifacts import artifact_response
+from utils.cache import cache_key, cached_response, store, artifact_value
+from stego.options import OUTPUT_MODES, DEFAULT_OUTPUT_MODE, DEFAULT_COMPRESSION, available_compressions
 
+# stego.video (numpy, cv2, ffmpeg) is imported inside the handlers, so the API can start
+# without loading it; main.py imports it in the background after startup
 router = APIRouter()
 
+
+def _media_type(ext: str) -> str:
+    if ext.lower() == ".mkv":
+        return "video/x-matroska"
+    return f"video/{ext.lstrip('.')}"
+
+
 @router.post("/encode")
 async def encode_video_route(
     video: UploadFile = File(...),
-    message: str = Form(...)
+    message: str = Form(...),
+    mode: str = Form(DEFAULT_OUTPUT_MODE),
+    compression: str = Form(DEFAULT_COMPRESSION),
+    scratch: Scratch = Depends(request_scratch)
 ):
+    from stego.video import encode_video, output_extension, PAYLOAD_VERSION
     try:
         # Log request info
         print(f"[INFO] Encode video request received for file: {video.filename}, content_type: {video.content_type}")
-        print(f"[INFO] Message length: {len(message)}")
+        print(f"[INFO] Message length: {len(message)}, output mode: {mode}, compression: {compression}")
+        
+        if mode not in OUTPUT_MODES:
+            print(f"[WARNING] Invalid output mode: {mode}")
+            return JSONResponse(
+                status_code=400,
+                content={"detail": f"Unknown output mode '{mode}'. Supported modes: {', '.join(OUTPUT_MODES)}"}
+            )
+        if compression not in available_compressions():
+            print(f"[WARNING] Invalid compression: {compression}")
+            return JSONResponse(
+                status_code=400,
+                content={"detail": f"Unknown or unavailable compression '{compression}'. Available: {', '.join(available_compressions())}"}
+            )
         
-        os.makedirs("temp", exist_ok=True)
 
         # Validate video content type and file extension
         valid_extensions = ['.mp4', '.avi', '.mov', '.mkv']
@@ -47,26 +76,20 @@ async def encode_video_route(
             )
 
         input_ext = os.path.splitext(video.filename)[1] or ".mp4"
-        input_path = f"temp/{uuid.uuid4()}{input_ext}"
-        output_path = f"temp/{uuid.uuid4()}_encoded{input_ext}"
+        input_path = scratch.path(input_ext)
+        output_ext = output_extension(mode, input_ext)
+        output_path = scratch.path(f"_encoded{output_ext}")
 
         try:
-            # Read and save the file
-            file_content = await video.read()
-            print(f"[INFO] Read {len(file_content)} bytes from uploaded video")
-            
-            # Check file size
-            if len(file_content) > 50 * 1024 * 1024:  # 50 MB limit
-                print(f"[WARNING] File too large: {len(file_content)} bytes")
-                return JSONResponse(
-                    status_code=400,
-                    content={"detail": f"File too large. Maximum size is 50 MB."}
-                )
-            
-            with open(input_path, "wb") as f:
-                f.write(file_content)
-                
-            print(f"[INFO] Saved video to {input_path}, file size: {os.path.getsize(input_path)} bytes")
+            # Stream the upload to disk, enforcing the size limit
+            size, digest = await save_upload(video, input_path, max_bytes=UPLOAD_LIMITS["video"])
+            print(f"[INFO] Saved video to {input_path}, file size: {size} bytes, sha256: {digest}")
+        except UploadTooLarge as too_large:
+            print(f"[WARNING] {too_large}")
+            return JSONResponse(
+                status_code=400,
+                content={"detail": str(too_large)}
+            )
         except Exception as read_error:
             print(f"[ERROR] File read/write error: {read_error}")
             return JSONResponse(
@@ -74,6 +97,12 @@ async def encode_video_route(
                 content={"detail": f"Error reading or writing video file: {str(read_error)}"}
             )
 
+        # The same carrier and message were uploaded before: return the earlier URL
+        key = cache_key("video-encode-s3", mode, compression, PAYLOAD_VERSION, digest, message)
+        cached = await cached_response(key)
+        if cached is not None:
+            return cached
+
         try:
             print(f"[INFO] Encoding message into video: {input_path}")
             print(f"[INFO] Video file size: {os.path.getsize(input_path)} bytes")
@@ -101,7 +130,7 @@ async def encode_video_route(
                 )
             
             # Encode the video
-            encode_video(input_path, message, output_path)
+            await run_cpu(encode_video, input_path, message, output_path, mode=mode, compression=compression)
             print(f"[INFO] Successfully encoded message, output file size: {os.path.getsize(output_path)} bytes")
         except Exception as encode_error:
             print(f"[ERROR] Encoding algorithm failed: {encode_error}")
@@ -132,9 +161,12 @@ async def encode_video_route(
                 
             # Upload to S3
             try:
-                s3_url = upload_file_to_s3(output_path)
-                print(f"[INFO] Successfully uploaded to S3, URL: {s3_url}")
-                return {"url": s3_url}
+                result = await upload_output(output_path)
+                print(f"[INFO] S3 upload {result.get('upload', 'complete')}, URL: {result['url']}")
+                # Background uploads may still fail, so only finished ones are cached
+                if result.get("upload", "complete") == "complete":
+                    await store(key, result)
+                return result
             except Exception as s3_error:
                 print(f"[ERROR] S3 upload failed: {s3_error}")
                 print(f"[ERROR] Error type: {type(s3_error)}")
@@ -142,11 +174,7 @@ async def encode_video_route(
                 
                 # As a fallback, try to serve the file directly
                 print(f"[INFO] Trying to serve the file directly")
-                return FileResponse(
-                    output_path,
-                    media_type=f"video/{input_ext.lstrip('.')}",
-                    filename=f"encoded{input_ext}"
-                )
+                return await artifact_response(output_path, media_type=_media_type(output_ext))
         except Exception as s3_error:
             print(f"[ERROR] S3 upload failed: {s3_error}")
             return JSONResponse(
@@ -164,13 +192,14 @@ async def encode_video_route(
 
 @router.post("/decode")
 async def decode_video_route(
-    video: UploadFile = File(...)
+    video: UploadFile = File(...),
+    scratch: Scratch = Depends(request_scratch)
 ):
+    from stego.video import decode_video, PAYLOAD_VERSION
     try:
         # Log request info
         print(f"[INFO] Decode video request received for file: {video.filename}, content_type: {video.content_type}")
         
-        os.makedirs("temp", exist_ok=True)
 
         # Validate video content type and file extension
         valid_extensions = ['.mp4', '.avi', '.mov', '.mkv']
@@ -191,17 +220,18 @@ async def decode_video_route(
             )
 
         input_ext = os.path.splitext(video.filename)[1] or ".mp4"
-        input_path = f"temp/{uuid.uuid4()}{input_ext}"
+        input_path = scratch.path(input_ext)
 
         try:
-            # Read and save the file
-            file_content = await video.read()
-            print(f"[INFO] Read {len(file_content)} bytes from uploaded video")
-            
-            with open(input_path, "wb") as f:
-                f.write(file_content)
-                
-            print(f"[INFO] Saved video to {input_path}, file size: {os.path.getsize(input_path)} bytes")
+            # Stream the upload to disk, enforcing the size limit
+            size, digest = await save_upload(video, input_path, max_bytes=UPLOAD_LIMITS["video"])
+            print(f"[INFO] Saved video to {input_path}, file size: {size} bytes, sha256: {digest}")
+        except UploadTooLarge as too_large:
+            print(f"[WARNING] {too_large}")
+            return JSONResponse(
+                status_code=400,
+                content={"detail": str(too_large)}
+            )
         except Exception as read_error:
             print(f"[ERROR] File read/write error: {read_error}")
             return JSONResponse(
@@ -209,10 +239,17 @@ async def decode_video_route(
                 content={"detail": f"Error reading or writing video file: {str(read_error)}"}
             )
 
+        # The same stego video was decoded before
+        key = cache_key("video-decode", PAYLOAD_VERSION, digest)
+        cached = await cached_response(key)
+        if cached is not None:
+            return cached
+
         try:
             print(f"[INFO] Decoding message from video: {input_path}")
-            message = decode_video(input_path)
+            message = await run_cpu(decode_video, input_path)
             print(f"[INFO] Successfully decoded message from video")
+            await store(key, {"message": message})
             return JSONResponse({"message": message})
         except Exception as decode_error:
             print(f"[ERROR] Decoding algorithm failed: {decode_error}")
@@ -232,18 +269,34 @@ async def decode_video_route(
 @router.post("/encode/direct")
 async def encode_video_direct(
     video: UploadFile = File(...),
-    message: str = Form(...)
+    message: str = Form(...),
+    mode: str = Form(DEFAULT_OUTPUT_MODE),
+    compression: str = Form(DEFAULT_COMPRESSION),
+    scratch: Scratch = Depends(request_scratch)
 ):
     """
     Encode a video and serve it directly without S3 upload.
     This endpoint is a fallback for when S3 is not available.
     """
+    from stego.video import encode_video, output_extension, PAYLOAD_VERSION
     try:
         # Log request info
         print(f"[INFO] Direct encode video request received for file: {video.filename}, content_type: {video.content_type}")
-        print(f"[INFO] Message length: {len(message)}")
+        print(f"[INFO] Message length: {len(message)}, output mode: {mode}, compression: {compression}")
+        
+        if mode not in OUTPUT_MODES:
+            print(f"[WARNING] Invalid output mode: {mode}")
+            return JSONResponse(
+                status_code=400,
+                content={"detail": f"Unknown output mode '{mode}'. Supported modes: {', '.join(OUTPUT_MODES)}"}
+            )
+        if compression not in available_compressions():
+            print(f"[WARNING] Invalid compression: {compression}")
+            return JSONResponse(
+                status_code=400,
+                content={"detail": f"Unknown or unavailable compression '{compression}'. Available: {', '.join(available_compressions())}"}
+            )
         
-        os.makedirs("temp", exist_ok=True)
 
         # Validate video content type and file extension
         valid_extensions = ['.mp4', '.avi', '.mov', '.mkv']
@@ -264,29 +317,35 @@ async def encode_video_direct(
             )
 
         input_ext = os.path.splitext(video.filename)[1] or ".mp4"
-        input_path = f"temp/{uuid.uuid4()}{input_ext}"
-        output_path = f"temp/{uuid.uuid4()}_encoded{input_ext}"
+        input_path = scratch.path(input_ext)
+        output_ext = output_extension(mode, input_ext)
+        output_path = scratch.path(f"_encoded{output_ext}")
 
-        # Read and save the file
-        file_content = await video.read()
-        print(f"[INFO] Read {len(file_content)} bytes from uploaded video")
-        
-        with open(input_path, "wb") as f:
-            f.write(file_content)
-            
-        print(f"[INFO] Saved video to {input_path}, file size: {os.path.getsize(input_path)} bytes")
+        # Stream the upload to disk, enforcing the size limit
+        try:
+            size, digest = await save_upload(video, input_path, max_bytes=UPLOAD_LIMITS["video"])
+        except UploadTooLarge as too_large:
+            print(f"[WARNING] {too_large}")
+            return JSONResponse(
+                status_code=400,
+                content={"detail": str(too_large)}
+            )
+        print(f"[INFO] Saved video to {input_path}, file size: {size} bytes, sha256: {digest}")
+
+        key = cache_key("video-encode-direct", mode, compression, PAYLOAD_VERSION, digest, message)
+        cached = await cached_response(key)
+        if cached is not None:
+            return cached
 
         # Encode the message
         print(f"[INFO] Encoding message into video: {input_path}")
-        encode_video(input_path, message, output_path)
+        await run_cpu(encode_video, input_path, message, output_path, mode=mode, compression=compression)
         print(f"[INFO] Successfully encoded message, output file size: {os.path.getsize(output_path)} bytes")
 
         # Return the file directly
-        return FileResponse(
-            output_path,
-            media_type=f"video/{input_ext.lstrip('.')}",
-            filename=f"encoded{input_ext}"
-        )
+        response = await artifact_response(output_path, media_type=_media_type(output_ext))
+        await store(key, artifact_value(response))
+        return response
             
     except Exception as e:
         print(f"[ERROR] Unexpected error in direct encode video route: {e}")
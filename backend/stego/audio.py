@@ -1,135 +1,325 @@
 from pydub import AudioSegment
 import numpy as np
 import wave
+import io
 import os
-import uuid
 import time
 
-def encode_audio(input_audio_path: str, message: str, output_audio_path: str) -> None:
+from stego.options import DEFAULT_COMPRESSION
+from stego.compression import compress, decompress, flags_for, method_for
+from stego.core import FRAME_VERSION as PAYLOAD_VERSION, HEADER_SIZE, PREFIX_SIZE
+from stego.core import embed_bits, frame_bits, from_bits, read_bytes, read_frame
+from utils.metrics import timed
+
+# Payload frame magic (see stego/core.py), written into the first sample LSBs.
+# Files without the magic are read as legacy NUL-terminated messages.
+_MAGIC = b"STGA"
+
+# Bytes extracted per step when scanning a legacy message for its NUL terminator
+_LEGACY_SCAN_BYTES = 4096
+
+# numpy dtypes matching pydub's raw sample layout (little-endian, signed; pydub
+# converts 8-bit WAV to signed and 24-bit to 32-bit on load)
+_SAMPLE_DTYPES = {1: np.dtype("i1"), 2: np.dtype("<i2"), 4: np.dtype("<i4")}
+
+
+def _writable_samples(audio: AudioSegment) -> np.ndarray:
+    dtype = _SAMPLE_DTYPES.get(audio.sample_width)
+    if dtype is None:
+        raise ValueError(f"Unsupported audio sample width: {audio.sample_width} bytes")
+    return np.frombuffer(bytearray(audio.raw_data), dtype=dtype)
+
+
+def _open_source(source, input_format: str = None):
+    # Returns (path or binary file object, lower-case format). Paths take their
+    # format from the extension; in-memory input uses input_format, default WAV.
+    if isinstance(source, (str, os.PathLike)):
+        return source, os.path.splitext(str(source).lower())[1].lstrip(".")
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    return source, (input_format or "wav").lower().lstrip(".")
+
+
+def _describe(source) -> str:
+    if isinstance(source, (str, os.PathLike)):
+        return str(source)
+    return f"<in-memory {type(source).__name__}>"
+
+
+def _wav_bit_reader(source):
+    # Sequential LSB reader over a PCM WAV file (path or file object) that only
+    # reads the frames it needs. Returns (read_bits, close, sample count).
+    # Raises wave.Error for files the wave module cannot parse.
+    wav = wave.open(source, "rb")
+    width = wav.getsampwidth()
+    channels = wav.getnchannels()
+    pending = np.empty(0, dtype=np.uint8)
+
+    def read_bits(count: int) -> np.ndarray:
+        nonlocal pending
+        missing = count - len(pending)
+        if missing > 0:
+            raw = wav.readframes(-(-missing // channels))
+            # The LSB of a little-endian sample is bit 0 of its first byte
+            pending = np.concatenate([pending, np.frombuffer(raw, dtype=np.uint8)[::width] & 1])
+        bits, pending = pending[:count], pending[count:]
+        return bits
+
+    return read_bits, wav.close, wav.getnframes() * channels
+
+
+def _segment_bit_reader(audio: AudioSegment):
+    # Sequential LSB reader over an already decoded AudioSegment; same return as _wav_bit_reader
+    samples = np.frombuffer(audio.raw_data, dtype=np.uint8)[::audio.sample_width]
+    position = 0
+
+    def read_bits(count: int) -> np.ndarray:
+        nonlocal position
+        bits = samples[position:position + count] & 1
+        position += len(bits)
+        return bits
+
+    return read_bits, lambda: None, len(samples)
+
+
+def _read_message(read_bits, samples: int) -> tuple:
+    # Returns (stored payload, header flags); a declared length beyond the
+    # samples' capacity is rejected before it is read
+    prefix = read_bytes(read_bits, PREFIX_SIZE, "audio")
+    if prefix.startswith(_MAGIC):
+        return read_frame(read_bits, prefix, "audio", samples // 8)
+
+    # Legacy NUL-terminated message: scan forward in fixed-size chunks
+    chunks = []
+    chunk = prefix
+    while True:
+        end = chunk.find(b"\0")
+        if end != -1:
+            chunks.append(chunk[:end])
+            return b"".join(chunks), 0
+        chunks.append(chunk)
+        bits = read_bits(_LEGACY_SCAN_BYTES * 8)
+        bits = bits[:len(bits) - len(bits) % 8]
+        if len(bits) == 0:
+            return b"".join(chunks), 0
+        chunk = from_bits(bits)
+
+
+def _capacity_bytes(samples: int) -> int:
+    # One bit per sample, minus the header
+    return max(0, samples // 8 - HEADER_SIZE)
+
+
+def _wav_info(source) -> dict:
+    # Reads the RIFF fmt chunk and the data chunk header only; the frame count
+    # comes from the declared data chunk size, so a prefix of the file is enough
+    position = None if isinstance(source, (str, os.PathLike)) else source.tell()
+    try:
+        wav = wave.open(source, "rb")
+        try:
+            return {
+                "channels": wav.getnchannels(),
+                "sample_rate": wav.getframerate(),
+                "sample_width": wav.getsampwidth(),
+                "frames": wav.getnframes(),
+            }
+        finally:
+            wav.close()
+    except (wave.Error, EOFError) as wav_error:
+        raise ValueError(f"Not a valid WAV file: {str(wav_error) or 'truncated header'}")
+    finally:
+        if position is not None:
+            source.seek(position)
+
+
+def _probe_info(source) -> dict:
+    # Stream info from ffprobe. For compressed formats the frame count is
+    # derived from the duration, so it is an estimate.
+    from pydub.utils import mediainfo_json
+    try:
+        info = mediainfo_json(source)
+    except Exception as probe_error:
+        raise ValueError(f"Could not read audio stream info: {probe_error}")
+    streams = [stream for stream in info.get("streams", []) if stream.get("codec_type") == "audio"]
+    if not streams or "duration" not in streams[0]:
+        raise ValueError("Could not read audio stream info")
+    stream = streams[0]
+    sample_rate = int(stream["sample_rate"])
+    return {
+        "channels": int(stream["channels"]),
+        "sample_rate": sample_rate,
+        "sample_width": None,
+        "frames": int(float(stream["duration"]) * sample_rate),
+    }
+
+
+def audio_capacity(source, input_format: str = None) -> dict:
+    """
+    Largest message, in UTF-8 bytes, that encode_audio can hide in an audio file,
+    from its header alone.
+
+    WAV capacity is exact and comes from the fmt and data chunk headers, so a
+    prefix of the file holding them is enough. Other formats (MP3) are probed
+    with ffprobe and the result is an estimate based on the stream duration.
+
+    :param source: Path, audio file bytes or binary file object
+    :param input_format: Format of in-memory input ("wav" or "mp3", default "wav")
+    :return: {"media", "format", "channels", "sample_rate", "sample_width",
+        "frames", "exact", "capacity_bytes"}
+    """
+    source, file_format = _open_source(source, input_format)
+    exact = file_format == "wav"
+    info = _wav_info(source) if exact else _probe_info(source)
+    return dict(
+        info,
+        media="audio",
+        format=file_format,
+        exact=exact,
+        capacity_bytes=_capacity_bytes(info["frames"] * info["channels"]),
+    )
+
+
+def encode_audio(input_audio, message: str, output_audio=None, input_format: str = None,
+                 compression: str = DEFAULT_COMPRESSION):
+    """
+    Hide `message` in an audio file; the output is always WAV.
+
+    :param input_audio: Path, audio file bytes or binary file object
+    :param output_audio: Path or binary file object to write the WAV to; when
+        None the encoded WAV is returned as bytes
+    :param input_format: Format of in-memory input ("wav" or "mp3", default "wav")
+    :param compression: Compression applied to the message before embedding;
+        recorded in the header for decoding
+    :return: The encoded WAV bytes when output_audio is None, otherwise None
+    """
     start_time = time.time()
-    print(f"[INFO] Starting audio encoding. Input file: {input_audio_path}")
+    print(f"[INFO] Starting audio encoding. Input: {_describe(input_audio)}")
     
     try:
-        # Check input file extension
-        file_ext = os.path.splitext(input_audio_path.lower())[1]
-        print(f"[INFO] Input file extension: {file_ext}")
+        source, file_format = _open_source(input_audio, input_format)
+        print(f"[INFO] Input format: {file_format}")
+        
+        payload = compress(message.encode('utf-8'), compression)
+        print(f"[INFO] Payload: {len(payload)} bytes after {compression} compression")
+        if file_format == "wav":
+            # Reject an oversized message from the WAV header, before decoding the
+            # samples. Files the wave module cannot parse are left to pydub.
+            try:
+                max_bytes = audio_capacity(source)["capacity_bytes"]
+            except ValueError:
+                max_bytes = None
+            if max_bytes is not None and len(payload) > max_bytes:
+                print(f"[ERROR] Message too long: {len(payload)} bytes > {max_bytes} bytes")
+                raise ValueError(f"Message too long to encode in audio. Maximum size for this audio is {max_bytes} bytes.")
         
-        # Load the audio file with pydub (supports both MP3 and WAV)
+        # Load the audio with pydub (supports both MP3 and WAV). Decoded MP3 is
+        # already PCM, so it is embedded directly without a WAV round trip on disk.
         try:
-            audio = AudioSegment.from_file(input_audio_path)
+            with timed("carrier_decode", "audio"):
+                audio = AudioSegment.from_file(source, format=file_format or None)
             print(f"[INFO] Loaded audio file. Duration: {len(audio)/1000:.2f}s, Channels: {audio.channels}, Sample width: {audio.sample_width}")
         except Exception as e:
             print(f"[ERROR] Failed to load audio file: {e}")
             raise ValueError(f"Failed to load audio file: {str(e)}. Make sure it's a valid WAV or MP3 file.")
-          # For MP3 files, first convert to WAV format internally
-        temp_wav_path = None
+        
         try:
-            if file_ext == '.mp3':
-                print(f"[INFO] Converting MP3 to WAV format for processing")
-                temp_wav_path = f"temp/{uuid.uuid4()}_temp.wav"
-                audio.export(temp_wav_path, format="wav")
-                audio = AudioSegment.from_wav(temp_wav_path)
-                print(f"[INFO] MP3 converted to WAV format, temp file: {temp_wav_path}")
-                # Now we'll use the temp_wav_path for processing
-                input_audio_path = temp_wav_path
-            
-            # Get audio samples
-            samples = np.array(audio.get_array_of_samples())
+            # Get a writable view of the audio samples
+            samples = _writable_samples(audio)
             print(f"[INFO] Extracted {len(samples)} samples from audio")
             
-            message_bytes = message.encode('utf-8') + b'\0'  # Null-terminated
-            bits = ''.join([format(byte, '08b') for byte in message_bytes])
-            print(f"[INFO] Message converted to {len(bits)} bits")
+            bits = frame_bits(_MAGIC, payload, flags_for(compression))
+            bit_count = len(bits)
+            print(f"[INFO] Message converted to {bit_count} bits")
             
-            if len(bits) > len(samples):
-                print(f"[ERROR] Message too long: {len(bits)} bits > {len(samples)} samples")
-                raise ValueError(f"Message too long to encode in audio. Maximum size for this audio is {len(samples) // 8} bytes.")
+            if bit_count > len(samples):
+                print(f"[ERROR] Message too long: {bit_count} bits > {len(samples)} samples")
+                raise ValueError(f"Message too long to encode in audio. Maximum size for this audio is {_capacity_bytes(len(samples))} bytes.")
             
             # Modify samples to encode the message
-            for i, bit in enumerate(bits):
-                samples[i] = (samples[i] & ~1) | int(bit)
+            with timed("embed", "audio"):
+                embed_bits(samples, bits)
             
             print(f"[INFO] Message encoded into audio samples")
             
-            # Create new audio with modified samples
+            # Create new audio with modified samples; pydub writes plain WAV
+            # straight into a file object without an intermediate file
             encoded_audio = audio._spawn(samples.tobytes())
-            encoded_audio.export(output_audio_path, format="wav")
+            if output_audio is None:
+                buffer = io.BytesIO()
+                with timed("output_encode", "audio"):
+                    encoded_audio.export(buffer, format="wav")
+                print(f"[INFO] Audio encoding completed in {time.time() - start_time:.2f}s, kept in memory: {buffer.tell()} bytes")
+                return buffer.getvalue()
+            
+            with timed("output_encode", "audio"):
+                encoded_audio.export(output_audio, format="wav")
+            if not isinstance(output_audio, (str, os.PathLike)):
+                print(f"[INFO] Audio encoding completed in {time.time() - start_time:.2f}s")
+                return None
             
             # Verify the output file
-            if not os.path.exists(output_audio_path):
-                raise ValueError(f"Failed to create output audio file: {output_audio_path}")
+            if not os.path.exists(output_audio):
+                raise ValueError(f"Failed to create output audio file: {output_audio}")
             
-            file_size = os.path.getsize(output_audio_path)
+            file_size = os.path.getsize(output_audio)
             if file_size == 0:
-                raise ValueError(f"Output audio file is empty: {output_audio_path}")
+                raise ValueError(f"Output audio file is empty: {output_audio}")
             
             print(f"[INFO] Audio encoding completed in {time.time() - start_time:.2f}s, Output size: {file_size} bytes")
         except Exception as e:
             print(f"[ERROR] Audio encoding failed during processing: {str(e)}")
             raise
-        finally:
-            # Clean up the temporary WAV file if it was created
-            if temp_wav_path and os.path.exists(temp_wav_path):
-                try:
-                    os.remove(temp_wav_path)
-                    print(f"[INFO] Cleaned up temporary WAV file: {temp_wav_path}")
-                except Exception as cleanup_error:
-                    print(f"[WARNING] Failed to clean up temporary WAV file: {cleanup_error}")
     except Exception as e:
         print(f"[ERROR] Audio encoding failed: {str(e)}")
         raise
 
-def decode_audio(stego_audio_path: str) -> str:
+def decode_audio(stego_audio, input_format: str = None) -> str:
+    """
+    Read the message hidden in an audio file.
+
+    :param stego_audio: Path, audio file bytes or binary file object
+    :param input_format: Format of in-memory input ("wav" or "mp3", default "wav")
+    """
     start_time = time.time()
-    print(f"[INFO] Starting audio decoding. Input file: {stego_audio_path}")
+    print(f"[INFO] Starting audio decoding. Input: {_describe(stego_audio)}")
     
-    temp_wav_path = None
+    close_reader = None
     try:
-        # Check file extension
-        file_ext = os.path.splitext(stego_audio_path.lower())[1]
-        print(f"[INFO] Input file extension: {file_ext}")
-        
-        # Load the audio file (pydub supports both MP3 and WAV)
-        try:
-            audio = AudioSegment.from_file(stego_audio_path)
-            print(f"[INFO] Loaded audio file. Duration: {len(audio)/1000:.2f}s, Channels: {audio.channels}, Sample width: {audio.sample_width}")
-        except Exception as e:
-            print(f"[ERROR] Failed to load audio file: {e}")
-            raise ValueError(f"Failed to load audio file: {str(e)}. Make sure it's a valid WAV or MP3 file.")
+        source, file_format = _open_source(stego_audio, input_format)
+        print(f"[INFO] Input format: {file_format}")
         
-        # For MP3 files, convert to WAV for consistent processing
-        if file_ext == '.mp3':
-            print(f"[INFO] Converting MP3 to WAV format for decoding")
-            temp_wav_path = f"temp/{uuid.uuid4()}_temp.wav"
-            audio.export(temp_wav_path, format="wav")
-            audio = AudioSegment.from_wav(temp_wav_path)
-            print(f"[INFO] MP3 converted to WAV format for decoding")
-        
-        # Get audio samples
-        try:
-            samples = np.array(audio.get_array_of_samples())
-            print(f"[INFO] Extracted {len(samples)} samples from audio")
-        except Exception as e:
-            print(f"[ERROR] Failed to extract samples: {e}")
-            raise ValueError(f"Failed to extract samples: {str(e)}. The audio file may be corrupted.")
+        # PCM WAV files are read frame by frame so only the samples holding the
+        # message are loaded; anything else is decoded in full by pydub
+        read_bits = None
+        if file_format == 'wav':
+            try:
+                read_bits, close_reader, samples = _wav_bit_reader(source)
+                print(f"[INFO] Reading WAV samples incrementally")
+            except (wave.Error, EOFError) as wav_error:
+                print(f"[INFO] WAV not readable incrementally ({wav_error}), falling back to pydub")
+                if hasattr(source, "seek"):
+                    source.seek(0)
         
-        # Extract LSB from each sample
-        bits = [str(samples[i] & 1) for i in range(len(samples))]
+        if read_bits is None:
+            try:
+                with timed("carrier_decode", "audio"):
+                    audio = AudioSegment.from_file(source, format=file_format or None)
+                print(f"[INFO] Loaded audio file. Duration: {len(audio)/1000:.2f}s, Channels: {audio.channels}, Sample width: {audio.sample_width}")
+            except Exception as e:
+                print(f"[ERROR] Failed to load audio file: {e}")
+                raise ValueError(f"Failed to load audio file: {str(e)}. Make sure it's a valid WAV or MP3 file.")
+            read_bits, close_reader, samples = _segment_bit_reader(audio)
         
-        # Convert bits to bytes and then to string
-        chars = []
-        for b in range(0, len(bits), 8):
-            byte = bits[b:b+8]
-            if len(byte) < 8:
-                break
-            char = int(''.join(byte), 2)
-            if char == 0:  # Null terminator
-                break
-            chars.append(char)
+        # Read the header, then only as many LSBs as the declared length needs.
+        # WAV frames are read inside this step, so for WAV it includes the carrier read.
+        with timed("extract", "audio"):
+            message_bytes, flags = _read_message(read_bits, samples)
+            # Compression is detected from the header flags
+            message_bytes = decompress(message_bytes, method_for(flags))
         
         # Convert bytes to string
         try:
-            message = bytes(chars).decode('utf-8')
+            message = message_bytes.decode('utf-8')
             print(f"[INFO] Decoded message with length: {len(message)} characters")
             print(f"[INFO] Audio decoding completed in {time.time() - start_time:.2f}s")
             return message
@@ -140,10 +330,5 @@ def decode_audio(stego_audio_path: str) -> str:
         print(f"[ERROR] Audio decoding failed: {str(e)}")
         raise
     finally:
-        # Clean up temporary files
-        if temp_wav_path and os.path.exists(temp_wav_path):
-            try:
-                os.remove(temp_wav_path)
-                print(f"[INFO] Cleaned up temporary WAV file: {temp_wav_path}")
-            except Exception as cleanup_error:
-                print(f"[WARNING] Failed to clean up temporary WAV file: {cleanup_error}")
+        if close_reader is not None:
+            close_reader()
@@ -0,0 +1,158 @@
+# stego/compression.py
+# Optional compression of hidden payloads. The method is stored as a code in
+# the payload header's flags byte, so decoders pick it up without an option.
+# zstandard and lz4 are optional and only imported when their method is used.
+import zlib
+
+from stego.options import COMPRESSIONS, available_compressions
+
+# Header codes; stored in images, so existing values must never change
+_CODES = {"none": 0, "zlib": 1, "zstd": 2, "lz4": 3}
+_METHODS = {code: method for method, code in _CODES.items()}
+_CODE_MASK = 0x0F
+
+# Decompressed output is produced at most this many bytes at a time
+_OUTPUT_CHUNK = 1024 * 1024
+
+# Largest message decompress() returns, so a small crafted payload cannot
+# expand into an unbounded amount of memory
+MAX_MESSAGE_BYTES = 64 * 1024 * 1024
+
+
+def validate(method: str) -> None:
+    if method not in COMPRESSIONS:
+        raise ValueError(f"Unknown compression '{method}'. Supported: {', '.join(COMPRESSIONS)}")
+    if method not in available_compressions():
+        raise ValueError(f"Compression '{method}' is not available on this server. Available: {', '.join(available_compressions())}")
+
+
+def flags_for(method: str) -> int:
+    """Header flags recording `method`."""
+    validate(method)
+    return _CODES[method]
+
+
+def method_for(flags: int) -> str:
+    """Compression method recorded in header flags."""
+    method = _METHODS.get(flags & _CODE_MASK)
+    if method is None:
+        raise ValueError(f"Unknown compression code in payload header: {flags & _CODE_MASK}")
+    return method
+
+
+class _Identity:
+    def compress(self, data) -> bytes:
+        return bytes(data)
+
+    def flush(self) -> bytes:
+        return b""
+
+
+class _Lz4Compressor:
+    # LZ4FrameCompressor wants begin() before the first block
+    def __init__(self):
+        import lz4.frame
+        self._compressor = lz4.frame.LZ4FrameCompressor()
+        self._started = False
+
+    def compress(self, data) -> bytes:
+        header = b""
+        if not self._started:
+            header, self._started = self._compressor.begin(), True
+        return header + self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self.compress(b"") + self._compressor.flush()
+
+
+def compressor(method: str):
+    """Streaming compressor with compress(data) and flush(), like zlib.compressobj."""
+    validate(method)
+    if method == "zlib":
+        return zlib.compressobj()
+    if method == "zstd":
+        import zstandard
+        return zstandard.ZstdCompressor().compressobj()
+    if method == "lz4":
+        return _Lz4Compressor()
+    return _Identity()
+
+
+def compress(data: bytes, method: str) -> bytes:
+    stream = compressor(method)
+    return stream.compress(data) + stream.flush()
+
+
+class _ChunkReader:
+    # File-like view of an iterable of byte strings, for zstandard.stream_reader
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._pending = b""
+
+    def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self._pending) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._pending += chunk
+        if size < 0:
+            size = len(self._pending)
+        data, self._pending = self._pending[:size], self._pending[size:]
+        return data
+
+
+def iter_decompress(chunks, method: str):
+    """
+    Decompress an iterable of byte strings, yielding output pieces of at most
+    1 MiB, so memory use does not grow with the expanded size.
+    """
+    if method == "none":
+        yield from chunks
+        return
+    validate(method)
+    if method == "zlib":
+        stream = zlib.decompressobj()
+        for chunk in chunks:
+            while chunk:
+                try:
+                    yield stream.decompress(chunk, _OUTPUT_CHUNK)
+                except zlib.error as error:
+                    raise ValueError(f"Hidden payload failed to decompress: {error}")
+                chunk = stream.unconsumed_tail
+        if not stream.eof:
+            raise ValueError("Compressed payload is truncated")
+    elif method == "lz4":
+        import lz4.frame
+        stream = lz4.frame.LZ4FrameDecompressor()
+        try:
+            for chunk in chunks:
+                yield stream.decompress(chunk, _OUTPUT_CHUNK)
+                while not stream.needs_input and not stream.eof:
+                    yield stream.decompress(b"", _OUTPUT_CHUNK)
+        except RuntimeError as error:
+            raise ValueError(f"Hidden payload failed to decompress: {error}")
+        if not stream.eof:
+            raise ValueError("Compressed payload is truncated")
+    else:
+        # stream_reader bounds each read; unlike the others it does not report a
+        # truncated frame, which the callers' CRC checks catch instead
+        import zstandard
+        reader = zstandard.ZstdDecompressor().stream_reader(_ChunkReader(chunks), read_across_frames=False)
+        while True:
+            try:
+                piece = reader.read(_OUTPUT_CHUNK)
+            except zstandard.ZstdError as error:
+                raise ValueError(f"Hidden payload failed to decompress: {error}")
+            if not piece:
+                break
+            yield piece
+
+
+def decompress(data: bytes, method: str, max_size: int = MAX_MESSAGE_BYTES) -> bytes:
+    """Decompress a whole payload, refusing output larger than max_size."""
+    output = bytearray()
+    for piece in iter_decompress((data,), method):
+        output += piece
+        if len(output) > max_size:
+            raise ValueError(f"Decompressed payload exceeds {max_size} bytes")
+    return bytes(output)
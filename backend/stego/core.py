@@ -0,0 +1,71 @@
+# stego/core.py
+# Bit packing and the payload frame shared by the image, audio and video
+# engines. A frame is a fixed header (magic, version, flags, payload length,
+# CRC32 of the stored payload) followed by the payload, written MSB first into
+# one carrier LSB per bit. Each media type has its own magic; the flags byte
+# holds the compression code (see stego/compression.py).
+import struct
+import zlib
+
+import numpy as np
+
+FRAME_VERSION = 1
+_HEADER = struct.Struct(">4sBBII")
+
+HEADER_SIZE = _HEADER.size
+# Magic and version; callers read these first to tell a frame from a legacy payload
+PREFIX_SIZE = 5
+
+
+def to_bits(data: bytes) -> np.ndarray:
+    """One uint8 0/1 value per bit of `data`, MSB first."""
+    return np.unpackbits(np.frombuffer(data, dtype=np.uint8))
+
+
+def from_bits(bits: np.ndarray) -> bytes:
+    """Inverse of to_bits; `bits` must hold only 0/1 values."""
+    return np.packbits(bits).tobytes()
+
+
+def embed_bits(values: np.ndarray, bits: np.ndarray) -> None:
+    """Overwrite the LSBs of the first len(bits) entries of `values` in place."""
+    head = values[:len(bits)]
+    head &= ~values.dtype.type(1)
+    head |= bits.astype(values.dtype, copy=False)
+
+
+def pack_frame(magic: bytes, payload: bytes, flags: int = 0) -> bytes:
+    return _HEADER.pack(magic, FRAME_VERSION, flags, len(payload), zlib.crc32(payload)) + payload
+
+
+def frame_bits(magic: bytes, payload: bytes, flags: int = 0) -> np.ndarray:
+    return to_bits(pack_frame(magic, payload, flags))
+
+
+def read_bytes(read_bits, count: int, media: str) -> bytes:
+    """Next `count` bytes from a read_bits(n) -> 0/1 array reader."""
+    bits = read_bits(count * 8)
+    if len(bits) < count * 8:
+        raise ValueError(f"{media.capitalize()} ended before the end of the hidden message")
+    return from_bits(bits)
+
+
+def read_frame(read_bits, prefix: bytes, media: str, capacity: int = None) -> tuple:
+    """
+    Read the rest of a frame whose first PREFIX_SIZE bytes are `prefix`; the
+    caller has checked the magic. Only the bits the declared length covers are
+    read, and a length beyond `capacity` (bytes the carrier holds, if known) is
+    rejected before reading. Returns (stored payload, header flags).
+    """
+    version = prefix[4]
+    if version != FRAME_VERSION:
+        raise ValueError(f"Unsupported payload version: {version}")
+    header = prefix + read_bytes(read_bits, HEADER_SIZE - PREFIX_SIZE, media)
+    _, _, flags, length, crc = _HEADER.unpack(header)
+
+    if capacity is not None and HEADER_SIZE + length > capacity:
+        raise ValueError(f"Corrupted payload header: declared length exceeds {media} capacity")
+    payload = read_bytes(read_bits, length, media)
+    if zlib.crc32(payload) != crc:
+        raise ValueError("Hidden message failed CRC check")
+    return payload, flags
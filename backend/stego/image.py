@@ -1,56 +1,252 @@
 # stego/image.py
 from PIL import Image
-import stepic
+import numpy as np
+import io
 import os
 
-def encode_image(input_image_path: str, message: str, output_image_path: str) -> None:
-    try:
-        print(f"[DEBUG] Opening image for encoding: {input_image_path}")
-        if not os.path.exists(input_image_path):
-            print(f"[ERROR] Input file does not exist: {input_image_path}")
-            raise FileNotFoundError(f"Input file does not exist: {input_image_path}")
-            
-        file_size = os.path.getsize(input_image_path)
+# Available LSB engines, described in stego/options.py
+from stego.options import ENGINES, DEFAULT_ENGINE, DEFAULT_COMPRESSION
+from stego.compression import compress, decompress, flags_for, method_for
+from stego.core import FRAME_VERSION as PAYLOAD_VERSION, HEADER_SIZE, PREFIX_SIZE
+from stego.core import embed_bits, frame_bits, from_bits, read_bytes, read_frame, to_bits
+from utils.metrics import timed
+
+# Payload frame magic, see stego/core.py
+_MAGIC = b"STGI"
+
+# Number of 9-value groups inspected by the first stepic terminator scan; doubled on each miss
+_SCAN_GROUPS = 4096
+
+
+def _validate_engine(engine: str) -> None:
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine '{engine}'. Supported engines: {', '.join(ENGINES)}")
+
+
+def _capacity(image: Image.Image, engine: str) -> int:
+    if engine == "numpy":
+        # One bit per channel value, minus the header
+        return max(0, (image.width * image.height * 3) // 8 - HEADER_SIZE)
+    # Each hidden byte occupies 3 RGB pixels (8 data bits + 1 terminator bit)
+    return (image.width * image.height) // 3
+
+
+def _rows_for(image: Image.Image, values: int) -> int:
+    # Number of leading rows holding at least `values` channel values
+    return min(image.height, -(-values // (image.width * 3)))
+
+
+def _read_values(image: Image.Image, values: int) -> np.ndarray:
+    # Flat view of the first `values` RGB channel values, converting only the rows needed
+    rows = _rows_for(image, values)
+    strip = image.crop((0, 0, image.width, rows))
+    if strip.mode != "RGB":
+        strip = strip.convert("RGB")
+    return np.asarray(strip, dtype=np.uint8).reshape(-1)[:values]
+
+
+def _value_bit_reader(image: Image.Image):
+    # Sequential LSB reader over the RGB channel values; each call converts only
+    # the leading rows up to the last value it reads
+    total = image.width * image.height * 3
+    position = 0
+
+    def read_bits(count: int) -> np.ndarray:
+        nonlocal position
+        end = min(position + count, total)
+        bits = _read_values(image, end)[position:] & 1
+        position = end
+        return bits
+
+    return read_bits
+
+
+def _embed_numpy(image: Image.Image, data: bytes, flags: int = 0) -> Image.Image:
+    # Writes the payload frame into `image` in place; only the leading rows that
+    # carry bits are copied into numpy
+    bits = frame_bits(_MAGIC, data, flags)
+
+    rows = _rows_for(image, len(bits))
+    strip = np.array(image.crop((0, 0, image.width, rows)), dtype=np.uint8)
+    embed_bits(strip.reshape(-1), bits)
+
+    image.paste(Image.fromarray(strip, "RGB"), (0, 0))
+    return image
+
+
+def _extract_numpy(image: Image.Image):
+    # Returns (stored payload, header flags), or None when the image has no
+    # frame magic; reads exactly the ceil((header + payload) * 8 / 3) pixels
+    # that hold the frame
+    capacity = (image.width * image.height * 3) // 8
+    if capacity < PREFIX_SIZE:
+        return None
+
+    read_bits = _value_bit_reader(image)
+    prefix = read_bytes(read_bits, PREFIX_SIZE, "image")
+    if not prefix.startswith(_MAGIC):
+        return None
+    return read_frame(read_bits, prefix, "image", capacity)
+
+
+def _embed_stepic(image: Image.Image, data: bytes) -> Image.Image:
+    # Writes into `image` in place using stepic's layout
+    rows = _rows_for(image, len(data) * 9)
+    strip = np.array(image.crop((0, 0, image.width, rows)), dtype=np.uint8)
+    flat = strip.reshape(-1)
+
+    bits = to_bits(data).reshape(-1, 8)
+    groups = flat[:len(data) * 9].reshape(-1, 9)
+    groups[:, :8] = (groups[:, :8] & 0xFE) | bits
+    groups[:, 8] &= 0xFE
+    groups[-1, 8] |= 1
+
+    image.paste(Image.fromarray(strip, "RGB"), (0, 0))
+    return image
+
+
+def _extract_stepic(image: Image.Image) -> bytes:
+    total_groups = (image.width * image.height * 3) // 9
+    scan_groups = _SCAN_GROUPS
+
+    # Read a growing prefix of rows until the terminator bit shows up
+    while True:
+        scan_groups = min(scan_groups, total_groups)
+        groups = _read_values(image, scan_groups * 9).reshape(-1, 9)
+
+        terminators = np.flatnonzero(groups[:, 8] & 1)
+        if terminators.size:
+            last = int(terminators[0])
+            return from_bits(groups[:last + 1, :8] & 1)
+        if scan_groups == total_groups:
+            raise ValueError("No hidden message found in image")
+        scan_groups *= 2
+
+
+def _open_image(source) -> Image.Image:
+    # Accepts a file path, encoded image bytes, a binary file object or an
+    # HxWx3 uint8 array, so callers can skip temp files for small images
+    if isinstance(source, np.ndarray):
+        return Image.fromarray(source.astype(np.uint8, copy=False))
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        if len(source) == 0:
+            raise ValueError("Input image is empty")
+        return Image.open(io.BytesIO(source))
+    if isinstance(source, (str, os.PathLike)):
+        if not os.path.exists(source):
+            print(f"[ERROR] Input file does not exist: {source}")
+            raise FileNotFoundError(f"Input file does not exist: {source}")
+        file_size = os.path.getsize(source)
         print(f"[DEBUG] Input file size: {file_size} bytes")
-        
-        # Check if file is empty
         if file_size == 0:
-            print(f"[ERROR] Input file is empty: {input_image_path}")
-            raise ValueError(f"Input file is empty: {input_image_path}")
-            
+            print(f"[ERROR] Input file is empty: {source}")
+            raise ValueError(f"Input file is empty: {source}")
+    return Image.open(source)
+
+
+def _describe(source) -> str:
+    if isinstance(source, (str, os.PathLike)):
+        return str(source)
+    return f"<in-memory {type(source).__name__}>"
+
+
+def image_capacity(source, engine: str = DEFAULT_ENGINE) -> dict:
+    """
+    Largest message, in UTF-8 bytes, that encode_image can hide in an image.
+
+    PIL's Image.open only parses the header, so no pixel data is decoded and
+    a prefix of the file holding the header is enough.
+
+    :param source: Path, image bytes or binary file object
+    :return: {"media", "width", "height", "engine", "capacity_bytes"}
+    """
+    from PIL import UnidentifiedImageError
+    _validate_engine(engine)
+    try:
+        image = _open_image(source)
+    except UnidentifiedImageError as uie:
+        raise ValueError(f"Not a valid image file or format: {uie}")
+    return {
+        "media": "image",
+        "width": image.width,
+        "height": image.height,
+        "engine": engine,
+        "capacity_bytes": _capacity(image, engine),
+    }
+
+
+def encode_image(input_image, message: str, output_image=None, engine: str = DEFAULT_ENGINE,
+                 compression: str = DEFAULT_COMPRESSION):
+    """
+    Hide `message` in an image.
+
+    :param input_image: Path, PNG bytes, binary file object or HxWx3 uint8 array
+    :param output_image: Path or binary file object to write the PNG to; when
+        None the encoded PNG is returned as bytes
+    :param compression: Compression applied to the message before
+        embedding (numpy engine only); recorded in the header for decoding
+    :return: The encoded PNG bytes when output_image is None, otherwise None
+    """
+    try:
+        print(f"[DEBUG] Opening image for encoding: {_describe(input_image)}")
         # Verify image format before opening
         try:
             from PIL import UnidentifiedImageError
-            image = Image.open(input_image_path)
+            image = _open_image(input_image)
             print(f"[DEBUG] Image format: {image.format}")
-            image = image.convert("RGB")
-            print(f"[DEBUG] Image opened successfully, size: {image.size}, mode: {image.mode}")
         except UnidentifiedImageError as uie:
             print(f"[ERROR] Invalid image format: {uie}")
             raise ValueError(f"Not a valid image file or format: {uie}")
         
-        # Check if message is too long for the image
-        max_bytes = (image.width * image.height * 3) // 8
-        message_bytes = message.encode('utf-8')
+        _validate_engine(engine)
+        if engine == "stepic" and compression != "none":
+            raise ValueError("The stepic engine has no header to record compression in; use the numpy engine")
+
+        # Check if message is too long for the image; the size comes from the
+        # header, so this fails before any pixel data is decoded
+        max_bytes = _capacity(image, engine)
+        message_bytes = compress(message.encode('utf-8'), compression)
         message_length = len(message_bytes)
-        print(f"[DEBUG] Message length: {message_length} bytes, max capacity: {max_bytes} bytes")
+        print(f"[DEBUG] Message length: {message_length} bytes ({compression} compression), max capacity: {max_bytes} bytes")
         
         if message_length > max_bytes:
             print(f"[ERROR] Message too large for image: {message_length} > {max_bytes}")
             raise ValueError(f"Message is too large for this image. Max: {max_bytes} bytes, Message: {message_length} bytes")
         
-        print(f"[DEBUG] Encoding message of length {len(message)} characters")
+        if not message:
+            raise ValueError("Message is empty")
+
+        with timed("carrier_decode", "image"):
+            image = image.convert("RGB")
+        print(f"[DEBUG] Image opened successfully, size: {image.size}, mode: {image.mode}")
+        
+        print(f"[DEBUG] Encoding message of length {len(message)} characters with {engine} engine")
         try:
-            encoded_image = stepic.encode(image, message_bytes)
+            with timed("embed", "image"):
+                if engine == "numpy":
+                    encoded_image = _embed_numpy(image, message_bytes, flags_for(compression))
+                else:
+                    encoded_image = _embed_stepic(image, message_bytes)
             print(f"[DEBUG] Message encoded successfully")
-        except Exception as stepic_error:
-            print(f"[ERROR] Stepic encoding failed: {stepic_error}")
-            raise ValueError(f"Stepic encoding failed: {stepic_error}")
+        except Exception as engine_error:
+            print(f"[ERROR] {engine} encoding failed: {engine_error}")
+            raise ValueError(f"{engine} encoding failed: {engine_error}")
         
-        print(f"[DEBUG] Saving encoded image to {output_image_path}")
         try:
-            encoded_image.save(output_image_path)
-            print(f"[DEBUG] Encoded image saved successfully, size: {os.path.getsize(output_image_path)} bytes")
+            if output_image is None:
+                buffer = io.BytesIO()
+                with timed("output_encode", "image"):
+                    encoded_image.save(buffer, format="PNG")
+                print(f"[DEBUG] Encoded image kept in memory, size: {buffer.tell()} bytes")
+                return buffer.getvalue()
+            print(f"[DEBUG] Saving encoded image to {_describe(output_image)}")
+            with timed("output_encode", "image"):
+                if isinstance(output_image, (str, os.PathLike)):
+                    encoded_image.save(output_image)
+                else:
+                    encoded_image.save(output_image, format="PNG")
+            if isinstance(output_image, (str, os.PathLike)):
+                print(f"[DEBUG] Encoded image saved successfully, size: {os.path.getsize(output_image)} bytes")
         except Exception as save_error:
             print(f"[ERROR] Failed to save encoded image: {save_error}")
             raise IOError(f"Failed to save encoded image: {save_error}")
@@ -61,32 +257,58 @@ def encode_image(input_image_path: str, message: str, output_image_path: str) ->
         traceback.print_exc()
         raise
 
-def decode_image(stego_image_path: str) -> str:
+def _legacy_text(data: bytes) -> str:
+    # Strict UTF-8 text, as the frontend encodes it; control characters other
+    # than line breaks and tabs mean the image holds no message
     try:
-        print(f"[DEBUG] Opening image for decoding: {stego_image_path}")
-        image = Image.open(stego_image_path).convert("RGB")
+        text = data.decode('utf-8')
+    except UnicodeDecodeError:
+        raise ValueError("No hidden message found in image")
+    if not text or not text.replace("\n", "").replace("\r", "").replace("\t", "").isprintable():
+        raise ValueError("No hidden message found in image")
+    return text
+
+
+def decode_image(stego_image, engine: str = DEFAULT_ENGINE) -> str:
+    """
+    Read the message hidden in an image.
+
+    :param stego_image: Path, PNG bytes, binary file object or HxWx3 uint8 array
+    """
+    try:
+        _validate_engine(engine)
+        
+        print(f"[DEBUG] Opening image for decoding: {_describe(stego_image)}")
+        # No full-image convert("RGB"): the extractors convert only the rows they read
+        image = _open_image(stego_image)
         print(f"[DEBUG] Image opened successfully, size: {image.size}, mode: {image.mode}")
         
-        print("[DEBUG] Attempting to decode with stepic")
-        hidden_message = stepic.decode(image)
-        print(f"[DEBUG] Raw decoded message type: {type(hidden_message)}")
+        print(f"[DEBUG] Attempting to decode with {engine} engine")
+        # Extraction decodes only the rows it reads, so this covers the carrier decode too
+        with timed("extract", "image"):
+            frame = _extract_numpy(image) if engine == "numpy" else None
+            if frame is not None:
+                hidden_message, flags = frame
+                # Compression is detected from the header flags
+                hidden_message = decompress(hidden_message, method_for(flags))
+            elif engine == "numpy":
+                # No frame magic: images encoded before the numpy engine use
+                # stepic's layout. Without a header any image "decodes", so
+                # only readable text is accepted as a message.
+                print(f"[DEBUG] No payload header found, falling back to the stepic layout")
+                return _legacy_text(_extract_stepic(image))
+            else:
+                hidden_message = _extract_stepic(image)
+        print(f"[DEBUG] Raw decoded message length: {len(hidden_message)} bytes")
         
-        if hidden_message is None:
-            print("[WARNING] stepic.decode returned None")
-            return ""
-            
-        if isinstance(hidden_message, bytes):
-            try:
-                decoded_text = hidden_message.decode('utf-8')
-                print(f"[DEBUG] Successfully decoded UTF-8 message: {decoded_text[:30]}...")
-                return decoded_text
-            except UnicodeDecodeError as ude:
-                print(f"[ERROR] UTF-8 decode error: {ude}")
-                # Try another encoding or return raw bytes as string
-                return str(hidden_message)
-        else:
-            print(f"[DEBUG] Message is already string: {hidden_message[:30]}...")
-            return hidden_message
+        try:
+            decoded_text = hidden_message.decode('utf-8')
+            print(f"[DEBUG] Successfully decoded UTF-8 message: {decoded_text[:30]}...")
+            return decoded_text
+        except UnicodeDecodeError as ude:
+            print(f"[ERROR] UTF-8 decode error: {ude}")
+            # Fall back to one character per byte, as stepic itself returns
+            return hidden_message.decode('latin-1')
     except Exception as e:
         print(f"[ERROR] Exception in decode_image: {e}")
         raise
\ No newline at end of file
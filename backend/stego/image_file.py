@@ -1,32 +1,345 @@
 import os
-import uuid
+import mmap
+import struct
+import zlib
 import mimetypes
 
-def encode_image_with_file(input_image_path: str, file_path: str, output_image_path: str) -> None:
-    # Append file bytes after IEND chunk of PNG
-    with open(input_image_path, 'rb') as img_f, open(file_path, 'rb') as file_f:
-        img_data = img_f.read()
-        file_data = file_f.read()
-    # Find IEND chunk (last 12 bytes of PNG)
-    iend = img_data.rfind(b'IEND')
-    if iend == -1:
+from stego.options import DEFAULT_COMPRESSION
+from stego.compression import compressor, iter_decompress, flags_for, method_for
+
+# Layout of the data appended after IEND. Version 1 was b"FILESEP" followed by
+# one file. Version 2 appends any number of files, then a directory describing
+# them and a fixed-size trailer at the very end of the image, so decoding
+# seeks from the end instead of scanning and reads only the file it extracts:
+#   [PNG ... IEND][file 1][file 2]...[directory][trailer]
+# The trailer ends with the version byte and the magic.
+PAYLOAD_VERSION = 2
+
+_MAGIC = b"STGF"
+_TRAILER_TAIL = struct.Struct(">B4s")
+# directory offset, directory length, file count, CRC32 of the directory, version, magic
+_TRAILER = struct.Struct(">QIIIB4s")
+# Directory entry: file offset, stored size, original size, CRC32 of the
+# original bytes, compression flags, filename length, MIME type length;
+# followed by the filename and MIME type in UTF-8
+_ENTRY = struct.Struct(">QQQIBHH")
+_LEGACY_SEPARATOR = b"FILESEP"
+
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+_CHUNK_HEADER = struct.Struct(">I4s")
+
+# Bytes copied per step when embedding or extracting
+_COPY_CHUNK = 1024 * 1024
+
+# A PNG with nothing appended ends with an empty IEND chunk: length, type, CRC
+_IEND_CHUNK = b"\x00\x00\x00\x00IEND\xaeB`\x82"
+
+
+def _png_end(f) -> int:
+    # Offset just past the IEND chunk, found by walking the chunk headers; chunk
+    # data is skipped with seeks, so nothing is scanned
+    f.seek(0)
+    if f.read(len(_PNG_SIGNATURE)) != _PNG_SIGNATURE:
         raise ValueError('Invalid PNG file')
-    # Insert file after IEND chunk
-    new_img = img_data + b'FILESEP' + file_data
-    with open(output_image_path, 'wb') as out_f:
-        out_f.write(new_img)
-
-def decode_file_from_image(stego_image_path: str, output_dir: str) -> str:
-    with open(stego_image_path, 'rb') as f:
-        data = f.read()
-    sep = b'FILESEP'
-    idx = data.find(sep)
-    if idx == -1:
+    while True:
+        header = f.read(_CHUNK_HEADER.size)
+        if len(header) < _CHUNK_HEADER.size:
+            raise ValueError('Invalid PNG file: no IEND chunk')
+        length, chunk_type = _CHUNK_HEADER.unpack(header)
+        # Chunk data, then its 4-byte CRC
+        f.seek(length + 4, os.SEEK_CUR)
+        if chunk_type == b'IEND':
+            return f.tell()
+
+
+def _carrier_end(f) -> int:
+    # Plain carriers end with IEND, so checking the signature and the last 12
+    # bytes is enough; carriers with data already appended need the chunk walk
+    file_size = f.seek(0, os.SEEK_END)
+    if file_size >= len(_PNG_SIGNATURE) + len(_IEND_CHUNK):
+        f.seek(file_size - len(_IEND_CHUNK))
+        if f.read(len(_IEND_CHUNK)) == _IEND_CHUNK:
+            f.seek(0)
+            if f.read(len(_PNG_SIGNATURE)) == _PNG_SIGNATURE:
+                return file_size
+    return _png_end(f)
+
+
+def _copy_carrier(src, dst, count: int) -> None:
+    # Copy the first `count` bytes of src into the empty output, inside the
+    # kernel where possible, falling back to a buffered copy
+    if hasattr(os, "copy_file_range"):
+        copied = 0
+        try:
+            while copied < count:
+                step = os.copy_file_range(src.fileno(), dst.fileno(), count - copied, copied, copied)
+                if step == 0:
+                    raise ValueError('Carrier image was truncated while copying')
+                copied += step
+            dst.seek(count)
+            return
+        except OSError:
+            # Not supported between these files, e.g. on older kernels
+            pass
+    src.seek(0)
+    dst.seek(0)
+    remaining = count
+    while remaining:
+        chunk = src.read(min(_COPY_CHUNK, remaining))
+        if not chunk:
+            raise ValueError('Carrier image was truncated while copying')
+        dst.write(chunk)
+        remaining -= len(chunk)
+
+
+def _copy_with_crc(src, dst) -> tuple:
+    # Copy src to dst through one reused buffer, returning (bytes copied, CRC32)
+    buffer = bytearray(_COPY_CHUNK)
+    view = memoryview(buffer)
+    length = crc = 0
+    while True:
+        read = src.readinto(buffer)
+        if not read:
+            return length, crc
+        crc = zlib.crc32(view[:read], crc)
+        dst.write(view[:read])
+        length += read
+
+
+def _copy_compressed(src, dst, method: str) -> tuple:
+    # Compress src into dst through one reused buffer, returning
+    # (bytes written, bytes read, CRC32 of the bytes read)
+    stream = compressor(method)
+    buffer = bytearray(_COPY_CHUNK)
+    view = memoryview(buffer)
+    stored = length = crc = 0
+    while True:
+        read = src.readinto(buffer)
+        if not read:
+            break
+        crc = zlib.crc32(view[:read], crc)
+        length += read
+        data = stream.compress(view[:read])
+        dst.write(data)
+        stored += len(data)
+    data = stream.flush()
+    dst.write(data)
+    return stored + len(data), length, crc
+
+
+def _safe_filename(filename: str) -> str:
+    name = os.path.basename((filename or "").replace("\\", "/")).strip()
+    return name if name not in ("", ".", "..") else ""
+
+
+def _unique_filename(filename: str, taken: set) -> str:
+    # "notes.txt", "notes (2).txt", ... so every file can be extracted by name
+    stem, ext = os.path.splitext(filename)
+    candidate, counter = filename, 1
+    while candidate in taken:
+        counter += 1
+        candidate = f"{stem} ({counter}){ext}"
+    return candidate
+
+
+def encode_image_with_files(input_image_path: str, files: list, output_image_path: str,
+                            compression: str = DEFAULT_COMPRESSION) -> list:
+    """
+    Append files after the IEND chunk of a PNG, followed by a directory of
+    their names, MIME types, offsets, sizes and CRC32s and a trailer locating it.
+
+    The carrier and the files are streamed into the output, the carrier with
+    os.copy_file_range where available, so memory use does not grow with
+    their size. With compression each file is compressed on the way.
+
+    :param files: (path, filename, mime_type) tuples. The filename defaults to
+        the basename of the path and repeated names get a " (2)" suffix; the
+        MIME type defaults to, or when generic is replaced by, one guessed from the name.
+    :param compression: Compression applied to every file; recorded per entry
+    :return: Directory entries, {"filename", "mime_type", "offset", "stored_size",
+        "size", "crc32", "compression"} per file
+    """
+    if not files:
+        raise ValueError('No files to hide')
+    flags = flags_for(compression)
+
+    entries = []
+    taken = set()
+    for path, filename, mime_type in files:
+        filename = _unique_filename(_safe_filename(filename or path) or "file", taken)
+        taken.add(filename)
+        if not mime_type or mime_type == "application/octet-stream":
+            mime_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        entries.append({"path": path, "filename": filename, "mime_type": mime_type, "compression": compression})
+
+    with open(input_image_path, 'rb') as img_f, open(output_image_path, 'wb') as out_f:
+        # Anything already appended to the carrier is dropped
+        offset = _carrier_end(img_f)
+        _copy_carrier(img_f, out_f, offset)
+        directory = bytearray()
+        for entry in entries:
+            with open(entry.pop("path"), 'rb') as file_f:
+                if compression == "none":
+                    size, crc = _copy_with_crc(file_f, out_f)
+                    stored = size
+                else:
+                    stored, size, crc = _copy_compressed(file_f, out_f, compression)
+            entry.update(offset=offset, stored_size=stored, size=size, crc32=crc)
+            offset += stored
+            name_bytes = entry["filename"].encode('utf-8')
+            mime_bytes = entry["mime_type"].encode('utf-8')
+            directory += _ENTRY.pack(entry["offset"], stored, size, crc, flags, len(name_bytes), len(mime_bytes))
+            directory += name_bytes + mime_bytes
+        out_f.write(directory)
+        out_f.write(_TRAILER.pack(
+            offset, len(directory), len(entries), zlib.crc32(directory), PAYLOAD_VERSION, _MAGIC,
+        ))
+    return entries
+
+
+def encode_image_with_file(input_image_path: str, file_path: str, output_image_path: str,
+                           filename: str = None, mime_type: str = None,
+                           compression: str = DEFAULT_COMPRESSION) -> None:
+    """
+    Append one file after the IEND chunk of a PNG; see encode_image_with_files.
+
+    :param filename: Name stored for extraction (default: basename of file_path)
+    :param mime_type: MIME type stored for extraction (default, or when generic: guessed from the name)
+    """
+    encode_image_with_files(input_image_path, [(file_path, filename, mime_type)], output_image_path, compression)
+
+
+def _read_directory(f, file_size: int) -> list:
+    f.seek(file_size - _TRAILER.size)
+    offset, length, count, crc, _, _ = _TRAILER.unpack(f.read(_TRAILER.size))
+    if offset + length + _TRAILER.size != file_size or count * _ENTRY.size > length:
+        raise ValueError('Corrupt hidden file directory')
+    f.seek(offset)
+    directory = f.read(length)
+    if zlib.crc32(directory) != crc:
+        raise ValueError('Hidden file directory failed CRC check')
+
+    files = []
+    position = 0
+    for _ in range(count):
+        file_offset, stored, size, file_crc, flags, name_len, mime_len = _ENTRY.unpack_from(directory, position)
+        position += _ENTRY.size
+        name = directory[position:position + name_len].decode('utf-8', errors='replace')
+        position += name_len
+        mime_type = directory[position:position + mime_len].decode('utf-8', errors='replace')
+        position += mime_len
+        if file_offset + stored > offset:
+            raise ValueError('Corrupt hidden file directory')
+        files.append({
+            "filename": name,
+            "mime_type": mime_type,
+            "offset": file_offset,
+            "stored_size": stored,
+            "size": size,
+            "crc32": file_crc,
+            "compression": method_for(flags),
+        })
+    return files
+
+
+def _read_index(f) -> dict:
+    file_size = f.seek(0, os.SEEK_END)
+    if file_size >= _TRAILER.size:
+        f.seek(file_size - _TRAILER_TAIL.size)
+        version, magic = _TRAILER_TAIL.unpack(f.read(_TRAILER_TAIL.size))
+        if magic == _MAGIC:
+            if version != PAYLOAD_VERSION:
+                raise ValueError(f'Unsupported payload version: {version}')
+            return {"version": version, "files": _read_directory(f, file_size)}
+
+    # Legacy layout: the separator directly follows the IEND chunk
+    png_end = _png_end(f)
+    f.seek(png_end)
+    if f.read(len(_LEGACY_SEPARATOR)) != _LEGACY_SEPARATOR:
         raise ValueError('No file hidden in image')
-    file_data = data[idx+len(sep):]
-    # Guess file type
-    ext = mimetypes.guess_extension(mimetypes.guess_type('file')[0] or '') or '.bin'
-    output_path = os.path.join(output_dir, f"extracted_{uuid.uuid4()}{ext}")
-    with open(output_path, 'wb') as out_f:
-        out_f.write(file_data)
-    return output_path
+    offset = png_end + len(_LEGACY_SEPARATOR)
+    return {"version": 1, "files": [{
+        "filename": "",
+        "mime_type": "application/octet-stream",
+        "offset": offset,
+        "stored_size": file_size - offset,
+        "size": file_size - offset,
+        "crc32": None,
+        "compression": "none",
+    }]}
+
+
+def read_file_index(source) -> dict:
+    """
+    List the files hidden in an image by reading only the trailer and the
+    directory before it.
+
+    :param source: Path or binary file object of the stego image
+    :return: {"version", "files"}, with {"filename", "mime_type", "offset",
+        "stored_size", "size", "crc32", "compression"} per file; legacy images
+        have no name or checksum
+    """
+    if hasattr(source, 'read'):
+        return _read_index(source)
+    with open(source, 'rb') as f:
+        return _read_index(f)
+
+
+def _mapped_chunks(mapped, start: int, end: int):
+    # Fixed-size slices of mapped[start:end]; the pages of each slice are
+    # released once the next one is requested, so they do not stay resident
+    for position in range(start, end, _COPY_CHUNK):
+        chunk_end = min(position + _COPY_CHUNK, end)
+        yield mapped[position:chunk_end]
+        if hasattr(mmap, "MADV_DONTNEED"):
+            page_start = position - position % mmap.PAGESIZE
+            mapped.madvise(mmap.MADV_DONTNEED, page_start, chunk_end - page_start)
+
+
+def decode_file_from_image(stego_image_path: str, output_dir: str, name: str = None) -> dict:
+    """
+    Extract one file hidden in an image into output_dir under its stored name.
+
+    Only that file's bytes are read: they are located from the directory and
+    copied out of a memory map in fixed-size steps, releasing each step's
+    pages once written, so memory use does not grow with the file. Compressed
+    files are decompressed on the way, and the CRC32 and size of the output
+    are checked against the directory.
+
+    :param name: Stored filename to extract (default: the first file)
+    :return: The file's directory entry plus "version" and "path" of the extracted file
+    """
+    index = read_file_index(stego_image_path)
+    if name is None:
+        info = index["files"][0]
+    else:
+        info = next((entry for entry in index["files"] if entry["filename"] == name), None)
+        if info is None:
+            raise ValueError(f"No file named '{name}' hidden in image")
+
+    ext = os.path.splitext(info["filename"])[1] or mimetypes.guess_extension(info["mime_type"]) or '.bin'
+    filename = _safe_filename(info["filename"]) or f"extracted{ext}"
+    output_path = os.path.join(output_dir, filename)
+    if os.path.exists(output_path):
+        output_path = os.path.join(output_dir, f"extracted_{filename}")
+
+    start, end = info["offset"], info["offset"] + info["stored_size"]
+    crc = size = 0
+    try:
+        with open(stego_image_path, 'rb') as f, open(output_path, 'wb') as out_f:
+            if info["stored_size"]:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    for piece in iter_decompress(_mapped_chunks(mapped, start, end), info["compression"]):
+                        size += len(piece)
+                        if size > info["size"]:
+                            raise ValueError('Hidden file is larger than its directory entry')
+                        crc = zlib.crc32(piece, crc)
+                        out_f.write(piece)
+        if size != info["size"]:
+            raise ValueError('Hidden file is smaller than its directory entry')
+        if info["crc32"] is not None and crc != info["crc32"]:
+            raise ValueError('Hidden file failed CRC check')
+    except Exception:
+        os.remove(output_path)
+        raise
+    return dict(info, version=index["version"], path=output_path)
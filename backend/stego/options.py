@@ -0,0 +1,36 @@
+# stego/options.py
+# Engine and output-mode choices the routes need when they are defined. This
+# module imports nothing heavy, so the API can start without loading numpy,
+# PIL, pydub or cv2; the codec modules themselves are imported on first use.
+
+# Image LSB engines, see stego/image.py:
+# - "numpy" writes the payload frame shared with audio and video (stego/core.py:
+#   magic, version, flags, payload length, CRC32, then the payload), packed 3
+#   bits per pixel from the first pixel on. Decoding reads the header first and
+#   then only the pixels the declared length covers.
+# - "stepic" writes stepic's layout (one byte per 3 pixels, the 9th channel LSB
+#   marking the last byte) and reads images produced by the stepic library.
+ENGINES = ("numpy", "stepic")
+DEFAULT_ENGINE = "numpy"
+
+# Output modes for video carrier frames, see stego/video.py. "lossy" encodes
+# them with mp4v, which does not preserve the embedded LSBs. "lossless" encodes
+# them with FFV1 into an MKV.
+OUTPUT_MODES = ("lossy", "lossless")
+DEFAULT_OUTPUT_MODE = "lossy"
+
+# Payload compression, see stego/compression.py. The method is recorded in the
+# payload header, so decoding detects it. zlib is always available; zstd and
+# lz4 need the optional zstandard and lz4 packages.
+COMPRESSIONS = ("none", "zlib", "zstd", "lz4")
+DEFAULT_COMPRESSION = "none"
+_COMPRESSION_PACKAGES = {"zstd": "zstandard", "lz4": "lz4"}
+
+
+def available_compressions() -> tuple:
+    """Compression methods usable here; the optional packages are looked up, not imported."""
+    import importlib.util
+    return tuple(
+        method for method in COMPRESSIONS
+        if method not in _COMPRESSION_PACKAGES or importlib.util.find_spec(_COMPRESSION_PACKAGES[method]) is not None
+    )
@@ -0,0 +1,135 @@
+import hashlib
+import os
+import re
+
+from fastapi.responses import FileResponse, Response
+from starlette.datastructures import Headers
+
+from utils.executors import run_io
+from utils.scratch import TEMP_DIR
+
+# Encoded outputs are kept as TEMP_DIR/artifact-<sha256><ext> so an interrupted
+# download can be resumed with a Range request to /artifacts/<sha256><ext>.
+# They expire through the temp sweeper's age and size quotas like any other entry.
+# Artifacts are public to anyone with the URL, so only encoded carriers are
+# published; decoded content is served from the request scratch space.
+ARTIFACT_PREFIX = "artifact-"
+_ARTIFACT_NAME = re.compile(r"^[0-9a-f]{64}(\.[A-Za-z0-9]{1,8})?$")
+
+_HASH_CHUNK = 1024 * 1024
+
+
+def _file_digest(path: str) -> str:
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(_HASH_CHUNK)
+            if not chunk:
+                break
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match is None:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison, as RFC 9110 requires for If-None-Match
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+def _not_modified(scope, etag: str) -> bool:
+    # 304 is only defined for GET and HEAD (RFC 9110 section 13.1.2). Encode
+    # routes answer POST, where the work is already done, so they always send
+    # the body rather than a 412.
+    if scope["method"] not in ("GET", "HEAD"):
+        return False
+    return _etag_matches(Headers(scope=scope).get("if-none-match"), etag)
+
+
+def publish_file(path: str) -> tuple:
+    """
+    Move a finished output out of its request scratch space into the artifact store.
+
+    :param path: Encoded output file
+    :return: (artifact path, SHA-256 hex digest of the content)
+    """
+    digest = _file_digest(path)
+    ext = os.path.splitext(path)[1].lower()
+    artifact = os.path.join(TEMP_DIR, f"{ARTIFACT_PREFIX}{digest}{ext}")
+    # Same file system as the scratch space, so this is a rename, not a copy
+    os.replace(path, artifact)
+    return artifact, digest
+
+
+def artifact_filename(name: str) -> str:
+    """Download name of an artifact (path or public name): encoded<ext>."""
+    return f"encoded{os.path.splitext(name)[1].lower()}"
+
+
+def artifact_path(name: str):
+    """Path of a stored artifact by its public name, or None if unknown or expired."""
+    if not _ARTIFACT_NAME.match(name):
+        return None
+    path = os.path.join(TEMP_DIR, f"{ARTIFACT_PREFIX}{name}")
+    return path if os.path.isfile(path) else None
+
+
+class ArtifactFileResponse(FileResponse):
+    """
+    FileResponse with a content-hash ETag that answers a matching If-None-Match
+    on GET or HEAD with 304.
+
+    Range and If-Range requests, and the ASGI pathsend extension (zero-copy
+    sendfile on servers that implement it), are handled by FileResponse itself.
+    """
+
+    def __init__(self, path: str, digest: str, media_type: str = None, filename: str = None):
+        self.etag = f'"{digest}"'
+        super().__init__(
+            path,
+            media_type=media_type,
+            filename=filename,
+            headers={
+                "ETag": self.etag,
+                "Content-Location": f"/artifacts/{os.path.basename(path)[len(ARTIFACT_PREFIX):]}",
+            },
+        )
+
+    async def __call__(self, scope, receive, send):
+        if _not_modified(scope, self.etag):
+            await Response(status_code=304, headers={"ETag": self.etag})(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+
+class ArtifactBytesResponse(Response):
+    """In-memory encoded output with a content-hash ETag; see ArtifactFileResponse."""
+
+    def __init__(self, data: bytes, media_type: str, filename: str):
+        self.etag = f'"{hashlib.sha256(data).hexdigest()}"'
+        super().__init__(
+            content=data,
+            media_type=media_type,
+            headers={
+                "ETag": self.etag,
+                "Content-Disposition": f'attachment; filename="{filename}"',
+            },
+        )
+
+    async def __call__(self, scope, receive, send):
+        if _not_modified(scope, self.etag):
+            await Response(status_code=304, headers={"ETag": self.etag})(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+
+async def artifact_response(path: str, media_type: str = None) -> ArtifactFileResponse:
+    """
+    Publish an encoded carrier and return a resumable response for it. The
+    download name is artifact_filename(), the same name /artifacts serves.
+    """
+    artifact, digest = await run_io(publish_file, path)
+    print(f"[INFO] Serving artifact {os.path.basename(artifact)}, size: {os.path.getsize(artifact)} bytes")
+    return ArtifactFileResponse(artifact, digest, media_type=media_type, filename=artifact_filename(artifact))
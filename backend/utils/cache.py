@@ -0,0 +1,221 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from utils.artifacts import artifact_path, ArtifactFileResponse, ArtifactBytesResponse, ARTIFACT_PREFIX
+from utils.executors import run_io
+from utils.scratch import TEMP_SWEEP_INTERVAL_SECONDS
+
+# Result cache for encode and decode requests, keyed by the hashes of the
+# inputs plus the payload format version. Values are small dicts:
+#   {"url": ...}                                        S3 URL of an encoded output
+#   {"artifact": name, "media_type": ..., "filename": ...}  file in the artifact store
+#   {"data": bytes, "media_type": ..., "filename": ...}      in-memory output (memory tier only)
+#   {"message": ...}                                    decoded text
+RESULT_CACHE_ENTRIES = int(os.getenv("RESULT_CACHE_ENTRIES", "256"))
+RESULT_CACHE_MEMORY_BYTES = int(os.getenv("RESULT_CACHE_MEMORY_MB", "64")) * 1024 * 1024
+RESULT_CACHE_TTL_SECONDS = int(os.getenv("RESULT_CACHE_TTL_SECONDS", "3600"))
+
+# Optional on-disk tier, shared by worker processes; unset keeps the cache in memory only
+RESULT_CACHE_DIR = os.getenv("RESULT_CACHE_DIR")
+RESULT_CACHE_DISK_BYTES = int(os.getenv("RESULT_CACHE_DISK_MB", "256")) * 1024 * 1024
+
+# Fixed per-entry overhead counted against the memory budget
+_ENTRY_OVERHEAD = 512
+
+_memory = OrderedDict()  # key -> (expires at, size, value)
+_memory_bytes = 0
+_lock = threading.Lock()
+_counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+
+def cache_key(operation: str, *parts) -> str:
+    """
+    Key for an operation and its inputs, e.g.
+    cache_key("image-encode", engine, PAYLOAD_VERSION, sha256(carrier), message).
+    """
+    hasher = hashlib.sha256(operation.encode())
+    for part in parts:
+        data = part if isinstance(part, bytes) else str(part).encode("utf-8")
+        # Length prefix so ("ab", "c") and ("a", "bc") give different keys
+        hasher.update(len(data).to_bytes(8, "big"))
+        hasher.update(data)
+    return hasher.hexdigest()
+
+
+def _count(counter: str, amount: int = 1) -> None:
+    with _lock:
+        _counters[counter] += amount
+
+
+def _memory_get(key: str):
+    with _lock:
+        entry = _memory.get(key)
+        if entry is None:
+            return None
+        expires, size, value = entry
+        if expires < time.time():
+            _drop(key)
+            return None
+        _memory.move_to_end(key)
+        return value
+
+
+def _drop(key: str) -> None:
+    # Caller holds _lock
+    global _memory_bytes
+    _, size, _ = _memory.pop(key)
+    _memory_bytes -= size
+
+
+def _memory_put(key: str, value: dict) -> None:
+    global _memory_bytes
+    size = _ENTRY_OVERHEAD + len(value.get("data", b""))
+    if size > RESULT_CACHE_MEMORY_BYTES:
+        return
+    with _lock:
+        if key in _memory:
+            _drop(key)
+        _memory[key] = (time.time() + RESULT_CACHE_TTL_SECONDS, size, value)
+        _memory_bytes += size
+        while len(_memory) > RESULT_CACHE_ENTRIES or _memory_bytes > RESULT_CACHE_MEMORY_BYTES:
+            _drop(next(iter(_memory)))
+            _counters["evictions"] += 1
+
+
+def _disk_path(key: str) -> str:
+    return os.path.join(RESULT_CACHE_DIR, f"{key}.json")
+
+
+def _disk_get(key: str):
+    path = _disk_path(key)
+    try:
+        if time.time() - os.path.getmtime(path) > RESULT_CACHE_TTL_SECONDS:
+            os.remove(path)
+            return None
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _disk_put(key: str, value: dict) -> None:
+    # Entries can hold S3 URLs and decoded messages, so only this user may read them
+    os.makedirs(RESULT_CACHE_DIR, mode=0o700, exist_ok=True)
+    path = _disk_path(key)
+    partial = f"{path}.{os.getpid()}.tmp"
+    with os.fdopen(os.open(partial, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as f:
+        json.dump(value, f)
+    os.replace(partial, path)
+
+
+def sweep_disk() -> int:
+    """
+    Apply the TTL and size quota to the disk tier, oldest entries first.
+    Blocking; sweep_disk_forever runs it in the I/O pool.
+
+    :return: entries removed
+    """
+    now = time.time()
+    entries = []
+    with os.scandir(RESULT_CACHE_DIR) as scan:
+        for entry in scan:
+            if entry.name.endswith(".json"):
+                try:
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                except OSError:
+                    continue
+    removed = 0
+    total = sum(size for _, size, _ in entries)
+    for mtime, size, entry_path in sorted(entries):
+        if total <= RESULT_CACHE_DISK_BYTES and now - mtime <= RESULT_CACHE_TTL_SECONDS:
+            break
+        try:
+            os.remove(entry_path)
+            removed += 1
+        except OSError:
+            pass
+        total -= size
+    _count("evictions", removed)
+    return removed
+
+
+async def sweep_disk_forever() -> None:
+    """Background task running sweep_disk() every TEMP_SWEEP_INTERVAL_SECONDS."""
+    while True:
+        try:
+            if os.path.isdir(RESULT_CACHE_DIR):
+                removed = await run_io(sweep_disk)
+                if removed:
+                    print(f"[INFO] Result cache sweeper removed {removed} disk entries")
+        except Exception as sweep_error:
+            print(f"[WARNING] Result cache sweep failed: {sweep_error}")
+        await asyncio.sleep(TEMP_SWEEP_INTERVAL_SECONDS)
+
+
+async def lookup(key: str):
+    """Cached value for `key` from the memory tier, then the disk tier, or None."""
+    value = _memory_get(key)
+    if value is not None:
+        _count("memory_hits")
+        return value
+    if RESULT_CACHE_DIR:
+        value = await run_io(_disk_get, key)
+        if value is not None:
+            _count("disk_hits")
+            _memory_put(key, value)
+            return value
+    _count("misses")
+    return None
+
+
+async def store(key: str, value: dict) -> None:
+    """Cache `value`; in-memory outputs ("data") are not written to the disk tier."""
+    _memory_put(key, value)
+    _count("stores")
+    if RESULT_CACHE_DIR and "data" not in value:
+        try:
+            await run_io(_disk_put, key, value)
+        except OSError as disk_error:
+            print(f"[WARNING] Could not write result cache entry: {disk_error}")
+
+
+async def cached_response(key: str):
+    """
+    Response for a cached result, or None on a miss. Entries pointing at an
+    artifact the temp sweeper has since removed count as misses.
+    """
+    value = await lookup(key)
+    if value is None:
+        return None
+    if "artifact" in value:
+        path = artifact_path(value["artifact"])
+        if path is None:
+            return None
+        digest = os.path.splitext(value["artifact"])[0]
+        response = ArtifactFileResponse(path, digest, media_type=value["media_type"], filename=value["filename"])
+    elif "data" in value:
+        response = ArtifactBytesResponse(value["data"], media_type=value["media_type"], filename=value["filename"])
+    else:
+        response = {field: value[field] for field in ("url", "message") if field in value}
+    print(f"[INFO] Result cache hit: {key[:16]}")
+    return response
+
+
+def artifact_value(response: ArtifactFileResponse) -> dict:
+    """Cache value pointing at the artifact served by `response`."""
+    return {
+        "artifact": os.path.basename(response.path)[len(ARTIFACT_PREFIX):],
+        "media_type": response.media_type,
+        "filename": response.filename,
+    }
+
+
+def stats() -> dict:
+    with _lock:
+        return dict(_counters, entries=len(_memory), memory_bytes=_memory_bytes)
@@ -0,0 +1,106 @@
+import asyncio
+import importlib
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+
+from utils import metrics
+
+# Worker counts, sized from the CPU count unless overridden. At least two CPU
+# workers so a long video job cannot hold up every other request.
+CPU_COUNT = os.cpu_count() or 1
+CPU_WORKERS = int(os.getenv("STEGO_CPU_WORKERS", str(max(2, CPU_COUNT))))
+IO_WORKERS = int(os.getenv("STEGO_IO_WORKERS", str(min(32, CPU_COUNT * 4))))
+
+_cpu_pool = None
+_io_pool = None
+_cpu_in_flight = 0
+
+
+def _get_cpu_pool() -> ProcessPoolExecutor:
+    global _cpu_pool
+    if _cpu_pool is None:
+        # spawn rather than fork: the server process has running threads
+        _cpu_pool = ProcessPoolExecutor(
+            max_workers=CPU_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+        print(f"[INFO] Started CPU process pool with {CPU_WORKERS} workers")
+    return _cpu_pool
+
+
+def _get_io_pool() -> ThreadPoolExecutor:
+    global _io_pool
+    if _io_pool is None:
+        _io_pool = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="stego-io")
+        print(f"[INFO] Started I/O thread pool with {IO_WORKERS} workers")
+    return _io_pool
+
+
+async def run_cpu(func, *args, **kwargs):
+    """
+    Run a CPU-bound function (encode/decode) in the shared process pool.
+
+    The function and its arguments must be picklable, i.e. module-level
+    functions called with plain values such as file paths and strings.
+    Stage timings the function records in the worker are added to the metrics.
+    """
+    global _cpu_in_flight
+    loop = asyncio.get_running_loop()
+    _cpu_in_flight += 1
+    _update_cpu_gauges()
+    try:
+        result, stages = await loop.run_in_executor(
+            _get_cpu_pool(), partial(metrics.collect_stages, func, *args, **kwargs)
+        )
+    finally:
+        _cpu_in_flight -= 1
+        _update_cpu_gauges()
+    metrics.record_stages(stages)
+    return result
+
+
+def _update_cpu_gauges() -> None:
+    metrics.CPU_TASKS_IN_FLIGHT.set(_cpu_in_flight)
+    metrics.CPU_QUEUE_DEPTH.set(max(0, _cpu_in_flight - CPU_WORKERS))
+
+
+async def run_io(func, *args, **kwargs):
+    """Run a blocking I/O function (S3, file system) in the shared thread pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_io_pool(), partial(func, *args, **kwargs))
+
+
+def submit_io(func, *args, **kwargs):
+    """Start a blocking I/O function in the shared thread pool without waiting for it."""
+    return _get_io_pool().submit(func, *args, **kwargs)
+
+
+def _import_modules(modules) -> None:
+    for module in modules:
+        importlib.import_module(module)
+
+
+async def warm_up(modules) -> None:
+    """
+    Import `modules` in this process and in every CPU worker, starting the
+    worker processes on the way, so the first requests do not pay for it.
+    """
+    # One task per worker; each is busy importing when the next is submitted,
+    # so the pool spawns a new process for it
+    await asyncio.gather(*(run_cpu(_import_modules, modules) for _ in range(CPU_WORKERS)))
+    # Only once every worker has started: a spawned worker copies sys.path,
+    # which OpenCV's loader changes while it is being imported
+    await run_io(_import_modules, modules)
+
+
+def shutdown() -> None:
+    """Stop both pools; called when the application shuts down."""
+    global _cpu_pool, _io_pool
+    if _cpu_pool is not None:
+        _cpu_pool.shutdown(wait=True, cancel_futures=True)
+        _cpu_pool = None
+    if _io_pool is not None:
+        _io_pool.shutdown(wait=True, cancel_futures=True)
+        _io_pool = None
@@ -0,0 +1,235 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+# Prometheus text-format metrics, kept in process. With several uvicorn
+# workers each process has its own values, so scrape every worker or run one.
+#
+# Stages timed per media type:
+#   upload_receive  reading the upload body      disk_write     writing it to scratch
+#   carrier_decode  decoding the carrier media   embed/extract  LSB work
+#   output_encode   encoding the output file     s3_upload      storing the output
+#   response        sending the response body
+# Stages inside the stego functions run in the CPU worker processes; run_cpu
+# brings their timings back with the result (see collect_stages).
+
+# Histogram buckets in seconds, from small in-memory images to long videos
+_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+_lock = threading.Lock()
+_metrics = []
+
+# Media type of the request being handled, set by MetricsMiddleware
+_request_media = contextvars.ContextVar("request_media", default="other")
+
+# Stage timings recorded in a CPU worker while collect_stages is running
+_collected = None
+
+
+def _format_labels(names, values) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{value}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._values = {}
+        _metrics.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def _samples(self):
+        for key, value in sorted(self._values.items()):
+            yield self.name, _format_labels(self.labels, key), value
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        with _lock:
+            lines += [f"{name}{labels} {value}" for name, labels, value in self._samples()]
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels) -> None:
+        with _lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with _lock:
+            # [cumulative bucket counts, sum, count]
+            entry = self._values.setdefault(key, [[0] * len(_BUCKETS), 0.0, 0])
+            for index, bound in enumerate(_BUCKETS):
+                if value <= bound:
+                    entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def _samples(self):
+        bucket_labels = self.labels + ("le",)
+        for key, (counts, total, count) in sorted(self._values.items()):
+            for bound, bucket_count in zip(_BUCKETS, counts):
+                yield f"{self.name}_bucket", _format_labels(bucket_labels, key + (bound,)), bucket_count
+            yield f"{self.name}_bucket", _format_labels(bucket_labels, key + ("+Inf",)), count
+            yield f"{self.name}_sum", _format_labels(self.labels, key), round(total, 6)
+            yield f"{self.name}_count", _format_labels(self.labels, key), count
+
+
+STAGE_SECONDS = Histogram("stego_stage_seconds", "Time spent per request stage", ("media", "stage"))
+REQUEST_SECONDS = Histogram("stego_request_seconds", "Request latency, first byte in to last byte out", ("media",))
+REQUESTS = Counter("stego_requests_total", "Requests handled", ("media", "status"))
+BYTES_IN = Counter("stego_bytes_in_total", "Request body bytes received", ("media",))
+BYTES_OUT = Counter("stego_bytes_out_total", "Response body bytes sent", ("media",))
+REQUESTS_IN_FLIGHT = Gauge("stego_requests_in_flight", "Requests being handled", ("media",))
+CPU_TASKS_IN_FLIGHT = Gauge("stego_cpu_tasks_in_flight", "Encode/decode tasks submitted to the CPU pool and not yet finished")
+CPU_QUEUE_DEPTH = Gauge("stego_cpu_queue_depth", "Encode/decode tasks waiting for a free CPU worker")
+
+
+def current_media() -> str:
+    return _request_media.get()
+
+
+def record_stage(stage: str, seconds: float, media: str = None) -> None:
+    """Record a stage timing; `media` defaults to that of the current request."""
+    media = media or current_media()
+    if _collected is not None:
+        _collected.append((media, stage, seconds))
+    else:
+        STAGE_SECONDS.observe(seconds, media=media, stage=stage)
+
+
+@contextmanager
+def timed(stage: str, media: str = None):
+    """Time the enclosed block as `stage`."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - started, media)
+
+
+def collect_stages(func, *args, **kwargs) -> tuple:
+    """
+    Run `func` in a CPU worker, returning (result, stage timings) so the
+    server process can record the timings; see executors.run_cpu.
+    """
+    global _collected
+    _collected = []
+    try:
+        return func(*args, **kwargs), _collected
+    finally:
+        _collected = None
+
+
+def record_stages(stages) -> None:
+    for media, stage, seconds in stages:
+        STAGE_SECONDS.observe(seconds, media=media, stage=stage)
+
+
+def render() -> str:
+    lines = []
+    for metric in _metrics:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+
+# Path prefix -> media label
+_MEDIA_PREFIXES = (
+    ("/encode/", "image"),
+    ("/decode/", "image"),
+    ("/image-file/", "image_file"),
+    ("/audio/", "audio"),
+    ("/video/", "video"),
+    ("/capacity", "capacity"),
+)
+
+
+def _media_for(path: str) -> str:
+    for prefix, media in _MEDIA_PREFIXES:
+        if path.startswith(prefix):
+            return media
+    return "other"
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware counting bytes, in-flight requests and latency per media
+    type, and timing the response stage from the first to the last byte sent.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] == "/metrics":
+            await self.app(scope, receive, send)
+            return
+
+        media = _media_for(scope["path"])
+        token = _request_media.set(media)
+        started = time.perf_counter()
+        response = {"status": 500, "started": None, "length": None}
+
+        async def counting_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                BYTES_IN.inc(len(message.get("body", b"")), media=media)
+            return message
+
+        async def timing_send(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["started"] = time.perf_counter()
+                for name, value in message.get("headers", []):
+                    if name.lower() == b"content-length":
+                        response["length"] = int(value)
+            elif message["type"] == "http.response.body":
+                BYTES_OUT.inc(len(message.get("body", b"")), media=media)
+            elif message["type"] == "http.response.pathsend" and response["length"] is not None:
+                # The server sends the file itself, so count its declared length
+                BYTES_OUT.inc(response["length"], media=media)
+            await send(message)
+
+        REQUESTS_IN_FLIGHT.inc(media=media)
+        try:
+            await self.app(scope, counting_receive, timing_send)
+        finally:
+            finished = time.perf_counter()
+            REQUESTS_IN_FLIGHT.dec(media=media)
+            REQUESTS.inc(media=media, status=response["status"])
+            REQUEST_SECONDS.observe(finished - started, media=media)
+            if response["started"] is not None:
+                STAGE_SECONDS.observe(finished - response["started"], media=media, stage="response")
+            _request_media.reset(token)
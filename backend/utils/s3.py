@@ -1,54 +1,113 @@
-import boto3
+import io
+import json
 import os
+import re
+import threading
+import time
 from uuid import uuid4
 from dotenv import load_dotenv
 
+from utils.executors import run_io, submit_io
+from utils.metrics import current_media, record_stage, timed
+from utils.scratch import TEMP_DIR, PENDING_UPLOAD_PREFIX
+
 load_dotenv()
 
 AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID")
 AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
 AWS_S3_BUCKET = os.getenv("AWS_S3_BUCKET_NAME")
 AWS_REGION = os.getenv("AWS_S3_REGION", "us-east-1")
+# Custom endpoint, e.g. a local moto server or MinIO; unset for AWS
+AWS_S3_ENDPOINT_URL = os.getenv("AWS_S3_ENDPOINT_URL")
 
-s3_client = boto3.client(
-    "s3",
-    aws_access_key_id=AWS_ACCESS_KEY_ID,
-    aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-    region_name=AWS_REGION,
-)
-
-def configure_cors():
-    """Configure CORS for the S3 bucket."""
-    cors_configuration = {
-        'CORSRules': [{
-            'AllowedHeaders': ['*'],
-            'AllowedMethods': ['GET', 'PUT', 'POST', 'DELETE', 'HEAD'],
-            'AllowedOrigins': [
-                'https://steganography-frontend.onrender.com',
-                'https://steganography-e1l9.onrender.com',
-                'http://localhost:3000'
-            ],
-            'ExposeHeaders': ['ETag'],
-            'MaxAgeSeconds': 3000
-        }]
-    }
-    
-    try:
-        s3_client.put_bucket_cors(
-            Bucket=AWS_S3_BUCKET,
-            CORSConfiguration=cors_configuration
-        )
-        print(f"CORS configuration updated for bucket: {AWS_S3_BUCKET}")
-        return True
-    except Exception as e:
-        print(f"Error setting CORS configuration: {str(e)}")
-        return False
+# Multipart transfer tuning: files above the threshold are sent in parallel parts
+S3_MULTIPART_THRESHOLD_BYTES = int(os.getenv("S3_MULTIPART_THRESHOLD_MB", "8")) * 1024 * 1024
+S3_MULTIPART_CHUNKSIZE_BYTES = int(os.getenv("S3_MULTIPART_CHUNKSIZE_MB", "8")) * 1024 * 1024
+S3_MAX_CONCURRENCY = int(os.getenv("S3_MAX_CONCURRENCY", "10"))
+
+# HTTP connections kept open by the shared client; enough for every I/O
+# thread to run a multipart upload at full concurrency without waiting
+S3_MAX_POOL_CONNECTIONS = int(os.getenv("S3_MAX_POOL_CONNECTIONS", "50"))
+
+# Return the object URL immediately and finish the upload in the background
+S3_BACKGROUND_UPLOADS = os.getenv("S3_BACKGROUND_UPLOADS", "false").lower() in ("1", "true", "yes")
+# Background upload statuses are JSON files in TEMP_DIR, so any worker process
+# sharing it can answer the status endpoint. A running upload's status is
+# upload-<id>.json, which the sweeper skips like the pending file; when it
+# finishes it moves to finished-upload-<id>.json, which expires through the
+# sweeper's quotas like an artifact.
+FINISHED_UPLOAD_PREFIX = "finished-upload-"
+_UPLOAD_ID = re.compile(r"^[0-9a-f]{32}$")
+
+# The boto3 client and transfer config are created on first use, not at import,
+# so starting a worker costs neither the boto3 import nor a network round trip.
+# Bucket configuration (CORS, public-read policy) is an explicit admin command:
+#     python -m utils.setup_s3_cors
+_client = None
+_transfer_config = None
+_client_lock = threading.Lock()
 
-# Call configure_cors on module import
-try:
-    configure_cors()
-except Exception as e:
-    print(f"Warning: Could not configure CORS for S3 bucket: {str(e)}")
+def get_s3_client():
+    """The process-wide S3 client. boto3 clients are thread-safe, so all I/O threads share it."""
+    global _client, _transfer_config
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                import boto3
+                from boto3.s3.transfer import TransferConfig
+                from botocore.config import Config
+
+                _transfer_config = TransferConfig(
+                    multipart_threshold=S3_MULTIPART_THRESHOLD_BYTES,
+                    multipart_chunksize=S3_MULTIPART_CHUNKSIZE_BYTES,
+                    max_concurrency=S3_MAX_CONCURRENCY,
+                )
+                _client = boto3.client(
+                    "s3",
+                    aws_access_key_id=AWS_ACCESS_KEY_ID,
+                    aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
+                    region_name=AWS_REGION,
+                    endpoint_url=AWS_S3_ENDPOINT_URL,
+                    config=Config(
+                        max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+                        tcp_keepalive=True,
+                        retries={"max_attempts": 3, "mode": "standard"},
+                    ),
+                )
+                print(f"[INFO] Created S3 client (pool size {S3_MAX_POOL_CONNECTIONS})")
+    return _client
+
+def _get_transfer_config():
+    get_s3_client()
+    return _transfer_config
+
+def _content_type(file_ext: str) -> str:
+    if file_ext == ".png" or file_ext == ".jpg" or file_ext == ".jpeg":
+        return "image/png" if file_ext == ".png" else "image/jpeg"
+    elif file_ext == ".wav":
+        return "audio/wav"
+    elif file_ext == ".mp3":
+        return "audio/mpeg"
+    elif file_ext == ".mp4":
+        return "video/mp4"
+    elif file_ext == ".mkv":
+        return "video/x-matroska"
+    return "application/octet-stream"  # Default
+
+def _object_url(object_name: str) -> str:
+    if AWS_S3_ENDPOINT_URL:
+        return f"{AWS_S3_ENDPOINT_URL.rstrip('/')}/{AWS_S3_BUCKET}/{object_name}"
+    return f"https://{AWS_S3_BUCKET}.s3.{AWS_REGION}.amazonaws.com/{object_name}"
+
+def _check_config() -> None:
+    # Validate AWS credentials and bucket name
+    if not AWS_ACCESS_KEY_ID or not AWS_SECRET_ACCESS_KEY or not AWS_S3_BUCKET:
+        error_msg = "Missing AWS credentials or bucket name"
+        print(f"[ERROR] {error_msg}")
+        print(f"[DEBUG] AWS_ACCESS_KEY_ID exists: {bool(AWS_ACCESS_KEY_ID)}")
+        print(f"[DEBUG] AWS_SECRET_ACCESS_KEY exists: {bool(AWS_SECRET_ACCESS_KEY)}")
+        print(f"[DEBUG] AWS_S3_BUCKET exists: {bool(AWS_S3_BUCKET)}")
+        raise ValueError(error_msg)
 
 def upload_file_to_s3(file_path: str, object_name: str = None) -> str:
     """
@@ -79,43 +138,27 @@ def upload_file_to_s3(file_path: str, object_name: str = None) -> str:
         print(f"[INFO] S3 object name: {object_name}")
         print(f"[INFO] S3 bucket: {AWS_S3_BUCKET}")
         
-        # Validate AWS credentials and bucket name
-        if not AWS_ACCESS_KEY_ID or not AWS_SECRET_ACCESS_KEY or not AWS_S3_BUCKET:
-            error_msg = "Missing AWS credentials or bucket name"
-            print(f"[ERROR] {error_msg}")
-            print(f"[DEBUG] AWS_ACCESS_KEY_ID exists: {bool(AWS_ACCESS_KEY_ID)}")
-            print(f"[DEBUG] AWS_SECRET_ACCESS_KEY exists: {bool(AWS_SECRET_ACCESS_KEY)}")
-            print(f"[DEBUG] AWS_S3_BUCKET exists: {bool(AWS_S3_BUCKET)}")
-            raise ValueError(error_msg)
+        _check_config()
             
         # Determine content type based on file extension
-        content_type = "application/octet-stream"  # Default
-        file_ext = os.path.splitext(file_path.lower())[1]
-        
-        if file_ext == ".png" or file_ext == ".jpg" or file_ext == ".jpeg":
-            content_type = "image/png" if file_ext == ".png" else "image/jpeg"
-        elif file_ext == ".wav":
-            content_type = "audio/wav"
-        elif file_ext == ".mp3":
-            content_type = "audio/mpeg"
-        elif file_ext == ".mp4":
-            content_type = "video/mp4"
+        content_type = _content_type(os.path.splitext(file_path.lower())[1])
         
         print(f"[INFO] Content type set to: {content_type}")
         
-        # Upload the file
-        s3_client.upload_file(
+        # Upload the file, in parallel parts above the multipart threshold
+        get_s3_client().upload_file(
             file_path, 
             AWS_S3_BUCKET, 
             object_name, 
             ExtraArgs={
                 "ContentType": content_type,
                 "ACL": "public-read"  # Make the object publicly readable
-            }
+            },
+            Config=_get_transfer_config()
         )
         
         # Generate the URL
-        url = f"https://{AWS_S3_BUCKET}.s3.{AWS_REGION}.amazonaws.com/{object_name}"
+        url = _object_url(object_name)
         print(f"[INFO] Successfully uploaded to S3: {url}")
         
         return url
@@ -132,3 +175,141 @@ def upload_file_to_s3(file_path: str, object_name: str = None) -> str:
         import traceback
         traceback.print_exc()
         raise
+
+
+def upload_bytes_to_s3(data: bytes, file_ext: str, object_name: str = None) -> str:
+    """
+    Upload in-memory content to an S3 bucket without writing it to disk first
+
+    :param data: Content to upload
+    :param file_ext: Extension used for the object name and content type, e.g. ".png"
+    :param object_name: S3 object name. If not specified a random UUID is used
+    :return: Public URL of the uploaded object
+    """
+    try:
+        if object_name is None:
+            object_name = f"stego/{uuid4()}{file_ext or '.bin'}"
+        print(f"[INFO] Uploading {len(data)} bytes from memory to S3 as {object_name}")
+        
+        _check_config()
+        content_type = _content_type(file_ext.lower())
+        
+        # Stream from memory with the same multipart settings as file uploads
+        get_s3_client().upload_fileobj(
+            io.BytesIO(data),
+            AWS_S3_BUCKET,
+            object_name,
+            ExtraArgs={
+                "ContentType": content_type,
+                "ACL": "public-read"  # Make the object publicly readable
+            },
+            Config=_get_transfer_config()
+        )
+        
+        url = _object_url(object_name)
+        print(f"[INFO] Successfully uploaded to S3: {url}")
+        return url
+        
+    except ValueError as e:
+        print(f"[ERROR] Value error: {e}")
+        raise
+    except Exception as e:
+        print(f"[ERROR] S3 upload error: {str(e)}")
+        print(f"[ERROR] Error type: {type(e)}")
+        import traceback
+        traceback.print_exc()
+        raise
+
+
+def _status_path(upload_id: str, finished: bool = False) -> str:
+    prefix = FINISHED_UPLOAD_PREFIX if finished else PENDING_UPLOAD_PREFIX
+    return os.path.join(TEMP_DIR, f"{prefix}{upload_id}.json")
+
+def _write_status(path: str, status: dict) -> None:
+    partial = f"{path}.{os.getpid()}.tmp"
+    with open(partial, "w") as f:
+        json.dump(status, f)
+    os.replace(partial, path)
+
+def _finish_status(upload_id: str, **fields) -> None:
+    pending = _status_path(upload_id)
+    with open(pending, "r") as f:
+        status = json.load(f)
+    status.update(fields)
+    # Written before the pending status goes, so readers always find one of them
+    _write_status(_status_path(upload_id, finished=True), status)
+    os.remove(pending)
+
+def _run_background_upload(upload_id: str, source, object_name: str, file_ext: str, media: str) -> None:
+    started = time.perf_counter()
+    try:
+        if isinstance(source, bytes):
+            upload_bytes_to_s3(source, file_ext, object_name)
+        else:
+            upload_file_to_s3(source, object_name)
+        _finish_status(upload_id, state="complete", finished=time.time())
+        record_stage("s3_upload", time.perf_counter() - started, media)
+    except Exception as e:
+        print(f"[ERROR] Background upload {upload_id} failed: {e}")
+        _finish_status(upload_id, state="failed", error=str(e), finished=time.time())
+    finally:
+        if not isinstance(source, bytes) and os.path.exists(source):
+            os.remove(source)
+
+def start_background_upload(source, file_ext: str = None) -> dict:
+    """
+    Start uploading a file path or bytes in the I/O pool and return at once.
+
+    The object name, and so the URL, is fixed before the upload starts. A file
+    is first moved out of the request's scratch space so it outlives the request.
+
+    :return: Status dict with id, state ("pending", "complete" or "failed") and url
+    """
+    _check_config()
+    if file_ext is None:
+        file_ext = os.path.splitext(source.lower())[1] or ".bin"
+    upload_id = uuid4().hex
+    object_name = f"stego/{upload_id}{file_ext}"
+
+    if not isinstance(source, bytes):
+        # The temp sweeper skips PENDING_UPLOAD_PREFIX entries; the upload thread removes it
+        pending_path = os.path.join(TEMP_DIR, f"{PENDING_UPLOAD_PREFIX}{upload_id}{file_ext}")
+        os.replace(source, pending_path)
+        source = pending_path
+
+    status = {"id": upload_id, "state": "pending", "url": _object_url(object_name), "started": time.time()}
+    _write_status(_status_path(upload_id), status)
+
+    print(f"[INFO] Starting background upload {upload_id} to {object_name}")
+    # The upload thread runs outside the request, so it is given the media label
+    submit_io(_run_background_upload, upload_id, source, object_name, file_ext, current_media())
+    return status
+
+def upload_status(upload_id: str):
+    """Status dict of a background upload, or None if unknown or expired."""
+    if not _UPLOAD_ID.match(upload_id):
+        return None
+    # Pending first: a finishing upload writes its finished status before removing it
+    for finished in (False, True):
+        try:
+            with open(_status_path(upload_id, finished), "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            continue
+    return None
+
+async def upload_output(source, file_ext: str = None) -> dict:
+    """
+    Upload an encoded output (file path, or bytes with file_ext) and return the
+    route's response body. In background mode the body also carries the upload
+    state and a status URL, and the upload may still be running.
+    """
+    if S3_BACKGROUND_UPLOADS:
+        status = start_background_upload(source, file_ext)
+        return {"url": status["url"], "upload": status["state"], "status_url": f"/storage/uploads/{status['id']}"}
+    with timed("s3_upload"):
+        if isinstance(source, bytes):
+            url = await run_io(upload_bytes_to_s3, source, file_ext)
+        else:
+            url = await run_io(upload_file_to_s3, source)
+    return {"url": url}
@@ -0,0 +1,169 @@
+import asyncio
+import os
+import shutil
+import time
+import uuid
+
+from fastapi import Request
+
+from utils.executors import run_io
+
+# Root for per-request scratch directories. Point it at a tmpfs mount
+# (e.g. /dev/shm/stego) to keep intermediate files off the disk.
+TEMP_DIR = os.getenv("STEGO_TEMP_DIR", "temp")
+
+# Sweeper quotas: entries older than TEMP_MAX_AGE_SECONDS are removed, and the
+# oldest entries go first while the directory is over TEMP_MAX_TOTAL_MB
+TEMP_MAX_AGE_SECONDS = int(os.getenv("TEMP_MAX_AGE_SECONDS", "3600"))
+TEMP_MAX_TOTAL_BYTES = int(os.getenv("TEMP_MAX_TOTAL_MB", "2048")) * 1024 * 1024
+TEMP_SWEEP_INTERVAL_SECONDS = int(os.getenv("TEMP_SWEEP_INTERVAL_SECONDS", "60"))
+
+# Directory names of scratch spaces still in use by this process
+_active = set()
+
+# Files awaiting a background S3 upload and their status files (utils/s3.py);
+# the uploader removes them when it finishes, so the sweeper leaves them alone
+PENDING_UPLOAD_PREFIX = "upload-"
+
+
+class Scratch:
+    """
+    A request's scratch directory under TEMP_DIR. The directory is created on
+    first use and removed with everything in it by cleanup().
+    """
+
+    def __init__(self):
+        self.name = uuid.uuid4().hex
+        self.dir = os.path.join(TEMP_DIR, self.name)
+        self._created = False
+        _active.add(self.name)
+
+    def path(self, suffix: str = "") -> str:
+        """Return a new unique file path in the scratch directory."""
+        if not self._created:
+            os.makedirs(self.dir, exist_ok=True)
+            self._created = True
+        return os.path.join(self.dir, f"{uuid.uuid4()}{suffix}")
+
+    def cleanup(self) -> None:
+        if self._created:
+            shutil.rmtree(self.dir, ignore_errors=True)
+            self._created = False
+        _active.discard(self.name)
+
+
+def request_scratch(request: Request) -> Scratch:
+    """
+    Dependency giving a route its own scratch directory. ScratchCleanupMiddleware
+    removes it once the response, including any streamed FileResponse, has been sent.
+    """
+    scratch = Scratch()
+    request.state.scratch_spaces = getattr(request.state, "scratch_spaces", []) + [scratch]
+    return scratch
+
+
+class ScratchCleanupMiddleware:
+    """ASGI middleware that cleans up the request's scratch spaces after the response."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        # request.state reads and writes this dict
+        state = scope.setdefault("state", {})
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            # rmtree of a large output would block the event loop
+            for scratch in state.get("scratch_spaces", []):
+                await run_io(scratch.cleanup)
+
+
+def init_temp_dir() -> None:
+    """Create TEMP_DIR and check once at startup that it is writable."""
+    os.makedirs(TEMP_DIR, exist_ok=True)
+    probe = os.path.join(TEMP_DIR, f".probe_{uuid.uuid4().hex}")
+    try:
+        with open(probe, "w") as f:
+            f.write("test")
+        os.remove(probe)
+    except OSError as perm_error:
+        raise RuntimeError(f"Temp directory {TEMP_DIR} is not writable: {perm_error}")
+    print(f"[INFO] Temp directory {os.path.abspath(TEMP_DIR)} is writable")
+
+
+def _entry_size(path: str) -> int:
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def _remove(path: str) -> None:
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        os.remove(path)
+
+
+def sweep() -> tuple:
+    """
+    Apply the age and size quotas to TEMP_DIR.
+
+    Scratch spaces in use by this process and files awaiting a background
+    upload are never removed. The size quota also skips entries modified
+    within the last sweep interval, which may belong to another worker process.
+    Blocking; sweep_forever runs it in the I/O pool.
+
+    :return: (entries removed, bytes freed)
+    """
+    now = time.time()
+    entries = []
+    with os.scandir(TEMP_DIR) as scan:
+        for entry in scan:
+            if (entry.name in _active or entry.name.startswith(".probe_")
+                    or entry.name.startswith(PENDING_UPLOAD_PREFIX)):
+                continue
+            try:
+                entries.append((entry.stat().st_mtime, _entry_size(entry.path), entry.path))
+            except OSError:
+                continue  # removed while scanning
+
+    removed, freed = 0, 0
+    total = sum(size for _, size, _ in entries)
+    for mtime, size, path in sorted(entries):
+        expired = now - mtime > TEMP_MAX_AGE_SECONDS
+        over_quota = total > TEMP_MAX_TOTAL_BYTES and now - mtime > TEMP_SWEEP_INTERVAL_SECONDS
+        if not (expired or over_quota):
+            continue
+        try:
+            _remove(path)
+        except OSError as remove_error:
+            print(f"[WARNING] Could not remove temp entry {path}: {remove_error}")
+            continue
+        removed += 1
+        freed += size
+        total -= size
+    return removed, freed
+
+
+async def sweep_forever() -> None:
+    """Background task running sweep() every TEMP_SWEEP_INTERVAL_SECONDS."""
+    while True:
+        try:
+            removed, freed = await run_io(sweep)
+            if removed:
+                print(f"[INFO] Temp sweeper removed {removed} entries, {freed} bytes")
+        except Exception as sweep_error:
+            print(f"[WARNING] Temp sweep failed: {sweep_error}")
+        await asyncio.sleep(TEMP_SWEEP_INTERVAL_SECONDS)
@@ -1,25 +1,14 @@
-import boto3
-import os
-from dotenv import load_dotenv
-
-# Load environment variables
-load_dotenv()
-
-AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID")
-AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
-AWS_S3_BUCKET = os.getenv("AWS_S3_BUCKET_NAME")
-AWS_REGION = os.getenv("AWS_S3_REGION", "us-east-1")
+# Admin command: apply CORS and the public-read policy to the bucket.
+# The API server no longer does this at import; run it once per bucket from
+# the backend directory:
+#     python -m utils.setup_s3_cors
+from utils.s3 import get_s3_client, AWS_S3_BUCKET
 
 def setup_s3_cors():
     """
     Set up CORS configuration for the S3 bucket
     """
-    s3_client = boto3.client(
-        "s3",
-        aws_access_key_id=AWS_ACCESS_KEY_ID,
-        aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-        region_name=AWS_REGION,
-    )
+    s3_client = get_s3_client()
     
     # CORS configuration to allow all origins (you can restrict to your specific domains in production)
     cors_configuration = {
@@ -29,6 +18,7 @@ def setup_s3_cors():
             'AllowedOrigins': [
                 'http://localhost:3000',
                 'https://steganography-frontend.onrender.com',
+                'https://steganography-e1l9.onrender.com',
                 # Add any other origins that need to access your S3 bucket
             ],
             'ExposeHeaders': ['ETag', 'x-amz-server-side-encryption'],
@@ -0,0 +1,172 @@
+import hashlib
+import os
+import time
+
+import aiofiles
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers
+
+from utils.metrics import record_stage
+
+# Bytes read from the upload and written to disk per step
+CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+
+# Per-media upload limits in bytes, overridable with MAX_<MEDIA>_UPLOAD_MB
+UPLOAD_LIMITS = {
+    "image": int(os.getenv("MAX_IMAGE_UPLOAD_MB", "50")) * 1024 * 1024,
+    "audio": int(os.getenv("MAX_AUDIO_UPLOAD_MB", "25")) * 1024 * 1024,
+    "video": int(os.getenv("MAX_VIDEO_UPLOAD_MB", "50")) * 1024 * 1024,
+    "file": int(os.getenv("MAX_FILE_UPLOAD_MB", "1024")) * 1024 * 1024,
+}
+
+
+# Room in a request body for the form fields besides the file, e.g. the message
+FORM_FIELDS_MAX_BYTES = int(os.getenv("MAX_FORM_FIELDS_MB", "16")) * 1024 * 1024
+
+# Largest upload each route prefix takes: /image-file/ carries the files to
+# hide (or the image holding them), /capacity any carrier type
+_REQUEST_LIMITS = (
+    ("/encode/", UPLOAD_LIMITS["image"]),
+    ("/decode/", UPLOAD_LIMITS["image"]),
+    ("/image-file/", UPLOAD_LIMITS["image"] + UPLOAD_LIMITS["file"]),
+    ("/audio/", UPLOAD_LIMITS["audio"]),
+    ("/video/", UPLOAD_LIMITS["video"]),
+    ("/capacity", max(UPLOAD_LIMITS["image"], UPLOAD_LIMITS["audio"], UPLOAD_LIMITS["video"])),
+)
+
+# Image and audio uploads up to this size are processed entirely in memory;
+# larger or unsized uploads go through temp files
+IN_MEMORY_MAX_BYTES = int(os.getenv("IN_MEMORY_MAX_MB", "8")) * 1024 * 1024
+
+
+class UploadTooLarge(ValueError):
+    """Raised when an upload exceeds its size limit."""
+
+
+def _too_large(limit: int) -> UploadTooLarge:
+    return UploadTooLarge(f"File too large. Maximum size is {limit // (1024 * 1024)} MB.")
+
+
+async def save_upload(upload: UploadFile, destination: str, max_bytes: int = None) -> tuple:
+    """
+    Stream an uploaded file to disk in CHUNK_SIZE pieces.
+
+    The request body as a whole is limited by RequestSizeLimitMiddleware before
+    it is buffered; this checks the file itself, from its spooled size and again
+    while streaming, so at most one chunk is held in memory. A partially written
+    destination is removed on failure.
+
+    :param upload: The uploaded file
+    :param destination: Path to write to
+    :param max_bytes: Size limit in bytes, or None for no limit
+    :return: (bytes written, SHA-256 hex digest of the content)
+    """
+    if max_bytes is not None and upload.size is not None and upload.size > max_bytes:
+        raise _too_large(max_bytes)
+
+    hasher = hashlib.sha256()
+    written = 0
+    receive_seconds, write_seconds = 0.0, 0.0
+    try:
+        async with aiofiles.open(destination, "wb") as out:
+            while True:
+                started = time.perf_counter()
+                chunk = await upload.read(CHUNK_SIZE)
+                receive_seconds += time.perf_counter() - started
+                if not chunk:
+                    break
+                written += len(chunk)
+                if max_bytes is not None and written > max_bytes:
+                    raise _too_large(max_bytes)
+                hasher.update(chunk)
+                started = time.perf_counter()
+                await out.write(chunk)
+                write_seconds += time.perf_counter() - started
+    except Exception:
+        if os.path.exists(destination):
+            os.remove(destination)
+        raise
+
+    record_stage("upload_receive", receive_seconds)
+    record_stage("disk_write", write_seconds)
+    return written, hasher.hexdigest()
+
+
+def fits_in_memory(upload: UploadFile) -> bool:
+    """Whether an upload is small enough for the in-memory path."""
+    return upload.size is not None and upload.size <= IN_MEMORY_MAX_BYTES
+
+
+async def read_upload(upload: UploadFile, max_bytes: int = None) -> tuple:
+    """
+    Read an uploaded file into memory in CHUNK_SIZE pieces, enforcing the same
+    limits as save_upload.
+
+    :param upload: The uploaded file
+    :param max_bytes: Size limit in bytes, or None for no limit
+    :return: (content bytes, SHA-256 hex digest of the content)
+    """
+    if max_bytes is not None and upload.size is not None and upload.size > max_bytes:
+        raise _too_large(max_bytes)
+
+    hasher = hashlib.sha256()
+    buffer = bytearray()
+    started = time.perf_counter()
+    while True:
+        chunk = await upload.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        if max_bytes is not None and len(buffer) + len(chunk) > max_bytes:
+            raise _too_large(max_bytes)
+        hasher.update(chunk)
+        buffer += chunk
+
+    record_stage("upload_receive", time.perf_counter() - started)
+    return bytes(buffer), hasher.hexdigest()
+
+
+def _request_limit(path: str):
+    for prefix, limit in _REQUEST_LIMITS:
+        if path.startswith(prefix):
+            return limit + FORM_FIELDS_MAX_BYTES
+    return None
+
+
+class RequestSizeLimitMiddleware:
+    """
+    ASGI middleware rejecting an oversized upload with 413 before its body is
+    buffered: from the Content-Length header when there is one, otherwise as
+    soon as the body received exceeds the route's limit.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        limit = _request_limit(scope["path"]) if scope["type"] == "http" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        detail = f"Request too large. Maximum size is {limit // (1024 * 1024)} MB."
+        declared = Headers(scope=scope).get("content-length")
+        if declared is not None and declared.isdigit() and int(declared) > limit:
+            print(f"[WARNING] Rejected {scope['path']}: Content-Length {declared} exceeds {limit} bytes")
+            await JSONResponse(status_code=413, content={"detail": detail})(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # Raised while the form is parsed; FastAPI passes it on as the response
+                    print(f"[WARNING] Rejected {scope['path']}: body exceeds {limit} bytes")
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)